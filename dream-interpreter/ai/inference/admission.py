@@ -0,0 +1,67 @@
+"""
+准入控制
+
+同时处理的请求数 (max_in_flight) 加上允许排队的请求数 (max_queue_depth) 构成服务容量，
+超出容量的请求立即被拒绝，由调用方返回 503 + Retry-After，而不是无限堆积。
+批量解析的条目用 acquire 在限定时间内等待名额，同一批中先提交的条目完成后后面的条目接着进入。
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: Optional[int] = None, max_queue_depth: Optional[int] = None,
+                 retry_after: Optional[int] = None):
+        self.max_in_flight = max_in_flight or int(os.environ.get("MAX_IN_FLIGHT", os.environ.get("MAX_BATCH_SIZE", "8")))
+        self.max_queue_depth = max_queue_depth if max_queue_depth is not None else int(os.environ.get("MAX_QUEUE_DEPTH", "32"))
+        self.retry_after = retry_after or int(os.environ.get("RETRY_AFTER_SECONDS", "5"))
+        self.outstanding = 0
+        self.admitted = 0
+        self.rejected = 0
+        # 名额归还时唤醒等待中的 acquire
+        self._lock = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        return self.max_in_flight + self.max_queue_depth
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.outstanding >= self.capacity:
+                self.rejected += 1
+                return False
+            self.outstanding += 1
+            self.admitted += 1
+            return True
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """等待名额，最多 timeout 秒 (None 表示一直等)；超时仍没有名额时返回 False"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            while self.outstanding >= self.capacity:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    self.rejected += 1
+                    return False
+                self._lock.wait(remaining)
+            self.outstanding += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.outstanding -= 1
+            self._lock.notify()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": min(self.outstanding, self.max_in_flight),
+                "queued": max(0, self.outstanding - self.max_in_flight),
+                "max_in_flight": self.max_in_flight,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
@@ -1,27 +1,80 @@
-from flask import Flask, request, jsonify
-from service import DreamInterpreter
+from flask import Flask, Response, request, jsonify, stream_with_context
+from service import DreamInterpreter, GenerationBudget
+from admission import AdmissionController
+from batch_interpret import run_batch
+from batching import MicroBatcher
+from engine import ContinuousBatchingEngine
+from jobs import JobQueue
+import json
+import math
 import os
 import sys
+import threading
+import time
 
 # Ensure we can import from current directory
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 app = Flask(__name__)
 
-# Lazy loading or global loading? Global is better for responsiveness.
-print("Initializing AI Model...")
-# Initialize interpreter. 
-# Note: In production, this might take time and memory.
+# 模型在后台线程中加载，端口立即可用；加载完成前 /interpret 由规则引擎兜底，并在结果中注明来源
+print("Initializing AI Model in background...")
 try:
-    interpreter = DreamInterpreter()
-    print("AI Model Initialized successfully.")
+    interpreter = DreamInterpreter(load=False)
+    if os.environ.get("BACKGROUND_LOAD", "1") == "0":
+        interpreter.load()
+    else:
+        interpreter.load_in_background()
 except Exception as e:
     print(f"Error initializing AI model: {e}")
     interpreter = None
 
-@app.route('/', methods=['GET'])
-def index():
-    return """
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_batcher():
+    """模型加载结束 (无论成败) 后才创建批处理器；加载期间返回 None"""
+    global _batcher
+    if interpreter is None or not interpreter.loaded.is_set():
+        return None
+    with _batcher_lock:
+        if _batcher is None:
+            # 默认使用连续批处理引擎；BATCHING_MODE=static 时退回按时间窗口合并的静态微批处理。
+            # 编译解码步依赖 generate 的静态KV缓存，引擎自己的变长解码循环会反复触发重新编译，因此也走静态批处理
+            # 投机解码只支持单条序列，逐条处理
+            if interpreter.speculative is not None:
+                _batcher = MicroBatcher(interpreter, max_batch_size=1)
+            elif os.environ.get("BATCHING_MODE", "continuous") == "static" or not interpreter.use_llm or interpreter.compiled:
+                _batcher = MicroBatcher(interpreter)
+            else:
+                _batcher = ContinuousBatchingEngine(interpreter)
+    return _batcher
+
+# 限制同时处理和排队的请求数，超出容量时立即返回 503 + Retry-After
+admission = AdmissionController()
+
+def _run_job(text, params):
+    """异步任务在任务线程中等待模型加载结束，再按提交时的参数解析"""
+    interpreter.loaded.wait()
+    return get_batcher().interpret_detailed(text, GenerationBudget.from_request(params))
+
+# 异步任务队列：持久化在 SQLite 中，重启后继续处理未完成的任务。
+# 任务线程只在真正处理请求的进程里启动 (第一次请求时，或由 prefork worker 启动时显式调用)，
+# 不在导入时启动：prefork 的父进程导入 app 后只负责 fork，不能带着正在运行的任务线程和引擎锁进入 fork
+jobs = JobQueue(_run_job) if interpreter is not None else None
+
+def start_jobs():
+    if jobs is not None:
+        jobs.start()
+
+# 多轮会话按需开启：请求带 session_id (追问) 或 follow_up=true (开启新会话) 时才使用会话；
+# SESSIONS=1 时每次解析都开启会话。普通的一次性解析不占用会话 KV，继续走结果缓存、前缀KV缓存和批处理
+SESSIONS_ENABLED = os.environ.get('SESSIONS', '0') == '1'
+
+def _wants_session(data):
+    return bool(SESSIONS_ENABLED or data.get('session_id') or data.get('follow_up'))
+
+INDEX_HTML = """
 <!DOCTYPE html>
 <html lang="zh-CN">
 <head>
@@ -111,7 +164,7 @@ def index():
             resultEl.textContent = '';
 
             try {
-                const response = await fetch('/interpret', {
+                const response = await fetch('/interpret/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json'
@@ -119,14 +172,44 @@ def index():
                     body: JSON.stringify({ text })
                 });
 
-                const data = await response.json();
-
-                if (response.ok && data.interpretation) {
-                    statusEl.textContent = '✅ 解析完成';
-                    resultEl.textContent = data.interpretation;
-                } else {
+                if (!response.ok) {
+                    const data = await response.json();
                     statusEl.textContent = '❌ 解析失败';
                     resultEl.textContent = data.error || '未知错误';
+                    return;
+                }
+
+                // 按 Server-Sent Events 格式逐段读取：event 行 + data 行，空行分隔
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    let sep;
+                    while ((sep = buffer.indexOf('\\n\\n')) !== -1) {
+                        const frame = buffer.slice(0, sep);
+                        buffer = buffer.slice(sep + 2);
+                        let event = 'message';
+                        let payload = '';
+                        for (const line of frame.split('\\n')) {
+                            if (line.startsWith('event: ')) event = line.slice(7);
+                            else if (line.startsWith('data: ')) payload += line.slice(6);
+                        }
+                        const data = JSON.parse(payload);
+                        if (event === 'token') {
+                            if (!resultEl.textContent) statusEl.textContent = '✍️ 正在生成…';
+                            resultEl.textContent += data.text;
+                        } else if (event === 'done') {
+                            statusEl.textContent = data.notice ? '⏳ ' + data.notice : data.ttft_ms !== undefined
+                                ? `✅ 解析完成 (首字 ${data.ttft_ms} ms，平均每token ${data.itl_ms_mean || 0} ms)`
+                                : '✅ 解析完成';
+                        } else if (event === 'error') {
+                            statusEl.textContent = '❌ 解析失败';
+                            resultEl.textContent += '\\n' + data.error;
+                        }
+                    }
                 }
             } catch (e) {
                 statusEl.textContent = '❌ 请求失败，请确认 AI 服务正在运行';
@@ -140,9 +223,71 @@ def index():
 </html>
     """
 
+@app.before_request
+def _ensure_jobs_started():
+    start_jobs()
+
+@app.route('/', methods=['GET'])
+def index():
+    return INDEX_HTML
+
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'ok', 'model_loaded': interpreter is not None})
+    return jsonify({
+        'status': 'ok',
+        'model_loaded': interpreter is not None and interpreter.ready,
+        'loading': interpreter.loading_status() if interpreter else None,
+    })
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """存活探针：进程能响应即可，模型加载期间也返回 200"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """就绪探针：只有大模型加载完成才返回 200，加载中或加载失败返回 503"""
+    ready = interpreter is not None and interpreter.ready
+    body = {'ready': ready, 'loading': interpreter.loading_status() if interpreter else None}
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if not interpreter:
+        return jsonify({'error': 'AI Model not initialized'}), 503
+    return jsonify(interpreter.result_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """提前结束次数与节省的token、引擎解码统计和准入状态"""
+    if not interpreter:
+        return jsonify({'error': 'AI Model not initialized'}), 503
+    batcher = get_batcher()
+    return jsonify({
+        'early_stopping': interpreter.stopping_stats.snapshot(),
+        'sessions': interpreter.sessions.stats(),
+        'jobs': jobs.stats(),
+        'engine': getattr(batcher, 'stats', None),
+        'admission': admission.stats(),
+    })
+
+def _overloaded():
+    response = jsonify({'error': 'Server busy, please retry later', 'admission': admission.stats()})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(admission.retry_after)
+    return response
+
+def _acquire_session(data):
+    """返回 (会话, 错误响应)；只带 follow_up 时新建会话，大模型不可用时不使用会话"""
+    session_id = data.get('session_id')
+    if not interpreter.use_llm or not _wants_session(data):
+        return None, None
+    try:
+        return interpreter.sessions.acquire(session_id), None
+    except KeyError:
+        return None, (jsonify({'error': 'Unknown or expired session', 'session_id': session_id}), 404)
+    except RuntimeError as e:
+        return None, (jsonify({'error': str(e), 'session_id': session_id}), 409)
 
 @app.route('/interpret', methods=['POST'])
 def interpret():
@@ -153,13 +298,162 @@ def interpret():
     text = data.get('text', '')
     if not text:
         return jsonify({'error': 'No text provided'}), 400
+    try:
+        budget = GenerationBudget.from_request(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid generation budget: {e}'}), 400
+    batcher = get_batcher()
+    if batcher is None:
+        # 模型仍在加载，规则引擎的结果很便宜，不占用推理名额
+        return jsonify(interpreter.fallback_result(text))
+    session, error = _acquire_session(data)
+    if error is not None:
+        return error
+    if not admission.try_acquire():
+        interpreter.sessions.release(session)
+        return _overloaded()
     
     try:
-        result = interpreter.interpret(text)
-        return jsonify({'interpretation': result})
+        return jsonify(batcher.interpret_detailed(text, budget, session=session))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        interpreter.sessions.release(session)
+        admission.release()
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """提交异步解析任务，立即返回 202 和任务 ID；参数与 /interpret 相同 (不支持 session_id)"""
+    if not jobs:
+        return jsonify({'error': 'AI Model not initialized'}), 503
+
+    data = request.json
+    text = data.get('text', '')
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    try:
+        GenerationBudget.from_request(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid generation budget: {e}'}), 400
+    params = {key: value for key, value in data.items() if key != 'text'}
+    return jsonify(jobs.submit(text, params)), 202
+
+JOB_MAX_WAIT = float(os.environ.get('JOB_MAX_WAIT', '60'))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态；?wait=秒数 时在服务端最多等待这么久 (上限 JOB_MAX_WAIT)，任务结束即返回"""
+    if not jobs:
+        return jsonify({'error': 'AI Model not initialized'}), 503
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    # nan 能绕过上下限的截断，inf 同样不是合法的等待时长
+    if not math.isfinite(wait):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait = min(max(wait, 0.0), JOB_MAX_WAIT)
+    job = jobs.wait(job_id, wait) if wait else jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'job_id': job_id}), 404
+    return jsonify(job)
+
+@app.route('/interpret/batch', methods=['POST'])
+def interpret_batch():
+    """一次提交多条梦境：{"items": [{"text": ..., "max_new_tokens": ...}, ...]}，顶层参数作为各条的默认值"""
+    if not interpreter:
+        return jsonify({'error': 'AI Model not initialized'}), 503
+    # 每条需要生成的梦境各占一个准入名额；模型加载中时规则引擎兜底，不占名额
+    try:
+        result = run_batch(interpreter, get_batcher(), request.json, admission)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    if result['batch']['rejected'] and not result['batch']['generated']:
+        return _overloaded()
+    return jsonify(result)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_events(text, budget=None, fallback=False, session=None, cancel=None):
+    """产出 SSE 帧：若干 token 事件，最后是 done 或 error；fallback=True 时直接使用规则引擎
+    cancel (threading.Event) 置位时引擎停止为这条请求解码"""
+    batcher = None if fallback else get_batcher()
+    if batcher is None or not hasattr(batcher, 'stream'):
+        # 模型加载中或静态批处理模式下无法逐token推送，整段结果作为一次事件返回
+        start_time = time.time()
+        try:
+            result = batcher.interpret_detailed(text, budget, session=session) if batcher else interpreter.fallback_result(text)
+        except Exception as e:
+            yield _sse('error', {'error': str(e)})
+            return
+        if result.get('reasoning'):
+            yield _sse('reasoning', {'text': result['reasoning']})
+        yield _sse('token', {'text': result['interpretation']})
+        done = {
+            'total_ms': round((time.time() - start_time) * 1000, 1),
+            'truncated': result['truncated'],
+            'finish_reason': result['finish_reason'],
+        }
+        if 'notice' in result:
+            done.update(fallback=True, notice=result['notice'])
+        if 'session_id' in result:
+            done.update(session_id=result['session_id'], session_turn=result['session_turn'])
+        yield _sse('done', done)
+        return
+    events = batcher.stream(text, budget, session=session, cancel=cancel)
+    try:
+        for kind, payload in events:
+            if kind in ('token', 'reasoning'):
+                yield _sse(kind, {'text': payload})
+            elif kind == 'done':
+                yield _sse('done', payload)
+            else:
+                yield _sse('error', {'error': payload})
+    finally:
+        # 客户端断开时生成器被关闭，连带取消引擎中的请求
+        events.close()
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/interpret/stream', methods=['POST'])
+def interpret_stream():
+    """以 Server-Sent Events 推送增量文本，结束时附带首token延迟和token间延迟"""
+    if not interpreter:
+        return jsonify({'error': 'AI Model not initialized'}), 503
+
+    data = request.json
+    text = data.get('text', '')
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    try:
+        budget = GenerationBudget.from_request(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid generation budget: {e}'}), 400
+    if get_batcher() is None:
+        return Response(stream_events(text, budget, fallback=True), mimetype='text/event-stream', headers=SSE_HEADERS)
+    session, error = _acquire_session(data)
+    if error is not None:
+        return error
+    if not admission.try_acquire():
+        interpreter.sessions.release(session)
+        return _overloaded()
+
+    cancel = threading.Event()
+    response = Response(
+        stream_with_context(stream_events(text, budget, session=session, cancel=cancel)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS,
+    )
+    # 流结束或客户端断开时才释放名额和会话；断开时同时取消引擎中的请求，名额与实际解码量保持一致
+    response.call_on_close(cancel.set)
+    response.call_on_close(admission.release)
+    response.call_on_close(lambda: interpreter.sessions.release(session))
+    return response
 
 if __name__ == '__main__':
+    start_jobs()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,238 @@
+"""
+异步 (ASGI) 服务模式
+
+与 app.py 提供相同的 /、/health (及 /health/live、/health/ready)、/interpret、/interpret/stream、/interpret/batch 和 /jobs 路由，
+推理在有界线程池中执行，不阻塞事件循环；超出容量的请求立即得到 503 + Retry-After。
+
+启动方式:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+或:
+    python asgi_app.py
+"""
+import asyncio
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from batch_interpret import run_batch
+from service import GenerationBudget
+from app import (
+    INDEX_HTML, JOB_MAX_WAIT, SSE_HEADERS, _wants_session, admission, get_batcher, interpreter, jobs, start_jobs, stream_events,
+)
+
+# 推理线程数与同时处理的请求数一致，排队由准入控制负责限制
+executor = ThreadPoolExecutor(max_workers=admission.max_in_flight, thread_name_prefix="inference")
+
+
+def _overloaded() -> JSONResponse:
+    return JSONResponse(
+        {"error": "Server busy, please retry later", "admission": admission.stats()},
+        status_code=503,
+        headers={"Retry-After": str(admission.retry_after)},
+    )
+
+
+async def _read_request(request: Request):
+    """返回 (text, budget, 会话, 错误响应)；会话已标记为进行中，处理结束后需要释放"""
+    data = await request.json()
+    text = data.get("text", "")
+    if not text:
+        return None, None, None, JSONResponse({"error": "No text provided"}, status_code=400)
+    try:
+        budget = GenerationBudget.from_request(data)
+    except (TypeError, ValueError) as e:
+        return None, None, None, JSONResponse({"error": f"Invalid generation budget: {e}"}, status_code=400)
+    session_id = data.get("session_id")
+    if not interpreter.use_llm or not _wants_session(data):
+        return text, budget, None, None
+    try:
+        return text, budget, interpreter.sessions.acquire(session_id), None
+    except KeyError:
+        error = JSONResponse({"error": "Unknown or expired session", "session_id": session_id}, status_code=404)
+    except RuntimeError as e:
+        error = JSONResponse({"error": str(e), "session_id": session_id}, status_code=409)
+    return None, None, None, error
+
+
+async def index(request: Request):
+    return HTMLResponse(INDEX_HTML)
+
+
+async def health(request: Request):
+    return JSONResponse({
+        "status": "ok",
+        "model_loaded": interpreter is not None and interpreter.ready,
+        "loading": interpreter.loading_status() if interpreter else None,
+        "admission": admission.stats(),
+    })
+
+
+async def health_live(request: Request):
+    return JSONResponse({"status": "alive"})
+
+
+async def health_ready(request: Request):
+    ready = interpreter is not None and interpreter.ready
+    body = {"ready": ready, "loading": interpreter.loading_status() if interpreter else None}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+async def metrics(request: Request):
+    if not interpreter:
+        return JSONResponse({"error": "AI Model not initialized"}, status_code=503)
+    return JSONResponse({
+        "early_stopping": interpreter.stopping_stats.snapshot(),
+        "sessions": interpreter.sessions.stats(),
+        "jobs": jobs.stats(),
+        "engine": getattr(get_batcher(), "stats", None),
+        "admission": admission.stats(),
+    })
+
+
+async def interpret(request: Request):
+    if not interpreter:
+        return JSONResponse({"error": "AI Model not initialized"}, status_code=503)
+
+    text, budget, session, error = await _read_request(request)
+    if error is not None:
+        return error
+    batcher = get_batcher()
+    if batcher is None:
+        interpreter.sessions.release(session)
+        return JSONResponse(interpreter.fallback_result(text))
+    if not admission.try_acquire():
+        interpreter.sessions.release(session)
+        return _overloaded()
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(
+            executor, lambda: batcher.interpret_detailed(text, budget, session=session)
+        )
+        return JSONResponse(result)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        interpreter.sessions.release(session)
+        admission.release()
+
+
+async def interpret_batch(request: Request):
+    if not interpreter:
+        return JSONResponse({"error": "AI Model not initialized"}, status_code=503)
+    data = await request.json()
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, run_batch, interpreter, get_batcher(), data, admission
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if result["batch"]["rejected"] and not result["batch"]["generated"]:
+        return _overloaded()
+    return JSONResponse(result)
+
+
+async def interpret_stream(request: Request):
+    if not interpreter:
+        return JSONResponse({"error": "AI Model not initialized"}, status_code=503)
+
+    text, budget, session, error = await _read_request(request)
+    if error is not None:
+        return error
+    if get_batcher() is None:
+        interpreter.sessions.release(session)
+        frames = list(stream_events(text, budget, fallback=True))
+        return StreamingResponse(iter(frames), media_type="text/event-stream", headers=SSE_HEADERS)
+    if not admission.try_acquire():
+        interpreter.sessions.release(session)
+        return _overloaded()
+
+    cancel = threading.Event()
+
+    async def events():
+        frames = stream_events(text, budget, session=session, cancel=cancel)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # 每取一帧都可能阻塞在引擎队列上，放到线程池里等待
+                frame = await loop.run_in_executor(executor, next, frames, None)
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            # 客户端断开时线程池里的 next() 可能还在等待下一帧，直接置位取消标志，不依赖生成器关闭
+            cancel.set()
+            admission.release()
+            interpreter.sessions.release(session)
+            try:
+                frames.close()
+            except ValueError:
+                # 客户端断开时线程池里可能仍有一次 next() 在执行，生成器结束后自行回收
+                pass
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def create_job(request: Request):
+    if not jobs:
+        return JSONResponse({"error": "AI Model not initialized"}, status_code=503)
+    data = await request.json()
+    text = data.get("text", "")
+    if not text:
+        return JSONResponse({"error": "No text provided"}, status_code=400)
+    try:
+        GenerationBudget.from_request(data)
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": f"Invalid generation budget: {e}"}, status_code=400)
+    params = {key: value for key, value in data.items() if key != "text"}
+    return JSONResponse(jobs.submit(text, params), status_code=202)
+
+
+async def get_job(request: Request):
+    if not jobs:
+        return JSONResponse({"error": "AI Model not initialized"}, status_code=503)
+    job_id = request.path_params["job_id"]
+    try:
+        wait = float(request.query_params.get("wait", 0))
+    except ValueError:
+        wait = math.nan
+    # nan 能绕过上下限的截断，inf 同样不是合法的等待时长
+    if not math.isfinite(wait):
+        return JSONResponse({"error": "wait must be a number of seconds"}, status_code=400)
+    wait = min(max(wait, 0.0), JOB_MAX_WAIT)
+    if wait:
+        # 等待期间不占用推理线程池
+        job = await asyncio.get_running_loop().run_in_executor(None, jobs.wait, job_id, wait)
+    else:
+        job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job", "job_id": job_id}, status_code=404)
+    return JSONResponse(job)
+
+
+app = Starlette(routes=[
+    Route("/", index, methods=["GET"]),
+    Route("/health", health, methods=["GET"]),
+    Route("/health/live", health_live, methods=["GET"]),
+    Route("/health/ready", health_ready, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/interpret", interpret, methods=["POST"]),
+    Route("/interpret/stream", interpret_stream, methods=["POST"]),
+    Route("/interpret/batch", interpret_batch, methods=["POST"]),
+    Route("/jobs", create_job, methods=["POST"]),
+    Route("/jobs/{job_id}", get_job, methods=["GET"]),
+], on_startup=[start_jobs])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
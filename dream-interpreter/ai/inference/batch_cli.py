@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+离线批量解析：流式读取 JSONL / CSV 梦境语料，按 token 长度分桶后批量生成，逐批写出结果
+
+- 每次只读入一个窗口 (--window 条) 的记录，窗口内按提示 token 数排序再切成批，长度相近的梦境一起生成，减少填充；
+  内存占用与输入文件大小无关。
+- 每处理完一个窗口，把结果刷到输出文件，并在检查点文件中记录输入的字节偏移和输出文件的长度。
+  任务被中断后用同样的参数重新运行，会截掉输出中最后一个窗口的不完整结果，从检查点的偏移继续。
+- 按读取的字节数估算进度，定期打印 records/s 与预计剩余时间。
+- 无法解析的记录 (非法 JSON、非 UTF-8 字节) 作为错误行写出，不会中断任务，续跑时也不会卡在同一行。
+
+用法:
+    python batch_cli.py dreams.jsonl -o results.jsonl
+    python batch_cli.py dreams.csv -o results.jsonl --text-field content --id-field dream_id --max-new-tokens 300
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _binary_lines(f, offset_box: List[int], errors: List[str]) -> Iterator[str]:
+    """逐行读取二进制文件并解码，offset_box[0] 始终是已经读过的字节数；解码失败的行记入 errors"""
+    for raw in f:
+        offset_box[0] += len(raw)
+        try:
+            yield raw.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # 坏字节替换后照常交给解析器 (CSV 的引号状态不被打乱)，对应的记录作为错误行输出
+            errors.append(f"invalid UTF-8 at byte {offset_box[0] - len(raw) + e.start}")
+            yield raw.decode("utf-8", errors="replace")
+
+
+def read_records(path: str, offset: int = 0) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """产出 (该记录结束处的字节偏移, 记录, 解析错误)；从 offset 开始读 (必须是某条记录的结束位置)
+    无法解析的记录为 None，错误写在第三项"""
+    is_csv = path.lower().endswith(".csv")
+    with open(path, "rb") as f:
+        header = None
+        if is_csv:
+            # 表头总是从文件开头读取，续跑时再跳到检查点的偏移
+            header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+            offset = max(offset, f.tell())
+        f.seek(offset)
+        offset_box = [offset]
+        errors: List[str] = []
+        lines = _binary_lines(f, offset_box, errors)
+        if is_csv:
+            # csv.reader 按需拉取行，带引号的多行字段也能正确计算偏移
+            for row in csv.reader(lines):
+                if errors:
+                    yield offset_box[0], None, errors[0]
+                    errors.clear()
+                elif row:
+                    yield offset_box[0], dict(zip(header, row)), None
+        else:
+            for line in lines:
+                line = line.strip()
+                if errors:
+                    yield offset_box[0], None, errors[0]
+                    errors.clear()
+                    continue
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield offset_box[0], None, f"invalid JSON: {e}"
+                    continue
+                if isinstance(record, dict):
+                    yield offset_box[0], record, None
+                else:
+                    yield offset_box[0], None, "record must be a JSON object"
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"input_offset": 0, "output_bytes": 0, "records": 0}
+
+    def save(self, state: Dict):
+        # 先写临时文件再替换，中断时检查点不会是半截内容
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class Progress:
+    def __init__(self, total_bytes: int, start_offset: int, start_records: int, interval: float = 10.0):
+        self.total_bytes = total_bytes
+        self.start_offset = start_offset
+        self.start_records = start_records
+        self.interval = interval
+        self.start_time = time.time()
+        self._last_report = 0.0
+
+    def report(self, offset: int, records: int, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        elapsed = max(now - self.start_time, 1e-6)
+        rate = (records - self.start_records) / elapsed
+        byte_rate = (offset - self.start_offset) / elapsed
+        percent = offset / self.total_bytes * 100 if self.total_bytes else 100.0
+        eta = (self.total_bytes - offset) / byte_rate if byte_rate > 0 else float("inf")
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        print(f"📈 {records} 条 ({percent:.1f}%), {rate:.2f} records/s, 预计剩余 {eta_text}")
+
+
+def bucketed_batches(window: List[Tuple[int, Dict]], lengths: List[int], batch_size: int) -> List[List[int]]:
+    """窗口内按 token 长度排序后切成批，返回每批在窗口中的下标"""
+    order = sorted(range(len(window)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def process(args) -> int:
+    from service import DreamInterpreter, GenerationBudget
+
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".ckpt")
+    state = checkpoint.load() if not args.restart else {"input_offset": 0, "output_bytes": 0, "records": 0}
+    if state["input_offset"]:
+        print(f"♻️ 从检查点继续: 已完成 {state['records']} 条, 输入偏移 {state['input_offset']} 字节")
+
+    interpreter = DreamInterpreter(verbose=False)
+    if not interpreter.use_llm:
+        print("⚠️ 大模型不可用，结果将来自规则引擎")
+    budget_params = {"max_new_tokens": args.max_new_tokens, "greedy": not args.sample}
+    batch_size = args.batch_size or int(os.environ.get("MAX_BATCH_SIZE", "8"))
+
+    # 截掉上次中断时最后一个窗口里已经写出、但还没记入检查点的结果
+    with open(args.output, "ab") as out:
+        out.truncate(state["output_bytes"])
+
+    progress = Progress(os.path.getsize(args.input), state["input_offset"], state["records"])
+    records = state["records"]
+    failed = 0
+    with open(args.output, "a", encoding="utf-8") as out:
+        source = read_records(args.input, state["input_offset"])
+        while True:
+            window = [item for _, item in zip(range(args.window), source)]
+            if not window:
+                break
+            texts = [str(record.get(args.text_field) or "") if record is not None else "" for _, record, _ in window]
+            lengths = [len(interpreter.tokenizer(text).input_ids) if interpreter.tokenizer else len(text) for text in texts]
+            for batch in bucketed_batches(window, lengths, batch_size):
+                runnable = [i for i in batch if texts[i]]
+                results = {}
+                if runnable:
+                    # 每批新建预算，截止时间 (若有) 从这一批开始计算
+                    budget = GenerationBudget(**budget_params)
+                    try:
+                        outputs = interpreter.interpret_batch_detailed([texts[i] for i in runnable], budget)
+                        results = dict(zip(runnable, outputs))
+                    except Exception as e:
+                        results = {i: {"error": str(e)} for i in runnable}
+                for i in batch:
+                    _, record, error = window[i]
+                    result = results.get(i, {"error": error or f"missing field {args.text_field!r}"})
+                    failed += "error" in result
+                    record_id = record.get(args.id_field) if record is not None else None
+                    out.write(json.dumps(
+                        dict(result, id=record_id, record=records + i, text_tokens=lengths[i]),
+                        ensure_ascii=False,
+                    ) + "\n")
+                out.flush()
+            records += len(window)
+            offset = window[-1][0]
+            os.fsync(out.fileno())
+            checkpoint.save({"input_offset": offset, "output_bytes": out.tell(), "records": records})
+            progress.report(offset, records)
+            if len(window) < args.window:
+                break
+    progress.report(progress.total_bytes, records, force=True)
+    print(f"✅ 完成: 共 {records} 条 (本次失败 {failed} 条), 结果写入 {args.output}")
+    return 0 if not failed else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量梦境解析 (JSONL/CSV，可断点续跑)")
+    parser.add_argument("input", help="输入文件，.jsonl 或 .csv")
+    parser.add_argument("-o", "--output", required=True, help="输出 JSONL 文件")
+    parser.add_argument("--checkpoint", help="检查点文件 (默认: <output>.ckpt)")
+    parser.add_argument("--text-field", default="text", help="梦境文本字段 (默认: text)")
+    parser.add_argument("--id-field", default="id", help="记录 ID 字段，原样写入结果 (默认: id)")
+    parser.add_argument("--batch-size", type=int, help="每批条数 (默认: MAX_BATCH_SIZE 或 8)")
+    parser.add_argument("--window", type=int, default=256, help="每次读入并按长度分桶的记录数 (默认: 256)")
+    parser.add_argument("--max-new-tokens", type=int, help="每条的最大生成 token 数")
+    parser.add_argument("--sample", action="store_true", help="使用采样解码 (默认贪心)")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点，从头开始")
+    args = parser.parse_args()
+    sys.exit(process(args))
+
+
+if __name__ == "__main__":
+    main()
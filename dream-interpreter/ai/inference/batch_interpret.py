@@ -0,0 +1,133 @@
+"""
+批量解析 (POST /interpret/batch)
+
+一次请求提交多条梦境，每条可以带自己的生成参数 (与 /interpret 相同，顶层的参数作为默认值)。
+合法的条目按梦境长度从短到长提交给批处理器，长度相近的梦境进入同一批，减少左填充；
+结果按输入顺序返回，每条带各自的计时或错误信息，另外给出整批的吞吐量。
+需要生成的每一条各占一个准入名额，生成结束即归还；服务满载时条目最多等待 BATCH_ADMISSION_WAIT_S 秒，
+仍没有名额的条目以 busy 错误返回，不进入批处理器。
+"""
+import os
+import time
+from typing import Dict, List, Optional
+
+from service import GenerationBudget
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "64"))
+BATCH_ADMISSION_WAIT_S = float(os.environ.get("BATCH_ADMISSION_WAIT_S", "30"))
+
+
+def parse_items(data: Dict) -> List[Dict]:
+    """items 可以是字符串 (只有梦境文本) 或带 text 与生成参数的对象；请求体也可以直接是 items 数组"""
+    if isinstance(data, list):
+        data = {"items": data}
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"at most {BATCH_MAX_ITEMS} items per batch")
+    defaults = {key: value for key, value in data.items() if key != "items"}
+    parsed = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"text": item}
+        parsed.append(dict(defaults, **item) if isinstance(item, dict) else {"invalid": item})
+    return parsed
+
+
+class _Pending:
+    def __init__(self, index: int, text: str, budget: GenerationBudget, length: int):
+        self.index = index
+        self.text = text
+        self.budget = budget
+        self.length = length
+        self.future = None
+        self.request = None
+        self.finished_at: Optional[float] = None
+
+
+def run_batch(interpreter, batcher, data: Dict, admission=None) -> Dict:
+    """执行一批解析；条目本身的错误写在对应结果里，不影响其他条目"""
+    start_time = time.time()
+    items = parse_items(data)
+    results: List[Optional[Dict]] = [None] * len(items)
+    pending: List[_Pending] = []
+
+    for index, item in enumerate(items):
+        text = item.get("text")
+        if not isinstance(text, str) or not text:
+            results[index] = {"index": index, "status": "error", "error": "No text provided"}
+            continue
+        try:
+            budget = GenerationBudget.from_request(item)
+        except (TypeError, ValueError) as e:
+            results[index] = {"index": index, "status": "error", "error": f"Invalid generation budget: {e}"}
+            continue
+        if batcher is None or not interpreter.use_llm:
+            results[index] = dict(interpreter.fallback_result(text), index=index, status="ok")
+            continue
+        if budget.greedy:
+            cached = interpreter.result_cache.get(interpreter.result_cache_key(text, budget))
+            if cached is not None:
+                result = interpreter.shape_reasoning(
+                    {"interpretation": cached, "truncated": False, "finish_reason": "cached"}, budget
+                )
+                results[index] = dict(result, index=index, status="ok", timings={"total_ms": 0.0})
+                continue
+        # 分词器不能在多个请求线程里并发使用，用字符数近似提示长度
+        pending.append(_Pending(index, text, budget, len(text)))
+
+    # 短的先提交：连续批处理引擎按提交顺序填满槽位，静态微批处理在同一时间窗口内凑批
+    pending.sort(key=lambda p: p.length)
+    rejected: List[_Pending] = []
+    for entry in pending:
+        # 条目数可以超过准入容量：等同一批中先提交的条目完成、归还名额后再提交
+        if admission is not None and not admission.acquire(timeout=BATCH_ADMISSION_WAIT_S):
+            results[entry.index] = {"index": entry.index, "status": "error", "error": "Server busy, please retry later"}
+            rejected.append(entry)
+            continue
+        try:
+            submitted = batcher.submit(entry.text, entry.budget)
+        except Exception:
+            if admission is not None:
+                admission.release()
+            raise
+        # 连续批处理引擎返回请求对象 (带逐 token 计时)，静态微批处理直接返回 Future
+        entry.request = submitted if hasattr(submitted, "future") else None
+        entry.future = submitted.future if entry.request is not None else submitted
+        entry.future.add_done_callback(lambda _, entry=entry: setattr(entry, "finished_at", time.time()))
+        if admission is not None:
+            entry.future.add_done_callback(lambda _: admission.release())
+    pending = [entry for entry in pending if entry.future is not None]
+
+    generated_tokens = 0
+    for entry in pending:
+        try:
+            result = entry.future.result()
+        except Exception as e:
+            results[entry.index] = {"index": entry.index, "status": "error", "error": str(e)}
+            continue
+        if entry.request is not None:
+            timings = entry.request.timings()
+        else:
+            timings = {"total_ms": round(((entry.finished_at or time.time()) - start_time) * 1000, 1)}
+        timings["text_length"] = entry.length
+        generated_tokens += result.get("generated_tokens", 0)
+        results[entry.index] = dict(result, index=entry.index, status="ok", timings=timings)
+
+    elapsed = time.time() - start_time
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    return {
+        "results": results,
+        "batch": {
+            "items": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "generated": len(pending),
+            "rejected": len(rejected),
+            "total_ms": round(elapsed * 1000, 1),
+            "generated_tokens": generated_tokens,
+            "tokens_per_second": round(generated_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+            "dreams_per_second": round(len(items) / elapsed, 3) if elapsed > 0 else 0.0,
+        },
+    }
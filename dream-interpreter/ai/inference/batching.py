@@ -0,0 +1,116 @@
+"""
+动态微批处理调度器
+
+把并发到达的 /interpret 请求在一个很短的时间窗口内收集起来，
+合并成一次左填充的 generate，再把各自的解码结果交还给调用方。
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from itertools import groupby
+from typing import Dict, List, NamedTuple, Optional
+
+from service import GenerationBudget
+from sessions import Session
+
+
+class MicroBatcher:
+    def __init__(self, interpreter, max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None):
+        self.interpreter = interpreter
+        self.max_batch_size = max_batch_size or int(os.environ.get("MAX_BATCH_SIZE", "8"))
+        self.max_wait_ms = max_wait_ms if max_wait_ms is not None else float(os.environ.get("BATCH_WAIT_MS", "20"))
+        self._queue = queue.Queue()
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, text: str, budget: Optional[GenerationBudget] = None) -> Future:
+        """提交一条梦境，返回在批处理完成后得到结果的 Future"""
+        return self._enqueue(text, budget or GenerationBudget())
+
+    def _enqueue(self, text: str, budget: GenerationBudget, session: Optional[Session] = None,
+                 single: bool = False) -> Future:
+        # single: 在工作线程中单条解码 (贪心请求使用结果缓存、会话轮次复用自己的 KV cache)，不与其他请求合批
+        future = Future()
+        self._ensure_worker()
+        self._queue.put(_Item(text, budget, future, session, single))
+        return future
+
+    def _ensure_worker(self):
+        # 线程不会被 fork 出的子进程继承，按进程在第一次提交时启动
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid != os.getpid():
+                threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+                self._worker_pid = os.getpid()
+
+    def interpret(self, text: str, budget: Optional[GenerationBudget] = None, timeout: Optional[float] = None) -> str:
+        return self.interpret_detailed(text, budget, timeout)["interpretation"]
+
+    def interpret_detailed(self, text: str, budget: Optional[GenerationBudget] = None,
+                           timeout: Optional[float] = None, session: Optional[Session] = None) -> Dict:
+        budget = budget or GenerationBudget()
+        if budget.greedy and session is None and self.interpreter.use_llm:
+            # 缓存命中直接在请求线程返回，不用排在正在进行的生成后面
+            cached = self.interpreter.result_cache.get(self.interpreter.result_cache_key(text, budget))
+            if cached is not None:
+                return self.interpreter.shape_reasoning(
+                    {"interpretation": cached, "truncated": False, "finish_reason": "cached"}, budget
+                )
+        single = budget.greedy or session is not None
+        return self._enqueue(text, budget, session, single).result(timeout=timeout)
+
+    def _collect(self) -> List["_Item"]:
+        # 阻塞等待第一条请求，然后在窗口期内尽量凑满一批
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [item for item in self._collect() if item.future.set_running_or_notify_cancel()]
+            # 单条解码也在本线程执行，与批量生成串行，不会在请求线程里并发调用 generate 和分词器
+            for item in batch:
+                if item.single:
+                    self._generate_single(item)
+            batch = [item for item in batch if not item.single]
+            # 只有预算相同的请求才能共用一次 generate
+            batch.sort(key=lambda item: repr(item.budget.key()))
+            for _, group in groupby(batch, key=lambda item: repr(item.budget.key())):
+                self._generate(list(group))
+
+    def _generate_single(self, item: "_Item"):
+        try:
+            item.future.set_result(self.interpreter.interpret_detailed(item.text, item.budget, session=item.session))
+        except Exception as e:
+            item.future.set_exception(e)
+
+    def _generate(self, group: List["_Item"]):
+        # 同组请求截止时长相同，以最早到达的那条为准
+        budget = min((item.budget for item in group), key=lambda b: b.created_at)
+        try:
+            results = self.interpreter.interpret_batch_detailed([item.text for item in group], budget)
+        except Exception as e:
+            for item in group:
+                item.future.set_exception(e)
+            return
+        for item, result in zip(group, results):
+            item.future.set_result(result)
+
+
+class _Item(NamedTuple):
+    text: str
+    budget: GenerationBudget
+    future: Future
+    session: Optional[Session]
+    single: bool
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+符号词典基准测试：词典规模增大时，规则引擎每个请求的匹配耗时
+
+在自带词典的基础上加入随机生成的中英文符号，扩充到各个规模后分别编译，
+对同一组梦境测量 Aho–Corasick 匹配 (SymbolLexicon.match) 的每请求耗时 p50 / p99，
+并与逐个词做子串查找 (旧规则引擎的做法) 对比。
+自动机的耗时应基本不随词典规模变化，逐词查找则随词数线性增长。
+
+用法:
+    python benchmark_lexicon.py --sizes 40 1000 10000 50000 --rounds 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from symbol_lexicon import DEFAULT_LEXICON_PATH, Symbol, SymbolLexicon
+
+BENCH_DREAMS = [
+    "我梦见自己在飞翔",
+    "梦见一条黑色的蛇一直在追我，我拼命跑却怎么也跑不动，最后从楼梯上掉了下去",
+    "梦见掉牙齿，牙齿一颗一颗地掉在手心里，妈妈在旁边看着却什么也没说",
+    "梦见考试不及格，老师把卷子发下来的时候全班同学都在笑，我一直在哭",
+    "I dreamt I was being chased through a dark house by a monster, then I fell into the ocean and started drowning",
+    "昨晚做了一个很长的梦，" * 20 + "最后在婚礼上看到了前任",
+]
+
+# 常用汉字区间，用来生成不会与真实符号冲突过多的随机词
+_CJK_START, _CJK_END = 0x4E00, 0x9FA5
+
+
+def synthetic_symbols(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    symbols = []
+    for index in range(count):
+        terms = ["".join(chr(rng.randint(_CJK_START, _CJK_END)) for _ in range(rng.randint(2, 4)))
+                 for _ in range(rng.randint(1, 4))]
+        terms.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(5, 10))))
+        symbols.append(Symbol(f"synthetic_{index}", terms, "梦到{term}", weight=rng.random()))
+    return symbols
+
+
+def naive_match(symbols, text: str):
+    """旧规则引擎的做法：复制一份小写文本，逐个词做子串查找"""
+    lower = text.lower()
+    return [s for s in symbols if any(term in text or term.lower() in lower for term in s.terms)]
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def measure(fn, rounds: int):
+    samples = []
+    for _ in range(rounds):
+        for dream in BENCH_DREAMS:
+            start_time = time.perf_counter()
+            fn(dream)
+            samples.append((time.perf_counter() - start_time) * 1e6)
+    return _percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="梦境符号词典匹配基准测试")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[40, 1000, 10000, 50000])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--lexicon", default=DEFAULT_LEXICON_PATH, help="基础词典 (默认自带的 dream_symbols.json)")
+    args = parser.parse_args()
+
+    base = SymbolLexicon.from_file(args.lexicon).symbols
+    results = []
+    for size in args.sizes:
+        symbols = base + synthetic_symbols(max(0, size - len(base)))
+        lexicon = SymbolLexicon(symbols)
+        stats = lexicon.stats()
+        print(f"🔄 {stats['symbols']} 个符号, {stats['terms']} 个词, {stats['states']} 个状态, 编译 {stats['build_ms']:.0f}ms")
+        ac_p50, ac_p99 = measure(lexicon.match, args.rounds)
+        # 逐词查找在大词典上很慢，轮数按比例减少
+        naive_p50, naive_p99 = measure(lambda text: naive_match(symbols, text), max(1, args.rounds * 40 // len(symbols)))
+        results.append((stats["symbols"], stats["build_ms"], ac_p50, ac_p99, naive_p50, naive_p99))
+
+    print("\n" + "=" * 84)
+    print(f"{'符号数':>8}{'编译(ms)':>12}{'自动机 p50(us)':>18}{'自动机 p99(us)':>18}{'逐词 p50(us)':>14}{'逐词 p99(us)':>14}")
+    print("=" * 84)
+    for symbols, build_ms, ac_p50, ac_p99, naive_p50, naive_p99 in results:
+        print(f"{symbols:>8}{build_ms:>12.0f}{ac_p50:>18.1f}{ac_p99:>18.1f}{naive_p50:>14.1f}{naive_p99:>14.1f}")
+    print("=" * 84)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+模型加载基准测试：比较 from_pretrained (default) 与分片快速加载 (fast) 的就绪耗时和峰值内存
+
+每种加载方式在独立子进程中运行，峰值内存取子进程的 ru_maxrss。
+页缓存会影响结果：测冷启动前请先清空页缓存 (Linux: echo 3 > /proc/sys/vm/drop_caches)。
+
+用法:
+    python benchmark_loading.py --loaders default fast
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_loader(loader: str) -> dict:
+    """在当前进程中加载模型并测量，结果以 JSON 打印到标准输出最后一行"""
+    os.environ["MODEL_LOADER"] = loader
+    os.environ["PREFIX_CACHE"] = "0"
+    os.environ["WARMUP_ON_START"] = "0"
+
+    from service import DreamInterpreter
+
+    start_time = time.time()
+    interpreter = DreamInterpreter(verbose=False)
+    ready_seconds = time.time() - start_time
+    return {
+        "loader": loader,
+        "ready": interpreter.use_llm,
+        "ready_seconds": round(ready_seconds, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "shard_steps": [step for step in interpreter.loading_steps if step.startswith("📦")],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型加载方式基准测试")
+    parser.add_argument("--loaders", nargs="+", default=["default", "fast"])
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_loader(args.worker), ensure_ascii=False))
+        return
+
+    results = []
+    for loader in args.loaders:
+        print(f"🔄 正在测试加载方式: {loader} ...")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", loader],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"❌ {loader} 测试失败:\n{proc.stderr[-2000:]}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        for step in result["shard_steps"]:
+            print(f"   {step}")
+        results.append(result)
+
+    print("\n" + "=" * 56)
+    print(f"{'加载方式':<10}{'成功':>8}{'就绪耗时(s)':>16}{'峰值RSS(MB)':>18}")
+    print("=" * 56)
+    for result in results:
+        print(f"{result['loader']:<10}{str(result['ready']):>8}{result['ready_seconds']:>16}{result['peak_rss_mb']:>18}")
+    print("=" * 56)
+
+
+if __name__ == "__main__":
+    main()
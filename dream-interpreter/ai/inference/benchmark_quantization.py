@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+CPU 量化基准测试：比较 float32 / int8 / int4 的内存占用、解码速度和输出质量
+
+每种模式在独立子进程中加载模型 (避免多个 7B 模型同时驻留内存)，
+使用贪心解码生成固定的测试梦境，质量以与 float32 输出的 token 一致率和文本相似度衡量。
+
+用法:
+    python benchmark_quantization.py --modes fp32 int8 int4 --max-new-tokens 64
+"""
+import argparse
+import difflib
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_DREAMS = [
+    "我梦见自己在飞翔",
+    "梦见一条黑色的蛇",
+    "梦见掉牙齿",
+    "梦见考试不及格",
+]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, max_new_tokens: int) -> dict:
+    """在当前进程中加载指定模式的模型并测量，结果以 JSON 打印到标准输出最后一行"""
+    if mode != "fp32":
+        os.environ["CPU_QUANTIZATION"] = mode
+    os.environ["PREFIX_CACHE"] = "0"
+    os.environ["WARMUP_ON_START"] = "0"
+    # 默认固定为 float32 计算，避免 CPU_DTYPE=auto 在不同机器上选到不同精度
+    os.environ.setdefault("CPU_DTYPE", "fp32")
+
+    from service import DreamInterpreter, GenerationBudget
+
+    start_time = time.time()
+    interpreter = DreamInterpreter(verbose=False)
+    load_time = time.time() - start_time
+    tokenizer = interpreter.tokenizer
+
+    outputs, total_tokens, total_time = [], 0, 0.0
+    for dream in BENCH_DREAMS:
+        start_time = time.time()
+        result = interpreter.interpret_detailed(dream, GenerationBudget(max_new_tokens=max_new_tokens, greedy=True))
+        total_time += time.time() - start_time
+        total_tokens += result["generated_tokens"]
+        outputs.append({
+            "text": result["interpretation"],
+            "token_ids": tokenizer(result["interpretation"], add_special_tokens=False).input_ids,
+        })
+    return {
+        "mode": mode,
+        "load_seconds": round(load_time, 2),
+        "rss_mb": round(_rss_mb(), 1),
+        "tokens_per_second": round(total_tokens / total_time, 2) if total_time else 0.0,
+        "outputs": outputs,
+    }
+
+
+def _agreement(reference: list, candidate: list) -> float:
+    """从头开始连续一致的 token 比例"""
+    if not reference:
+        return 1.0
+    same = 0
+    for a, b in zip(reference, candidate):
+        if a != b:
+            break
+        same += 1
+    return same / len(reference)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU量化模式基准测试")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8", "int4"])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_mode(args.worker, args.max_new_tokens), ensure_ascii=False))
+        return
+
+    results = {}
+    for mode in args.modes:
+        print(f"🔄 正在测试模式: {mode} ...")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", mode, "--max-new-tokens", str(args.max_new_tokens)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"❌ {mode} 测试失败:\n{proc.stderr[-2000:]}")
+            continue
+        results[mode] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    reference = results.get("fp32")
+    print("\n" + "=" * 72)
+    print(f"{'模式':<8}{'加载(s)':>10}{'RSS(MB)':>12}{'tokens/s':>12}{'token一致率':>14}{'文本相似度':>14}")
+    print("=" * 72)
+    for mode, result in results.items():
+        agreement = similarity = 1.0
+        if reference and mode != "fp32":
+            pairs = list(zip(reference["outputs"], result["outputs"]))
+            agreement = sum(_agreement(r["token_ids"], c["token_ids"]) for r, c in pairs) / len(pairs)
+            similarity = sum(difflib.SequenceMatcher(None, r["text"], c["text"]).ratio() for r, c in pairs) / len(pairs)
+        print(f"{mode:<8}{result['load_seconds']:>10}{result['rss_mb']:>12}{result['tokens_per_second']:>12}"
+              f"{agreement:>14.2%}{similarity:>14.2%}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
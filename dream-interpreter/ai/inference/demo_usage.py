@@ -28,14 +28,15 @@ def interpret_dream(dream_text, max_tokens=None):
     """解析梦境"""
     print(f"\n🌙 解析梦境: {dream_text}")
     
-    # 设置环境变量来调整生成参数（可选）
-    if max_tokens:
-        print(f"⚙️ 设置max_new_tokens={max_tokens}")
-    
     data = {
         "text": dream_text
     }
     
+    # 通过请求参数调整本次生成的token预算（可选）
+    if max_tokens:
+        print(f"⚙️ 设置max_new_tokens={max_tokens}")
+        data["max_new_tokens"] = max_tokens
+    
     try:
         start_time = time.time()
         response = requests.post(
@@ -48,6 +49,8 @@ def interpret_dream(dream_text, max_tokens=None):
         if response.status_code == 200:
             result = response.json()
             interpretation = result.get('interpretation', '无解析结果')
+            if result.get('truncated'):
+                print(f"✂️ 输出被截断 (原因: {result.get('finish_reason')})")
             
             print(f"✅ 解析完成！耗时: {end_time - start_time:.2f}秒")
             print(f"\n💭 梦境解析结果:")
@@ -68,6 +71,40 @@ def interpret_dream(dream_text, max_tokens=None):
         print(f"❌ 请求失败: {e}")
         return None
 
+def interpret_dreams_batch(dream_texts, max_tokens=None):
+    """一次请求批量解析多条梦境，服务端按长度排序后合并生成，结果按输入顺序返回"""
+    print(f"\n📦 批量解析 {len(dream_texts)} 条梦境")
+    data = {"items": [{"text": text} for text in dream_texts]}
+    if max_tokens:
+        # 顶层参数作为每条的默认值，单条也可以在自己的对象里覆盖
+        data["max_new_tokens"] = max_tokens
+    
+    try:
+        response = requests.post("http://127.0.0.1:5000/interpret/batch", json=data, timeout=600)
+        if response.status_code != 200:
+            print(f"❌ 批量解析失败: {response.json().get('error', '未知错误')}")
+            return None
+        result = response.json()
+        for item, dream in zip(result["results"], dream_texts):
+            print(f"\n🌙 {dream}")
+            print("-" * 50)
+            if item["status"] == "ok":
+                print(item["interpretation"])
+                print(f"⏱️ {item.get('timings', {})}")
+            else:
+                print(f"❌ {item['error']}")
+        batch = result["batch"]
+        print("-" * 50)
+        print(f"✅ 批量完成: {batch['succeeded']}/{batch['items']} 条成功, 耗时 {batch['total_ms'] / 1000:.2f}秒, "
+              f"吞吐 {batch['tokens_per_second']} tokens/秒")
+        return result["results"]
+    except requests.exceptions.Timeout:
+        print("❌ 请求超时 - 批量解析需要较长时间")
+        return None
+    except Exception as e:
+        print(f"❌ 请求失败: {e}")
+        return None
+
 def main():
     """主演示函数"""
     print("🌟 梦境解析AI服务演示")
@@ -88,12 +125,8 @@ def main():
         "梦见考试不及格"
     ]
     
-    for i, dream in enumerate(test_dreams, 1):
-        print(f"\n📝 测试案例 {i}/{len(test_dreams)}")
-        interpret_dream(dream)
-        
-        if i < len(test_dreams):
-            input("\n按回车键继续下一个测试...")
+    # 多条梦境一次请求提交，服务端可以合并成一批生成
+    interpret_dreams_batch(test_dreams)
     
     print("\n🎉 演示完成！")
     
@@ -122,13 +155,13 @@ def main():
         
         # 根据选择设置参数
         if choice == '1':
-            os.environ["MAX_NEW_TOKENS"] = "20"
+            max_tokens = 20
         elif choice == '3':
-            os.environ["MAX_NEW_TOKENS"] = "100"
+            max_tokens = 100
         else:
-            os.environ["MAX_NEW_TOKENS"] = "50"  # 默认标准模式
+            max_tokens = 50  # 默认标准模式
             
-        interpret_dream(user_input)
+        interpret_dream(user_input, max_tokens)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
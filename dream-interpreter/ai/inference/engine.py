@@ -0,0 +1,438 @@
+"""
+连续批处理 (iteration-level batching) 生成引擎
+
+引擎自己运行解码循环：每个解码步之间把新请求预填充后并入空闲的 KV 槽位，
+已经结束的序列立即退出并返回结果，短梦境不必等待同批次中最长的那一条。
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+import kv_cache
+from result_cache import CACHEABLE_FINISH_REASONS
+from service import GenerationBudget
+from sessions import Session
+from stopping import StopMonitor
+from thinking import THINK_END, THINK_START, ThinkingTracker
+
+
+class IncrementalDetokenizer:
+    """逐token增量解码；多字节字符(例如中文)没有拼完整时先不输出"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.tokens: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def push(self, token_id: int) -> str:
+        self.tokens.append(token_id)
+        prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(self.tokens[self.prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.tokens)
+            return new_text[len(prefix_text):]
+        return ""
+
+
+class GenerationRequest:
+    def __init__(self, prompt: str, budget: GenerationBudget, temperature: float = 0.7,
+                 top_p: float = 0.9, stream: bool = False, cache_key: Optional[str] = None,
+                 cancel: Optional[threading.Event] = None):
+        self.prompt = prompt
+        self.prompt_ids: List[int] = []
+        self.budget = budget
+        self.max_new_tokens = budget.max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.do_sample = not budget.greedy
+        self.finish_reason: Optional[str] = None
+        # 确定性请求完成后以此键写入解析结果缓存
+        self.cache_key = cache_key
+        self.generated: List[int] = []
+        self.future = Future()
+        self.submitted_at = time.time()
+        self.token_times: List[float] = []
+        self.finished_at: Optional[float] = None
+        # 流式请求：引擎线程往队列里放 ("token", 文本增量)，最后放 ("done", 计时) 或 ("error", 信息)
+        self.events: Optional[queue.Queue] = queue.Queue() if stream else None
+        # 客户端断开时置位：引擎在下一个解码步让这一行退出，不再为没人接收的输出解码
+        self.cancelled = cancel if cancel is not None else threading.Event()
+        self.detokenizer: Optional[IncrementalDetokenizer] = None
+        # 推理段 (<think>) 跟踪：超出 thinking_budget 时强制结束推理，流式输出时区分推理和答案
+        self.tracker: Optional[ThinkingTracker] = None
+        self.answer_started = False
+        # 提前结束检测 (重复、停止字符串、结构完整)
+        self.monitor: Optional[StopMonitor] = None
+        # 多轮会话：本轮的完整对话消息，结束时把这一行的 KV cache 交给会话
+        self.session: Optional[Session] = None
+        self.messages: Optional[List[Dict[str, str]]] = None
+
+    @property
+    def last_token(self) -> int:
+        return self.generated[-1]
+
+    def timings(self) -> Dict:
+        """首token延迟 (TTFT) 与 token 间延迟 (ITL)，单位毫秒"""
+        result = {"generated_tokens": len(self.generated)}
+        if self.token_times:
+            result["ttft_ms"] = round((self.token_times[0] - self.submitted_at) * 1000, 1)
+        gaps = sorted(b - a for a, b in zip(self.token_times, self.token_times[1:]))
+        if gaps:
+            result["itl_ms_mean"] = round(sum(gaps) / len(gaps) * 1000, 1)
+            result["itl_ms_p50"] = round(gaps[len(gaps) // 2] * 1000, 1)
+            result["itl_ms_p95"] = round(gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))] * 1000, 1)
+        if self.finished_at:
+            result["total_ms"] = round((self.finished_at - self.submitted_at) * 1000, 1)
+        return result
+
+    def result(self, text: str) -> Dict:
+        result = {
+            "interpretation": text,
+            "truncated": self.finish_reason != "eos",
+            "finish_reason": self.finish_reason,
+            "generated_tokens": len(self.generated),
+        }
+        if self.budget.thinking_budget is not None and self.tracker is not None:
+            result.update(reasoning_tokens=self.tracker.reasoning_tokens, thinking_forced=self.tracker.forced)
+        return result
+
+
+class ContinuousBatchingEngine:
+    def __init__(self, interpreter, max_slots: Optional[int] = None, verbose: bool = False):
+        self.interpreter = interpreter
+        self.model = interpreter.model
+        self.tokenizer = interpreter.tokenizer
+        self.max_slots = max_slots or int(os.environ.get("MAX_BATCH_SIZE", "8"))
+        self.verbose = verbose
+        self.stats = {"admitted": 0, "completed": 0, "cancelled": 0, "decode_steps": 0, "generated_tokens": 0}
+
+        self._pending = queue.Queue()
+        # 当前批次状态：第 i 行对应 self._active[i]
+        self._active: List[GenerationRequest] = []
+        self._cache = None
+        self._mask: Optional[torch.Tensor] = None
+
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, text: str, budget: Optional[GenerationBudget] = None, stream: bool = False,
+               session: Optional[Session] = None, cancel: Optional[threading.Event] = None) -> GenerationRequest:
+        budget = budget or GenerationBudget()
+        if session is not None:
+            messages = self.interpreter.session_messages(session, text)
+            request = GenerationRequest(
+                self.interpreter._render_messages(messages), budget, stream=stream, cancel=cancel
+            )
+            request.session, request.messages = session, messages
+        else:
+            request = GenerationRequest(
+                self.interpreter._build_prompt(text),
+                budget,
+                stream=stream,
+                cache_key=self.interpreter.result_cache_key(text, budget) if budget.greedy else None,
+                cancel=cancel,
+            )
+        if stream:
+            request.detokenizer = IncrementalDetokenizer(self.tokenizer)
+        self._ensure_worker()
+        self._pending.put(request)
+        return request
+
+    def _cached(self, text: str, budget: GenerationBudget, session: Optional[Session] = None) -> Optional[str]:
+        # 会话的回答依赖之前的对话，不查结果缓存
+        if not budget.greedy or session is not None:
+            return None
+        return self.interpreter.result_cache.get(self.interpreter.result_cache_key(text, budget))
+
+    def interpret(self, text: str, budget: Optional[GenerationBudget] = None, timeout: Optional[float] = None) -> str:
+        return self.interpret_detailed(text, budget, timeout)["interpretation"]
+
+    def interpret_detailed(self, text: str, budget: Optional[GenerationBudget] = None,
+                           timeout: Optional[float] = None, session: Optional[Session] = None) -> Dict:
+        budget = budget or GenerationBudget()
+        if not self.interpreter.use_llm:
+            return self.interpreter.fallback_result(text)
+        cached = self._cached(text, budget, session)
+        if cached is not None:
+            return self.interpreter.shape_reasoning(
+                {"interpretation": cached, "truncated": False, "finish_reason": "cached"}, budget
+            )
+        return self.submit(text, budget, session=session).future.result(timeout=timeout)
+
+    def stream(self, text: str, budget: Optional[GenerationBudget] = None, session: Optional[Session] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[Tuple[str, object]]:
+        """逐个产出 ("token", 文本增量) 或 ("reasoning", 推理增量)，最后产出 ("done", 计时) 或 ("error", 信息)；
+        调用方提前关闭生成器或置位 cancel 时取消生成"""
+        budget = budget or GenerationBudget()
+        if not self.interpreter.use_llm:
+            result = self.interpreter.fallback_result(text)
+            yield "token", result["interpretation"]
+            yield "done", {"fallback": True, "finish_reason": "fallback", "notice": result["notice"]}
+            return
+        cached = self._cached(text, budget, session)
+        if cached is not None:
+            result = self.interpreter.shape_reasoning(
+                {"interpretation": cached, "truncated": False, "finish_reason": "cached"}, budget
+            )
+            if result.get("reasoning"):
+                yield "reasoning", result["reasoning"]
+            yield "token", result["interpretation"]
+            yield "done", {"cached": True}
+            return
+        request = self.submit(text, budget, stream=True, session=session, cancel=cancel)
+        finished = False
+        try:
+            while not finished:
+                kind, payload = request.events.get()
+                # token / reasoning 之后还有后续事件，只有 done 或 error 表示流结束
+                finished = kind in ("done", "error")
+                yield kind, payload
+        finally:
+            if not finished:
+                request.cancelled.set()
+
+    def _ensure_worker(self):
+        # 线程不会被 fork 出的子进程继承，解码线程按进程在第一次提交时启动
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid != os.getpid():
+                threading.Thread(target=self._run, name="continuous-batching", daemon=True).start()
+                self._worker_pid = os.getpid()
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(f"[{time.strftime('%H:%M:%S')}] {message}")
+
+    @property
+    def _device(self):
+        return next(self.model.parameters()).device
+
+    def _run(self):
+        while True:
+            try:
+                with torch.inference_mode():
+                    self._admit(block=not self._active)
+                    if self._active:
+                        self._step()
+            except Exception as e:
+                self._log(f"❌ 解码循环出错: {e}")
+                for request in self._active:
+                    self._fail(request, e)
+                self._active, self._cache, self._mask = [], None, None
+
+    @staticmethod
+    def _fail(request: GenerationRequest, error: Exception):
+        if not request.future.done():
+            request.future.set_exception(error)
+        if request.events is not None:
+            request.events.put(("error", str(error)))
+
+    def _admit(self, block: bool):
+        while len(self._active) < self.max_slots:
+            try:
+                request = self._pending.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            if request.budget.expired() or request.cancelled.is_set():
+                # 排队期间已经超过截止时间或被取消，不再占用槽位
+                request.finish_reason = "cancelled" if request.cancelled.is_set() else "deadline"
+                self._finish(request)
+                continue
+            try:
+                self._prefill(request)
+            except Exception as e:
+                # 只让这一条请求失败；它还没有并入批次，正在解码的其他序列不受影响
+                self._log(f"❌ 预填充失败: {e}")
+                self._fail(request, e)
+
+    def _prefill(self, request: GenerationRequest):
+        """单独预填充一条新请求，采样首个token后并入当前批次"""
+        # 分词放在引擎线程里做，避免多个请求线程并发使用同一个 fast tokenizer
+        request.prompt_ids = self.tokenizer(request.prompt).input_ids
+        if self.interpreter.thinking is not None:
+            request.tracker = self.interpreter.thinking.tracker(request.prompt_ids, request.budget.thinking_budget)
+        request.monitor = self.interpreter.stop_monitor(request.budget)
+        prefix, prefix_length = None, 0
+        if request.session is not None:
+            # 会话的后续轮次只需预填充上一轮之后新增的 token；KV 被淘汰时完整重算
+            prefix, prefix_length = self.interpreter.sessions.reusable(request.session, request.prompt_ids)
+        # 会话的第一轮 (或 KV 已被淘汰) 与普通请求一样从提示前缀KV缓存开始
+        if prefix is None and self.interpreter.prefix_cache is not None:
+            prefix, prefix_length = self.interpreter.prefix_cache.lookup(request.prompt_ids)
+        input_ids = torch.tensor([request.prompt_ids[prefix_length:]], dtype=torch.long, device=self._device)
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=kv_cache.from_legacy(prefix) if prefix is not None else None,
+            use_cache=True,
+        )
+        self.stats["admitted"] += 1
+        self._append_token(request, self._next_token(outputs.logits[0, -1], request))
+        new_cache = kv_cache.to_legacy(outputs.past_key_values)
+        if self._is_finished(request):
+            self._finish(request, new_cache)
+            return
+
+        new_mask = torch.ones((1, len(request.prompt_ids)), dtype=torch.long, device=self._device)
+        if not self._active:
+            self._cache, self._mask = new_cache, new_mask
+        else:
+            # 较短的一方左侧补齐，补出的位置由 attention_mask 屏蔽
+            # 先算出新的批次状态再一起替换，中途出错时原批次保持不变
+            length = max(self._mask.shape[1], new_mask.shape[1])
+            merged_cache = kv_cache.concat_batch([
+                kv_cache.pad_left(self._cache, length),
+                kv_cache.pad_left(new_cache, length),
+            ])
+            merged_mask = torch.cat([
+                self._pad_mask(self._mask, length),
+                self._pad_mask(new_mask, length),
+            ], dim=0)
+            self._cache, self._mask = merged_cache, merged_mask
+        self._active.append(request)
+        self._log(f"➕ 新序列进入槽位 (活跃: {len(self._active)}/{self.max_slots})")
+
+    @staticmethod
+    def _pad_mask(mask: torch.Tensor, length: int) -> torch.Tensor:
+        if mask.shape[1] >= length:
+            return mask
+        return torch.cat([mask.new_zeros((mask.shape[0], length - mask.shape[1])), mask], dim=1)
+
+    def _step(self):
+        """整批执行一个解码步，并让已结束的序列立即退出"""
+        input_ids = torch.tensor([[r.last_token] for r in self._active], dtype=torch.long, device=self._device)
+        self._mask = torch.cat([self._mask, self._mask.new_ones((len(self._active), 1))], dim=1)
+        position_ids = self._mask.sum(dim=1, keepdim=True) - 1
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=self._mask,
+            position_ids=position_ids,
+            past_key_values=kv_cache.from_legacy(self._cache),
+            use_cache=True,
+        )
+        self._cache = kv_cache.to_legacy(outputs.past_key_values)
+        self.stats["decode_steps"] += 1
+
+        keep = []
+        for row, request in enumerate(self._active):
+            self._append_token(request, self._next_token(outputs.logits[row, -1], request))
+            if self._is_finished(request):
+                self._finish(request, self._row_cache(row) if request.session is not None else None)
+            else:
+                keep.append(row)
+        if len(keep) < len(self._active):
+            self._retire(keep)
+
+    def _append_token(self, request: GenerationRequest, token_id: int):
+        request.generated.append(token_id)
+        request.token_times.append(time.time())
+        in_reasoning = request.tracker.push(token_id) if request.tracker is not None else False
+        if request.events is not None:
+            delta = request.detokenizer.push(token_id)
+            mode = request.budget.reasoning
+            if mode == "keep":
+                kind = "token"
+            elif in_reasoning:
+                # strip 模式直接丢弃推理部分，separate 模式以单独的事件推送
+                kind = "reasoning" if mode == "separate" else None
+                delta = delta.replace(THINK_START, "").replace(THINK_END, "")
+            else:
+                kind = "token"
+                if not request.answer_started:
+                    delta = delta.lstrip()
+                    request.answer_started = bool(delta)
+            if delta and kind is not None:
+                request.events.put((kind, delta))
+
+    def _retire(self, keep: List[int]):
+        self._active = [self._active[row] for row in keep]
+        if not self._active:
+            self._cache, self._mask = None, None
+            return
+        self._cache = kv_cache.select_rows(self._cache, keep)
+        self._mask = self._mask[keep]
+        # 退出的长序列可能留下整列都是填充的位置，顺手裁掉
+        leading = int((self._mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        if leading:
+            self._cache = kv_cache.drop_leading(self._cache, leading)
+            self._mask = self._mask[:, leading:]
+
+    def _row_cache(self, row: int):
+        """取出一行的 KV 并去掉左侧填充，留给会话的下一轮"""
+        cache = kv_cache.select_rows(self._cache, [row])
+        return kv_cache.drop_leading(cache, int((self._mask[row] == 0).sum()))
+
+    def _is_finished(self, request: GenerationRequest) -> bool:
+        if request.cancelled.is_set():
+            request.finish_reason = "cancelled"
+        elif request.last_token == self.tokenizer.eos_token_id:
+            request.finish_reason = "eos"
+        elif len(request.generated) >= request.max_new_tokens:
+            request.finish_reason = "length"
+        elif request.budget.expired():
+            request.finish_reason = "deadline"
+        elif request.monitor is not None and request.monitor.push(request.generated):
+            request.finish_reason = "stop"
+        return request.finish_reason is not None
+
+    def _finish(self, request: GenerationRequest, cache=None):
+        request.finished_at = time.time()
+        self.stats["completed"] += 1
+        self.stats["generated_tokens"] += len(request.generated)
+        if request.finish_reason == "cancelled":
+            self.stats["cancelled"] += 1
+        if request.finish_reason == "stop":
+            # 重复检测会截掉多余的重复单元
+            del request.generated[request.monitor.keep_tokens:]
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        result = self.interpreter._apply_stop(request.result(text), request.monitor, request.budget)
+        # 被截断的部分结果不进缓存，命中缓存时总是完整的解析
+        if request.cache_key is not None and request.finish_reason in CACHEABLE_FINISH_REASONS:
+            self.interpreter.result_cache.put(request.cache_key, result["interpretation"])
+        # 被取消的轮次没有完整回答，不写入会话
+        if request.session is not None and request.finish_reason != "cancelled":
+            self.interpreter.complete_turn(
+                request.session, request.messages, result, request.prompt_ids + request.generated, cache
+            )
+        request.future.set_result(self.interpreter.shape_reasoning(result, request.budget))
+        timings = request.timings()
+        timings.update(truncated=result["truncated"], finish_reason=request.finish_reason)
+        if "stop_criterion" in result:
+            timings["stop_criterion"] = result["stop_criterion"]
+        if "session_id" in result:
+            timings.update(session_id=result["session_id"], session_turn=result["session_turn"])
+        if request.budget.thinking_budget is not None and request.tracker is not None:
+            timings.update(reasoning_tokens=request.tracker.reasoning_tokens, thinking_forced=request.tracker.forced)
+        self._log(f"📏 序列完成: {timings}")
+        if request.events is not None:
+            request.events.put(("done", timings))
+
+    def _next_token(self, logits: torch.Tensor, request: GenerationRequest) -> int:
+        """推理超出预算时直接输出结束标签，否则正常采样"""
+        if request.tracker is not None:
+            forced = request.tracker.forced_token()
+            if forced is not None:
+                return forced
+        return self._sample(logits, request)
+
+    @staticmethod
+    def _sample(logits: torch.Tensor, request: GenerationRequest) -> int:
+        if not request.do_sample:
+            return int(torch.argmax(logits))
+        probs = torch.softmax(logits.float() / request.temperature, dim=-1)
+        sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+        # top-p：保留累计概率刚好超过阈值的最小token集合
+        outside = torch.cumsum(sorted_probs, dim=-1) - sorted_probs > request.top_p
+        sorted_probs = sorted_probs.masked_fill(outside, 0.0)
+        choice = torch.multinomial(sorted_probs / sorted_probs.sum(), 1)
+        return int(sorted_idx[choice])
@@ -0,0 +1,130 @@
+"""
+启动时的模型完整性校验
+
+VERIFY_MODEL 选择策略 (默认 off)：
+- warn: 后台校验，不一致时只记录警告，不影响就绪；
+- refuse: 标记就绪前等待校验结果，不一致或无法完成校验 (参考文件缺失等) 时拒绝就绪 (由规则引擎兜底)；
+- quarantine: 同 refuse，内容不一致时还会在模型清单中隔离该快照：下次启动时解析器跳过它，
+  没有其他本地快照时强制重新下载 (不允许下载则直接失败)，重新下载的快照校验通过后解除隔离。
+校验与分词器、模型加载并行进行。默认使用 blob 名快速比对 (HF 缓存中几乎不读取内容)，
+VERIFY_MODEL_DEEP=1 时读取内容校验 (参考文件为 Merkle 清单时按块并行校验)。
+参考文件由 VERIFY_MODEL_REFERENCE 指定，扁平格式和 Merkle 清单均可。
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from verify_model_hashes import load_reference, verify_merkle, verify_model_fast, verify_model_hashes
+
+POLICIES = ("off", "warn", "refuse", "quarantine")
+DEFAULT_REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "deepseek_model_hashes.json")
+
+
+def integrity_policy(log: Callable[[str], None] = print) -> str:
+    policy = os.environ.get("VERIFY_MODEL", "off").lower()
+    if policy not in POLICIES:
+        log(f"⚠️ 未知的 VERIFY_MODEL={policy}，改用 warn")
+        policy = "warn"
+    return policy
+
+
+class IntegrityCheck:
+    def __init__(self, model_path: str, policy: Optional[str] = None, reference_path: Optional[str] = None,
+                 deep: Optional[bool] = None, log: Callable[[str], None] = print):
+        self.model_path = model_path
+        self.policy = policy or integrity_policy(log)
+        self.reference_path = reference_path or os.environ.get("VERIFY_MODEL_REFERENCE", DEFAULT_REFERENCE)
+        self.deep = deep if deep is not None else os.environ.get("VERIFY_MODEL_DEEP", "0") == "1"
+        self.sample_files = int(os.environ.get("VERIFY_MODEL_SAMPLE_FILES", "0"))
+        self.log = log
+        # pending / running / verified / mismatch / error
+        self.status = "pending"
+        self.report: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self.quarantined = False
+        self._done = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != "off"
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def failed(self) -> bool:
+        """确认内容不一致；校验本身出错 (status == "error") 另行处理，不隔离快照"""
+        return self.status == "mismatch"
+
+    @property
+    def passed(self) -> bool:
+        return self.status == "verified"
+
+    def start(self) -> threading.Thread:
+        self.status = "running"
+        thread = threading.Thread(target=self._run, name="model-integrity", daemon=True)
+        thread.start()
+        return thread
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _run(self):
+        start_time = time.time()
+        try:
+            reference, manifest = load_reference(self.reference_path)
+            if self.deep and manifest is not None:
+                report = verify_merkle(self.model_path, manifest)
+            elif self.deep:
+                report = verify_model_hashes(self.model_path, reference)
+            else:
+                report = verify_model_fast(self.model_path, reference, sample_files=self.sample_files)
+            self.report = report
+            self.status = report["status"] if report["status"] in ("verified", "mismatch") else "error"
+            if self.status == "error":
+                self.error = report.get("message") or f"参考文件中没有可比对的哈希值 ({report['status']})"
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+        self.seconds = round(time.time() - start_time, 3)
+        if self.status == "verified":
+            self.log(f"🔐 模型完整性校验通过 ({len(self.report['verified_files'])} 个文件, 耗时 {self.seconds * 1000:.0f}ms)")
+        elif self.status == "mismatch":
+            self.log(f"🚨 模型完整性校验未通过: {self.describe()} (策略: {self.policy})")
+        else:
+            self.log(f"⚠️ 模型完整性校验无法完成: {self.error}")
+        self._done.set()
+
+    def describe(self) -> str:
+        if not self.report:
+            return self.error or self.status
+        parts = []
+        if self.report.get("mismatched_files"):
+            parts.append(f"不匹配 {', '.join(self.report['mismatched_files'])}")
+        if self.report.get("missing_files"):
+            parts.append(f"缺失 {', '.join(self.report['missing_files'])}")
+        return "; ".join(parts) or self.status
+
+    def to_dict(self) -> Dict:
+        result = {
+            "policy": self.policy,
+            "status": self.status,
+            "mode": "deep" if self.deep else "fast",
+            "reference": self.reference_path,
+            "seconds": self.seconds,
+            "quarantined": self.quarantined,
+        }
+        if self.report:
+            result.update(
+                verified_files=len(self.report.get("verified_files", [])),
+                mismatched_files=self.report.get("mismatched_files", []),
+                missing_files=self.report.get("missing_files", []),
+            )
+            if self.report.get("corrupted_ranges"):
+                result["corrupted_ranges"] = self.report["corrupted_ranges"]
+        if self.error:
+            result["error"] = self.error
+        return result
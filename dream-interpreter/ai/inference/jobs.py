@@ -0,0 +1,190 @@
+"""
+异步解析任务队列
+
+长梦境配合大的 max_new_tokens 可能超过 Node 后端与 AI 服务之间的 HTTP 超时。
+POST /jobs 立即返回任务 ID，之后用 GET /jobs/<id> 轮询 (可带 wait 参数在服务端等待一段时间)。
+任务保存在本地 SQLite 文件 (JOBS_DB_PATH) 中：app.py 重启后，未完成的任务 (包括重启时正在执行的)
+重新回到待处理状态继续执行；同一任务被中断超过 JOB_MAX_ATTEMPTS 次后标记为失败，避免反复拖垮服务。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")
+
+
+class JobQueue:
+    def __init__(self, handler: Callable[[str, Dict], Dict], db_path: Optional[str] = None,
+                 workers: Optional[int] = None, verbose: bool = True):
+        """handler(text, params) 执行一次解析并返回结果字典，在任务线程中调用"""
+        self.handler = handler
+        self.db_path = db_path or os.environ.get("JOBS_DB_PATH", DEFAULT_DB_PATH)
+        self.workers = workers or int(os.environ.get("JOB_WORKERS", "1"))
+        self.max_attempts = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+        self.ttl_seconds = float(os.environ.get("JOB_TTL", str(7 * 24 * 3600)))
+        self.verbose = verbose
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "resumed": 0}
+
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+
+        db = self._db
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, text TEXT NOT NULL, params TEXT NOT NULL,"
+            " result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - self.ttl_seconds,))
+        db.commit()
+        self._recover()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """每个线程 (以及 fork 出的每个进程) 使用自己的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(f"📮 {message}")
+
+    def _recover(self):
+        """上次退出时正在执行的任务重新排队；中断次数过多的直接标记失败"""
+        db = self._db
+        now = time.time()
+        failed = db.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE status = 'running' AND attempts >= ?",
+            ("Interrupted too many times", now, self.max_attempts),
+        ).rowcount
+        resumed = db.execute("UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'").rowcount
+        db.commit()
+        pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        self.counters["resumed"] += resumed
+        if pending or failed:
+            self._log(f"恢复任务队列: 待处理 {pending} 个 (其中中断后重新排队 {resumed} 个), 放弃 {failed} 个")
+
+    def start(self):
+        # 线程不会被 fork 出的子进程继承，按进程启动任务线程
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid != os.getpid():
+                for index in range(self.workers):
+                    threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True).start()
+                self._worker_pid = os.getpid()
+
+    def submit(self, text: str, params: Optional[Dict] = None) -> Dict:
+        job_id = uuid.uuid4().hex
+        db = self._db
+        db.execute(
+            "INSERT INTO jobs (id, status, text, params, created_at) VALUES (?, 'pending', ?, ?, ?)",
+            (job_id, text, json.dumps(params or {}, ensure_ascii=False), time.time()),
+        )
+        db.commit()
+        self.counters["submitted"] += 1
+        self.start()
+        self._notify()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "attempts": row["attempts"],
+        }
+        if row["status"] == "pending":
+            job["position"] = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND created_at < ?", (row["created_at"],)
+            ).fetchone()[0]
+        if row["started_at"] is not None:
+            job["started_at"] = row["started_at"]
+        if row["finished_at"] is not None:
+            job["finished_at"] = row["finished_at"]
+            job["total_ms"] = round((row["finished_at"] - row["created_at"]) * 1000, 1)
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """等到任务结束或超时，返回任务当前状态；其他进程完成的任务靠定期重新查询发现"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, 0.5))
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """取出最早的待处理任务；按状态条件更新，多个进程同时抢同一任务时只有一个成功"""
+        db = self._db
+        while True:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1"
+                " WHERE id = ? AND status = 'pending'",
+                (time.time(), row["id"]),
+            ).rowcount
+            db.commit()
+            if claimed:
+                return row
+
+    def _run(self):
+        while True:
+            row = self._claim()
+            if row is None:
+                with self._changed:
+                    self._changed.wait(1.0)
+                continue
+            job_id = row["id"]
+            self._log(f"开始任务 {job_id[:8]} (第 {row['attempts'] + 1} 次尝试)")
+            try:
+                result = self.handler(row["text"], json.loads(row["params"]))
+                self._finish(job_id, "done", result=json.dumps(result, ensure_ascii=False))
+                self.counters["completed"] += 1
+                self._log(f"✅ 任务 {job_id[:8]} 完成 ({result.get('finish_reason')})")
+            except Exception as e:
+                self._finish(job_id, "failed", error=str(e))
+                self.counters["failed"] += 1
+                self._log(f"❌ 任务 {job_id[:8]} 失败: {e}")
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        db = self._db
+        db.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, result, error, time.time(), job_id),
+        )
+        db.commit()
+        self._notify()
+
+    def stats(self) -> Dict:
+        stats = dict(self.counters)
+        stats["by_status"] = {row[0]: row[1] for row in self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+        return stats
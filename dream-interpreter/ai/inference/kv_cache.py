@@ -0,0 +1,79 @@
+"""
+KV cache 工具函数
+
+统一使用 legacy 格式 (每层一个 (key, value) 元组，形状 [batch, heads, seq, head_dim])
+在引擎内部拼接、裁剪、选取批次行，只在调用模型前转换为 transformers 的 Cache 对象。
+"""
+from typing import List, Sequence, Tuple
+
+import torch
+
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+def to_legacy(past_key_values) -> LegacyCache:
+    """把模型返回的 past_key_values 转为 legacy 元组格式"""
+    if past_key_values is None or isinstance(past_key_values, tuple):
+        return past_key_values
+    if hasattr(past_key_values, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+    if hasattr(past_key_values, "key_cache"):
+        return tuple(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return past_key_values.to_legacy_cache()
+
+
+def from_legacy(legacy: LegacyCache):
+    """由 legacy 元组构造一个新的 DynamicCache；原张量不会被模型前向原地修改"""
+    from transformers import DynamicCache
+
+    cache = DynamicCache()
+    if legacy is not None:
+        for layer_idx, (key, value) in enumerate(legacy):
+            cache.update(key, value, layer_idx)
+    return cache
+
+
+def cache_length(legacy: LegacyCache) -> int:
+    if not legacy:
+        return 0
+    return legacy[0][0].shape[2]
+
+
+def pad_left(legacy: LegacyCache, length: int) -> LegacyCache:
+    """在序列维左侧补零到指定长度，补出来的位置需要由 attention_mask 屏蔽"""
+    current = cache_length(legacy)
+    if current >= length:
+        return legacy
+    padded = []
+    for key, value in legacy:
+        pad_shape = (key.shape[0], key.shape[1], length - current, key.shape[3])
+        padded.append((
+            torch.cat([key.new_zeros(pad_shape), key], dim=2),
+            torch.cat([value.new_zeros(pad_shape), value], dim=2),
+        ))
+    return tuple(padded)
+
+
+def concat_batch(caches: Sequence[LegacyCache]) -> LegacyCache:
+    """沿批次维拼接长度相同的多个 cache"""
+    return tuple(
+        (torch.cat([c[i][0] for c in caches], dim=0), torch.cat([c[i][1] for c in caches], dim=0))
+        for i in range(len(caches[0]))
+    )
+
+
+def select_rows(legacy: LegacyCache, rows: List[int]) -> LegacyCache:
+    index = torch.tensor(rows, dtype=torch.long, device=legacy[0][0].device)
+    return tuple((key.index_select(0, index), value.index_select(0, index)) for key, value in legacy)
+
+
+def drop_leading(legacy: LegacyCache, count: int) -> LegacyCache:
+    """丢弃序列维最前面的 count 个位置 (通常是全部行都为填充的列)"""
+    if count <= 0:
+        return legacy
+    return tuple((key[:, :, count:], value[:, :, count:]) for key, value in legacy)
+
+
+def crop(legacy: LegacyCache, length: int) -> LegacyCache:
+    """只保留序列维最前面的 length 个位置"""
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in legacy)
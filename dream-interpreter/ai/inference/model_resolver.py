@@ -0,0 +1,243 @@
+"""
+模型路径解析 (离线优先)
+
+按以下顺序确定要加载的模型目录，找到本地快照后整个启动过程不会访问网络：
+1. MODEL_NAME 本身就是一个本地目录；
+2. 清单文件 (MODEL_MANIFEST_PATH) 中上次解析到的快照仍然有效；
+3. 依次扫描 MODEL_SEARCH_PATHS、Hugging Face 缓存目录和几个常用的本地模型目录，
+   HF 缓存按 refs/main 指向的提交选择快照，而不是按目录名排序猜测最新版本。
+完整性校验未通过而被隔离 (见 integrity.py) 的快照记录在清单中，以上各步都会跳过它们。
+都找不到时，只有在允许下载 (MODEL_ALLOW_DOWNLOAD=1 且未设置 HF_HUB_OFFLINE) 时才返回远程模型 ID，
+否则立即报错，由调用方退回规则引擎，不会卡在网络超时上。
+"""
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_MODEL_ID = "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"
+
+
+class ResolvedModel:
+    def __init__(self, model_id: str, path: str, source: str, commit: Optional[str] = None,
+                 force_download: bool = False):
+        self.model_id = model_id
+        self.path = path
+        # manifest / directory / hf_cache / local_dir / remote
+        self.source = source
+        self.commit = commit
+        # 本地快照已被隔离：按模型 ID 加载时 transformers 仍会命中同一个 HF 缓存快照，必须强制重新下载
+        self.force_download = force_download
+
+    @property
+    def local(self) -> bool:
+        return self.source != "remote"
+
+    def to_dict(self) -> Dict:
+        return {"model_id": self.model_id, "path": self.path, "source": self.source, "commit": self.commit,
+                "force_download": self.force_download}
+
+
+def _hf_cache_roots() -> List[str]:
+    roots = []
+    for key in ("HF_HUB_CACHE", "HUGGINGFACE_HUB_CACHE"):
+        if os.environ.get(key):
+            roots.append(os.environ[key])
+    if os.environ.get("HF_HOME"):
+        roots.append(os.path.join(os.environ["HF_HOME"], "hub"))
+    roots.append(os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub"))
+    return roots
+
+
+def _is_model_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, "config.json"))
+
+
+def _read_ref(repo_dir: str, ref: str = "main") -> Optional[str]:
+    try:
+        with open(os.path.join(repo_dir, "refs", ref), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def download_allowed() -> bool:
+    if os.environ.get("HF_HUB_OFFLINE", "0") not in ("", "0") or os.environ.get("TRANSFORMERS_OFFLINE", "0") not in ("", "0"):
+        return False
+    return os.environ.get("MODEL_ALLOW_DOWNLOAD", "1") != "0"
+
+
+class ModelResolver:
+    def __init__(self, model_id: Optional[str] = None, search_paths: Optional[List[str]] = None,
+                 manifest_path: Optional[str] = None, allow_download: Optional[bool] = None,
+                 log: Callable[[str], None] = print):
+        self.model_id = model_id or os.environ.get("MODEL_NAME", DEFAULT_MODEL_ID)
+        if search_paths is None:
+            search_paths = [p for p in os.environ.get("MODEL_SEARCH_PATHS", "").split(os.pathsep) if p]
+        self.search_paths = search_paths
+        self.manifest_path = manifest_path or os.environ.get(
+            "MODEL_MANIFEST_PATH",
+            os.path.join(os.path.expanduser("~"), ".cache", "dream-interpreter", "model-manifest.json"),
+        )
+        self.allow_download = download_allowed() if allow_download is None else allow_download
+        self.log = log
+        self._quarantined = set()
+
+    def roots(self) -> List[str]:
+        """搜索根目录：配置的路径优先，其次是 HF 缓存，最后是常用的本地模型目录"""
+        roots = list(self.search_paths) + _hf_cache_roots()
+        roots += ["./models", "../models", "D:\\models", "E:\\models"]
+        seen, unique = set(), []
+        for root in roots:
+            key = os.path.abspath(os.path.expanduser(root))
+            if key not in seen:
+                seen.add(key)
+                unique.append(key)
+        return unique
+
+    def resolve(self) -> ResolvedModel:
+        self._quarantined = set(self.quarantined())
+        if self._usable(self.model_id):
+            return ResolvedModel(self.model_id, os.path.abspath(self.model_id), "directory")
+
+        resolved = self._from_manifest()
+        if resolved is not None:
+            return resolved
+
+        start_time = time.time()
+        for root in self.roots():
+            resolved = self._scan_root(root)
+            if resolved is not None:
+                self.log(f"🔎 已在 {root} 找到本地模型 (扫描耗时: {(time.time() - start_time) * 1000:.0f}ms)")
+                self._record(resolved)
+                return resolved
+
+        if self.allow_download:
+            if self._quarantined:
+                self.log("🚫 本地快照已被隔离，将强制重新下载模型")
+            return ResolvedModel(self.model_id, self.model_id, "remote", force_download=bool(self._quarantined))
+        raise FileNotFoundError(
+            f"本地未找到模型 {self.model_id}，且已禁止下载 (MODEL_ALLOW_DOWNLOAD=0 或 HF_HUB_OFFLINE=1)；"
+            f"已搜索: {', '.join(self.roots())}"
+        )
+
+    def _scan_root(self, root: str) -> Optional[ResolvedModel]:
+        if not os.path.isdir(root):
+            return None
+        # Hugging Face 缓存布局: models--org--name/refs/main -> snapshots/<commit>
+        repo_dir = os.path.join(root, "models--" + self.model_id.replace("/", "--"))
+        if os.path.isdir(repo_dir):
+            snapshot = self._hf_snapshot(repo_dir)
+            if snapshot is not None:
+                return snapshot
+        # 普通目录布局: root/org/name、root/name，或者 root 本身就是模型目录
+        candidates = [os.path.join(root, *self.model_id.split("/")), os.path.join(root, self.model_id.split("/")[-1])]
+        if os.path.basename(root.rstrip("/\\")) == self.model_id.split("/")[-1]:
+            candidates.append(root)
+        for path in candidates:
+            if self._usable(path):
+                return ResolvedModel(self.model_id, os.path.abspath(path), "local_dir")
+        return None
+
+    def _hf_snapshot(self, repo_dir: str) -> Optional[ResolvedModel]:
+        snapshots_dir = os.path.join(repo_dir, "snapshots")
+        commit = _read_ref(repo_dir)
+        if commit:
+            path = os.path.join(snapshots_dir, commit)
+            if self._usable(path):
+                return ResolvedModel(self.model_id, path, "hf_cache", commit)
+        # 没有 refs/main (例如手动拷贝的缓存) 时取最近修改的完整快照
+        try:
+            names = os.listdir(snapshots_dir)
+        except OSError:
+            return None
+        paths = [os.path.join(snapshots_dir, n) for n in names]
+        paths = [p for p in paths if self._usable(p)]
+        if not paths:
+            return None
+        path = max(paths, key=os.path.getmtime)
+        return ResolvedModel(self.model_id, path, "hf_cache", os.path.basename(path))
+
+    def _usable(self, path: str) -> bool:
+        if not _is_model_dir(path):
+            return False
+        if os.path.abspath(path) in self._quarantined:
+            self.log(f"🚫 跳过已隔离的模型快照: {path}")
+            return False
+        return True
+
+    def quarantined(self) -> Dict[str, Dict]:
+        """已隔离的快照: {路径: {reason, quarantined_at}}"""
+        return (self._load_manifest().get(self.model_id) or {}).get("quarantined", {})
+
+    def quarantine(self, path: str, reason: str):
+        """隔离一个快照：之后的解析都跳过它；从清单的 quarantined 中删除该路径即可解除"""
+        path = os.path.abspath(path)
+        manifest = self._load_manifest()
+        entry = manifest.get(self.model_id) or {}
+        entry.setdefault("quarantined", {})[path] = {"reason": reason, "quarantined_at": time.time()}
+        if entry.get("path") == path:
+            for key in ("path", "source", "commit", "resolved_at"):
+                entry.pop(key, None)
+        manifest[self.model_id] = entry
+        self._quarantined.add(path)
+        self._write_manifest(manifest)
+        self.log(f"🚫 已隔离模型快照 {path}: {reason}")
+
+    def release(self, path: str):
+        """解除隔离 (例如强制重新下载的快照已通过完整性校验)"""
+        path = os.path.abspath(path)
+        manifest = self._load_manifest()
+        quarantined = (manifest.get(self.model_id) or {}).get("quarantined", {})
+        if path not in quarantined:
+            return
+        del quarantined[path]
+        self._quarantined.discard(path)
+        self._write_manifest(manifest)
+        self.log(f"✅ 已解除模型快照隔离: {path}")
+
+    def _load_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _from_manifest(self) -> Optional[ResolvedModel]:
+        entry = self._load_manifest().get(self.model_id)
+        if not entry:
+            return None
+        path = entry.get("path")
+        if not path or not self._usable(path):
+            return None
+        if entry.get("source") == "hf_cache" and entry.get("commit"):
+            # refs/main 更新 (拉取了新版本) 后清单失效，重新扫描
+            repo_dir = os.path.dirname(os.path.dirname(path))
+            current = _read_ref(repo_dir)
+            if current is not None and current != entry["commit"]:
+                return None
+        return ResolvedModel(self.model_id, path, "manifest", entry.get("commit"))
+
+    def _record(self, resolved: ResolvedModel):
+        manifest = self._load_manifest()
+        entry = {
+            "path": resolved.path,
+            "source": resolved.source,
+            "commit": resolved.commit,
+            "resolved_at": time.time(),
+        }
+        quarantined = (manifest.get(self.model_id) or {}).get("quarantined")
+        if quarantined:
+            entry["quarantined"] = quarantined
+        manifest[self.model_id] = entry
+        self._write_manifest(manifest)
+
+    def _write_manifest(self, manifest: Dict):
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            self.log(f"⚠️ 模型清单写入失败，下次启动将重新扫描: {e}")
@@ -0,0 +1,67 @@
+"""
+固定提示前缀的 KV 缓存
+
+聊天模板在梦境文本之前的部分 (系统标记 + "请帮我详细解析这个梦境..." 引导语) 对所有请求都相同。
+加载时对这段前缀预填充一次并保存 past_key_values，之后每个请求只需预填充梦境相关的后缀。
+"""
+import hashlib
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import torch
+
+import kv_cache
+
+# 用一个不会出现在梦境中的占位符渲染模板，再据此切出前缀
+_SENTINEL = "<<DREAM_TEXT>>"
+
+
+class PromptPrefixCache:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.prefix_ids: List[int] = []
+        self.cache = None
+        self.hits = 0
+        self.misses = 0
+        self._signature: Optional[str] = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _current_signature(self) -> Tuple[str, str]:
+        """签名覆盖模型名、聊天模板和前缀文本，任一变化都会让缓存失效"""
+        prompt = self.interpreter._build_prompt(_SENTINEL)
+        prefix_text = prompt.split(_SENTINEL, 1)[0]
+        template = str(getattr(self.interpreter.tokenizer, "chat_template", ""))
+        raw = "\n".join([str(self.interpreter.model_name), template, prefix_text])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest(), prefix_text
+
+    def refresh(self):
+        signature, prefix_text = self._current_signature()
+        model = self.interpreter.model
+        start_time = time.time()
+        self.prefix_ids = self.interpreter.tokenizer(prefix_text).input_ids
+        device = next(model.parameters()).device
+        with torch.inference_mode():
+            outputs = model(input_ids=torch.tensor([self.prefix_ids], device=device), use_cache=True)
+        self.cache = kv_cache.to_legacy(outputs.past_key_values)
+        self._signature = signature
+        self._model = model
+        self.interpreter._log_step(
+            f"🧩 提示前缀KV缓存已构建: {len(self.prefix_ids)} tokens (耗时: {time.time() - start_time:.2f}s)"
+        )
+
+    def lookup(self, prompt_ids: List[int]):
+        """返回 (前缀cache, 前缀长度)；提示不以缓存的前缀开头时返回 (None, 0)"""
+        signature, _ = self._current_signature()
+        with self._lock:
+            if signature != self._signature or self._model is not self.interpreter.model:
+                self.refresh()
+            prefix_ids, cache = self.prefix_ids, self.cache
+        n = len(prefix_ids)
+        # 前缀和梦境拼接后分词边界可能变化，必须逐token确认一致，并且至少留一个token给后缀
+        if n == 0 or len(prompt_ids) <= n or prompt_ids[:n] != prefix_ids:
+            self.misses += 1
+            return None, 0
+        self.hits += 1
+        return cache, n
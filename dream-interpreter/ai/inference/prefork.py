@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+预派生 (pre-fork) 多进程服务模式 (仅 Linux/macOS)
+
+父进程只加载一次模型，调用 gc.freeze() 把已加载的对象移出垃圾回收的扫描范围，
+再 fork 出 N 个 worker 共享同一个监听端口。模型权重以写时复制 (copy-on-write) 的方式被所有
+worker 共享，GC 不会再触碰这些对象，因此每多一个 worker 只增加少量私有内存。
+每个 worker 绑定自己的一组 CPU 核心，并把 torch 线程数设为这组核心的数量。
+
+启动方式:
+    WEB_WORKERS=4 python prefork.py
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+
+def memory_usage() -> Dict[str, int]:
+    """读取 /proc/self/smaps_rollup，返回 Rss/Pss/私有内存 (MB)"""
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if parts[0] in ("Rss:", "Pss:", "Private_Clean:", "Private_Dirty:"):
+                    usage[parts[0].rstrip(":").lower()] = int(parts[1]) // 1024
+    except OSError:
+        pass
+    if usage:
+        usage["private"] = usage.pop("private_clean", 0) + usage.pop("private_dirty", 0)
+    return usage
+
+
+def _cpu_slices(workers: int) -> List[List[int]]:
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cpus) // workers)
+    return [cpus[i * per_worker:(i + 1) * per_worker] or cpus for i in range(workers)]
+
+
+def _serve(service_app, sock: socket.socket, index: int, cpus: List[int]):
+    import torch
+    from werkzeug.serving import make_server
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    # 任务线程在设置好 CPU 亲和性之后、在 worker 自己的进程里启动 (父进程从不启动任务线程)
+    service_app.start_jobs()
+    server = make_server(sock.getsockname()[0], sock.getsockname()[1], service_app.app, threaded=True, fd=sock.fileno())
+    print(f"[worker {index}] pid={os.getpid()} cpus={cpus} torch_threads={torch.get_num_threads()} memory={memory_usage()}")
+    server.serve_forever()
+
+
+def main():
+    if not hasattr(os, "fork"):
+        print("❌ 预派生模式需要 os.fork，请在 Linux/macOS 上运行，或直接使用 app.py")
+        sys.exit(1)
+
+    workers = int(os.environ.get("WEB_WORKERS", "2"))
+    host = os.environ.get("HOST", "0.0.0.0")
+    port = int(os.environ.get("PORT", 5000))
+
+    # 导入 app 会在父进程中开始加载模型；必须等加载结束再 fork，否则每个 worker 各自持有一份未完成的加载状态。
+    # 引擎线程和任务线程都在各个 worker 中才启动
+    import app as service_app
+
+    if service_app.interpreter is not None:
+        service_app.interpreter.loaded.wait()
+
+    # 加载阶段产生的垃圾先回收掉，再冻结剩余对象，避免 worker 里的 GC 写脏共享页
+    gc.collect()
+    gc.freeze()
+    print(f"🧊 已冻结 {gc.get_freeze_count()} 个对象，父进程内存: {memory_usage()}")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    slices = _cpu_slices(workers)
+    children: Dict[int, int] = {}
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _serve(service_app, sock, index, slices[index])
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def shutdown(signum, frame):
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(workers):
+        spawn(index)
+    print(f"🚀 已启动 {workers} 个 worker，监听 {host}:{port}")
+
+    # 退出的 worker 自动重新派生，仍然共享父进程中的模型
+    while True:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is not None:
+            print(f"⚠️ worker {index} (pid={pid}) 退出，状态 {status}，正在重新启动")
+            time.sleep(1)
+            spawn(index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+CPU 权重量化 (weight-only int8 / int4)
+
+把模型中的 nn.Linear 替换为只量化权重的线性层：int8 为逐输出通道对称量化，
+int4 为按组 (默认 128 列一组) 对称量化并两两打包进一个字节。激活仍使用浮点计算。
+
+解码提速依赖 torch 的打包矩阵乘内核 (int8: _weight_int8pack_mm，int4: _weight_int4pack_mm_for_cpu，
+torch 2.6+)，权重不展开成浮点矩阵直接参与计算。内核不可用时退回每次把权重转换成浮点再做矩阵乘，
+这时量化只节省内存，解码反而比浮点模型慢；加载时会检查内核并在加载步骤中说明。
+
+第一次启动时从原始权重量化，并把量化后的 state_dict 写到产物缓存目录 (QUANTIZED_DIR，
+默认 ~/.cache/dream-interpreter/quantized，不写进模型快照目录)；
+之后的启动直接以内存映射 (mmap) 方式加载该产物，不再读取原始权重、也不再重新量化。
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Dict, Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+SUPPORTED_MODES = ("int8", "int4")
+ARTIFACT_VERSION = 1
+
+# torch 内置的 int8 / int4 权重矩阵乘在部分平台/版本上不可用，失败一次后改用反量化路径
+_int8pack_mm_available = hasattr(torch, "_weight_int8pack_mm")
+_int4pack_mm_available = hasattr(torch, "_weight_int4pack_mm_for_cpu") and hasattr(torch, "_convert_weight_to_int4pack_for_cpu")
+# int4 内核的权重布局参数，in_features 需要是 INT4_INNER_K_TILES * 16 的倍数
+INT4_INNER_K_TILES = 8
+
+
+class WeightOnlyInt8Linear(nn.Module):
+    def __init__(self, in_features: int, out_features: int, bias: bool, device=None, dtype=torch.float32):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight", torch.empty((out_features, in_features), dtype=torch.int8, device=device))
+        self.register_buffer("scales", torch.empty(out_features, dtype=dtype, device=device))
+        self.register_buffer("bias", torch.empty(out_features, dtype=dtype, device=device) if bias else None)
+
+    @classmethod
+    def from_linear(cls, linear: nn.Linear) -> "WeightOnlyInt8Linear":
+        weight = linear.weight.detach().float()
+        scales = weight.abs().amax(dim=1).clamp(min=1e-8) / 127.0
+        module = cls(linear.in_features, linear.out_features, linear.bias is not None, dtype=linear.weight.dtype)
+        module.weight = torch.round(weight / scales[:, None]).clamp(-127, 127).to(torch.int8)
+        module.scales = scales.to(linear.weight.dtype)
+        if linear.bias is not None:
+            module.bias = linear.bias.detach().clone()
+        return module
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        global _int8pack_mm_available
+        shape = x.shape[:-1] + (self.out_features,)
+        x2d = x.reshape(-1, self.in_features)
+        out = None
+        if _int8pack_mm_available:
+            try:
+                out = torch._weight_int8pack_mm(x2d, self.weight, self.scales.to(x.dtype))
+            except RuntimeError:
+                _int8pack_mm_available = False
+        if out is None:
+            # 没有内核时每次把 int8 权重转成浮点 (只省内存，不提速)；逐通道缩放移到矩阵乘之后
+            out = F.linear(x2d, self.weight.to(x.dtype)) * self.scales.to(x.dtype)
+        if self.bias is not None:
+            out = out + self.bias.to(x.dtype)
+        return out.reshape(shape)
+
+
+class WeightOnlyInt4Linear(nn.Module):
+    def __init__(self, in_features: int, out_features: int, bias: bool, group_size: int = 128,
+                 device=None, dtype=torch.float32):
+        super().__init__()
+        if in_features % group_size or in_features % 2:
+            raise ValueError(f"in_features={in_features} 不能被 group_size={group_size} 整除")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size
+        # 每个字节存两个 4 位有符号整数 (低 4 位为偶数列，高 4 位为奇数列)
+        self.register_buffer("packed_weight", torch.empty((out_features, in_features // 2), dtype=torch.uint8, device=device))
+        self.register_buffer("scales", torch.empty((out_features, in_features // group_size), dtype=dtype, device=device))
+        self.register_buffer("bias", torch.empty(out_features, dtype=dtype, device=device) if bias else None)
+        # prepare() 转换出的内核权重布局，不进 state_dict (产物保存的是与 torch 版本无关的打包格式)
+        self._kernel_weight: Optional[torch.Tensor] = None
+        self._scales_and_zeros: Optional[torch.Tensor] = None
+
+    @classmethod
+    def from_linear(cls, linear: nn.Linear, group_size: int = 128) -> "WeightOnlyInt4Linear":
+        module = cls(linear.in_features, linear.out_features, linear.bias is not None, group_size, dtype=linear.weight.dtype)
+        weight = linear.weight.detach().float().reshape(linear.out_features, -1, group_size)
+        scales = weight.abs().amax(dim=2).clamp(min=1e-8) / 7.0
+        q = torch.round(weight / scales[:, :, None]).clamp(-8, 7).to(torch.int8).reshape(linear.out_features, -1)
+        q = (q & 0x0F).to(torch.uint8)
+        module.packed_weight = q[:, 0::2] | (q[:, 1::2] << 4)
+        module.scales = scales.to(linear.weight.dtype)
+        if linear.bias is not None:
+            module.bias = linear.bias.detach().clone()
+        return module
+
+    def _unpack(self) -> torch.Tensor:
+        """还原成 [-8, 7] 的有符号整数矩阵"""
+        low = (self.packed_weight & 0x0F).to(torch.int8)
+        high = (self.packed_weight >> 4).to(torch.int8)
+        q = torch.stack([low, high], dim=-1).reshape(self.out_features, self.in_features)
+        return torch.where(q > 7, q - 16, q)
+
+    def dequantize(self, dtype: torch.dtype) -> torch.Tensor:
+        q = self._unpack()
+        weight = q.reshape(self.out_features, -1, self.group_size).to(dtype) * self.scales.to(dtype)[:, :, None]
+        return weight.reshape(self.out_features, self.in_features)
+
+    def prepare(self, dtype: torch.dtype) -> bool:
+        """转换成 CPU int4 矩阵乘内核的权重布局，并与反量化结果对比确认数值一致；返回是否可以使用内核"""
+        global _int4pack_mm_available
+        if not _int4pack_mm_available or self.in_features % (INT4_INNER_K_TILES * 16):
+            return False
+        try:
+            # 内核按 (q - 8) * scale + zero 反量化：有符号值平移到 [0, 15]，zero 取 0
+            q = (self._unpack().to(torch.int32) + 8).contiguous()
+            weight = torch._convert_weight_to_int4pack_for_cpu(q, INT4_INNER_K_TILES)
+            scales = self.scales.to(dtype).t().contiguous()
+            scales_and_zeros = torch.stack([scales, torch.zeros_like(scales)], dim=-1).contiguous()
+            probe = torch.randn((2, self.in_features), dtype=dtype)
+            out = torch._weight_int4pack_mm_for_cpu(probe, weight, self.group_size, scales_and_zeros)
+            expected = F.linear(probe.float(), self.dequantize(torch.float32))
+            if not torch.allclose(out.float(), expected, rtol=5e-2, atol=5e-2 * float(expected.abs().max())):
+                raise RuntimeError("int4 内核结果与反量化结果不一致")
+        except (RuntimeError, TypeError):
+            _int4pack_mm_available = False
+            return False
+        self._kernel_weight, self._scales_and_zeros = weight, scales_and_zeros
+        return True
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        bias = self.bias.to(x.dtype) if self.bias is not None else None
+        if self._kernel_weight is not None and x.dtype == self._scales_and_zeros.dtype:
+            x2d = x.reshape(-1, self.in_features)
+            out = torch._weight_int4pack_mm_for_cpu(x2d, self._kernel_weight, self.group_size, self._scales_and_zeros)
+            out = out.reshape(x.shape[:-1] + (self.out_features,))
+            return out + bias if bias is not None else out
+        # 没有内核时每次展开成浮点权重 (只省内存，不提速)
+        return F.linear(x, self.dequantize(x.dtype), bias)
+
+
+def quantize_model(model: nn.Module, mode: str, group_size: int = 128, skip=("lm_head",)) -> nn.Module:
+    """把模型中的 nn.Linear 原地替换为量化线性层；输出层默认保留浮点以保证质量"""
+    if mode not in SUPPORTED_MODES:
+        raise ValueError(f"不支持的量化模式: {mode}")
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            full_name = f"{name}.{child_name}" if name else child_name
+            if not isinstance(child, nn.Linear) or any(full_name.endswith(s) for s in skip):
+                continue
+            if child.weight.is_meta:
+                # 只搭骨架，权重随后从产物文件加载
+                if mode == "int8":
+                    quantized = WeightOnlyInt8Linear(child.in_features, child.out_features, child.bias is not None,
+                                                     device="meta", dtype=child.weight.dtype)
+                else:
+                    quantized = WeightOnlyInt4Linear(child.in_features, child.out_features, child.bias is not None,
+                                                     group_size, device="meta", dtype=child.weight.dtype)
+            elif mode == "int8":
+                quantized = WeightOnlyInt8Linear.from_linear(child)
+            else:
+                quantized = WeightOnlyInt4Linear.from_linear(child, group_size)
+            setattr(module, child_name, quantized)
+    return model
+
+
+def prepare_quantized_model(model: nn.Module, mode: str, dtype: torch.dtype, log: Callable[[str], None] = print):
+    """加载后检查打包矩阵乘内核；不可用时明确提示该模式只节省内存"""
+    global _int8pack_mm_available
+    layers = [m for m in model.modules() if isinstance(m, (WeightOnlyInt8Linear, WeightOnlyInt4Linear))]
+    if mode == "int4":
+        fast = sum(layer.prepare(dtype) for layer in layers)
+    else:
+        fast = 0
+        if _int8pack_mm_available and layers:
+            layer = layers[0]
+            try:
+                torch._weight_int8pack_mm(torch.zeros((1, layer.in_features), dtype=dtype), layer.weight, layer.scales.to(dtype))
+                fast = len(layers)
+            except RuntimeError:
+                _int8pack_mm_available = False
+    if fast == len(layers):
+        log(f"⚡ {mode}打包矩阵乘内核可用 ({fast} 层)")
+    elif fast:
+        log(f"⚡ {mode}打包矩阵乘内核可用于 {fast}/{len(layers)} 层，其余层每次展开成浮点权重")
+    else:
+        log(f"⚠️ 当前 torch 没有可用的 {mode} CPU 矩阵乘内核：量化只节省内存，解码速度会低于浮点模型")
+
+
+def _source_signature(model_name: str, mode: str, group_size: int, dtype: torch.dtype) -> str:
+    """原始权重 (文件名/大小/修改时间)、量化模式和计算精度共同决定产物是否仍然有效"""
+    parts = [model_name, mode, str(group_size), str(dtype), str(ARTIFACT_VERSION)]
+    if os.path.isdir(model_name):
+        for name in sorted(os.listdir(model_name)):
+            if name.endswith((".safetensors", ".bin", "config.json")) and not name.startswith("quantized-"):
+                stat = os.stat(os.path.join(model_name, name))
+                parts.append(f"{name}:{stat.st_size}:{int(stat.st_mtime)}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def artifact_dir(model_name: str) -> str:
+    """产物放在单独的缓存目录，不写进模型快照 (快照目录由 HF 缓存管理，多出的文件也会干扰完整性校验)；
+    本地路径按 目录名 + 路径哈希 区分，同名的不同快照不会互相覆盖"""
+    root = os.environ.get("QUANTIZED_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "dream-interpreter", "quantized"
+    )
+    if os.path.isdir(model_name):
+        path = os.path.abspath(model_name)
+        safe_name = f"{os.path.basename(path.rstrip(os.sep))}-{hashlib.sha256(path.encode('utf-8')).hexdigest()[:12]}"
+    else:
+        safe_name = model_name.replace("/", "--")
+    return os.path.join(root, safe_name)
+
+
+def load_quantized_model(model_name: str, config, mode: str, load_kwargs: Dict,
+                         log: Callable[[str], None] = print, model_cls=None) -> nn.Module:
+    """加载量化模型：产物有效时以 mmap 方式加载，否则从原始权重量化并写出产物"""
+    from transformers import AutoModelForCausalLM
+
+    # 在读取原始权重之前检查，配置错误时不必先把完整的 fp32 模型加载一遍
+    if mode not in SUPPORTED_MODES:
+        raise ValueError(f"不支持的量化模式: {mode}")
+
+    model_cls = model_cls or AutoModelForCausalLM
+    group_size = int(os.environ.get("QUANT_GROUP_SIZE", "128"))
+    dtype = load_kwargs.get("torch_dtype", torch.float32)
+    signature = _source_signature(model_name, mode, group_size, dtype)
+    directory = artifact_dir(model_name)
+    weights_path = os.path.join(directory, f"quantized-{mode}.pt")
+    meta_path = os.path.join(directory, f"quantized-{mode}.json")
+
+    meta: Optional[Dict] = None
+    if os.path.exists(weights_path) and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("signature") != signature:
+            log(f"♻️ 量化产物与当前模型不匹配，将重新量化: {weights_path}")
+            meta = None
+        elif load_kwargs.get("force_download"):
+            # 原始快照被隔离后重新下载，由它量化出的旧产物同样不可信
+            log(f"♻️ 模型快照已重新下载，将重新量化: {weights_path}")
+            meta = None
+
+    if meta is not None:
+        from accelerate import init_empty_weights
+
+        start_time = time.time()
+        # 参数只在 meta 设备上搭骨架，buffer (如旋转位置编码) 正常创建
+        with init_empty_weights(include_buffers=False):
+            model = model_cls.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+        quantize_model(model, mode, group_size)
+        state_dict = torch.load(weights_path, mmap=True, weights_only=True, map_location="cpu")
+        model.load_state_dict(state_dict, assign=True)
+        model.tie_weights()
+        model.eval()
+        log(f"📦 已通过内存映射加载{mode}量化产物 (耗时: {time.time() - start_time:.2f}s): {weights_path}")
+        prepare_quantized_model(model, mode, dtype, log)
+        return model
+
+    start_time = time.time()
+    model = model_cls.from_pretrained(model_name, **load_kwargs)
+    quantize_model(model, mode, group_size)
+    model.eval()
+    log(f"🗜️ {mode}量化完成 (耗时: {time.time() - start_time:.2f}s)")
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = weights_path + ".tmp"
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, weights_path)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"signature": signature, "mode": mode, "group_size": group_size,
+                       "dtype": str(dtype), "created_at": time.time()}, f, indent=2)
+        log(f"💾 量化产物已保存: {weights_path} ({os.path.getsize(weights_path) / 1024 ** 3:.2f} GB)")
+    except OSError as e:
+        log(f"⚠️ 量化产物保存失败，下次启动将重新量化: {e}")
+    prepare_quantized_model(model, mode, dtype, log)
+    return model
@@ -0,0 +1,120 @@
+"""
+解析结果缓存
+
+只缓存确定性解码 (贪心) 且完整结束 (eos 或提前结束条件) 的结果，命中时可以原样作为完整解析返回；
+键由规范化后的梦境文本、模型标识和生成参数组成。
+内存中是带 TTL 的有界 LRU，可选的 SQLite 文件在 app.py 重启后仍然有效。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# 用完 max_new_tokens (length) 或超过截止时间 (deadline) 的结果是截断的，不进缓存
+CACHEABLE_FINISH_REASONS = ("eos", "stop")
+
+
+def normalize_dream(text: str) -> str:
+    """全角/半角统一、去掉首尾空白、合并连续空白并转小写"""
+    text = unicodedata.normalize("NFKC", text).strip().lower()
+    return re.sub(r"\s+", " ", text)
+
+
+class ResultCache:
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None,
+                 disk_path: Optional[str] = None):
+        self.max_entries = max_entries or int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.environ.get("RESULT_CACHE_TTL", "86400"))
+        disk_path = disk_path if disk_path is not None else os.environ.get("RESULT_CACHE_PATH", "")
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk_path = disk_path or None
+        self._conn = None
+        self._conn_pid = None
+        if self.disk_path:
+            db = self._db
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            db.commit()
+
+    @property
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """SQLite 连接不能跨 fork 使用，每个进程各自打开"""
+        if self.disk_path is None:
+            return None
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(text: str, model_id: str, params: Dict) -> str:
+        raw = json.dumps(
+            {"text": normalize_dream(text), "model": model_id, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                del self._entries[key]
+                self.counters["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] >= now:
+                    self._remember(key, row[0], row[1])
+                    self.counters["hits"] += 1
+                    self.counters["disk_hits"] += 1
+                    return row[0]
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            stats["hit_rate"] = round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            return stats
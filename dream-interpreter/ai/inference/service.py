@@ -1,17 +1,187 @@
+import contextlib
 import os
+import threading
 import torch
 import time
-from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig, LogitsProcessorList, StoppingCriteriaList
 from typing import Optional, List, Dict
 
+from kv_cache import cache_length, crop, from_legacy, to_legacy
+from integrity import IntegrityCheck, integrity_policy
+from model_resolver import DEFAULT_MODEL_ID, ModelResolver
+from prefix_cache import PromptPrefixCache
+from quantization import SUPPORTED_MODES as QUANT_MODES, load_quantized_model
+from result_cache import CACHEABLE_FINISH_REASONS, ResultCache
+from sessions import Session, SessionStore
+from shard_loader import load_sharded_model
+from speculative import SpeculativeDecoder
+from stopping import EarlyStoppingCriteria, StoppingStats, StopMonitor, configured_criteria, configured_stop_strings
+from symbol_lexicon import load_lexicon
+from thinking import REASONING_MODES, ThinkingController, shape_result, split_reasoning
+
+def cpu_supports_bf16() -> bool:
+    """CPU 是否有原生 bf16 指令 (AVX512-BF16 或 AMX-BF16)"""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+class GenerationBudget:
+    """单个请求的生成预算：最大新token数、墙钟截止时间、贪心或采样解码、推理(<think>)token预算"""
+
+    def __init__(self, max_new_tokens: Optional[int] = None, deadline_s: Optional[float] = None,
+                 greedy: Optional[bool] = None, thinking_budget: Optional[int] = None,
+                 reasoning: Optional[str] = None, stop_strings: Optional[List[str]] = None):
+        self.max_new_tokens = max_new_tokens or int(os.environ.get("MAX_NEW_TOKENS", "256"))
+        self.deadline_s = deadline_s
+        # 未显式指定时由 DETERMINISTIC_DECODE 环境变量决定是否使用贪心解码
+        self.greedy = greedy if greedy is not None else os.environ.get("DETERMINISTIC_DECODE", "0") == "1"
+        # 推理部分最多使用的token数，超出后强制结束推理；THINKING_BUDGET 未设置时不限制
+        if thinking_budget is None and os.environ.get("THINKING_BUDGET"):
+            thinking_budget = int(os.environ["THINKING_BUDGET"])
+        self.thinking_budget = thinking_budget
+        # keep: 原样返回推理；strip: 只返回答案；separate: 推理放在单独的 reasoning 字段
+        self.reasoning = reasoning or os.environ.get("REASONING_MODE", "keep")
+        # 出现即结束生成的字符串，未指定时使用 STOP_STRINGS 环境变量
+        self.stop_strings = list(stop_strings) if stop_strings is not None else configured_stop_strings()
+        self.created_at = time.time()
+
+    @classmethod
+    def from_request(cls, data: Dict) -> "GenerationBudget":
+        """从请求JSON中解析 max_new_tokens / deadline_ms / greedy (兼容 deterministic)，非法取值抛出 ValueError"""
+        max_new_tokens = data.get("max_new_tokens")
+        if max_new_tokens is not None:
+            max_new_tokens = int(max_new_tokens)
+            if not 1 <= max_new_tokens <= int(os.environ.get("MAX_NEW_TOKENS_LIMIT", "2048")):
+                raise ValueError("max_new_tokens out of range")
+        deadline_ms = data.get("deadline_ms")
+        if deadline_ms is not None:
+            deadline_ms = float(deadline_ms)
+            if deadline_ms <= 0:
+                raise ValueError("deadline_ms must be positive")
+        greedy = data.get("greedy", data.get("deterministic"))
+        thinking_budget = data.get("thinking_budget")
+        if thinking_budget is not None:
+            thinking_budget = int(thinking_budget)
+            if thinking_budget < 0:
+                raise ValueError("thinking_budget must be non-negative")
+        reasoning = data.get("reasoning")
+        if reasoning is not None and reasoning not in REASONING_MODES:
+            raise ValueError(f"reasoning must be one of {', '.join(REASONING_MODES)}")
+        stop = data.get("stop")
+        if isinstance(stop, str):
+            stop = [stop]
+        if stop is not None and not all(isinstance(s, str) and s for s in stop):
+            raise ValueError("stop must be a string or a list of non-empty strings")
+        return cls(
+            max_new_tokens=max_new_tokens,
+            deadline_s=deadline_ms / 1000.0 if deadline_ms is not None else None,
+            greedy=bool(greedy) if greedy is not None else None,
+            thinking_budget=thinking_budget,
+            reasoning=reasoning,
+            stop_strings=stop,
+        )
+
+    @property
+    def deadline_at(self) -> Optional[float]:
+        return self.created_at + self.deadline_s if self.deadline_s is not None else None
+
+    def remaining(self) -> Optional[float]:
+        return max(0.0, self.deadline_at - time.time()) if self.deadline_s is not None else None
+
+    def expired(self) -> bool:
+        return self.deadline_s is not None and time.time() >= self.deadline_at
+
+    def key(self):
+        """预算相同的请求才能放进同一次批量 generate (reasoning 决定结果如何整理，也要一致)"""
+        return (self.max_new_tokens, self.greedy, self.deadline_s, self.thinking_budget, self.reasoning,
+                tuple(self.stop_strings))
+
+    def generate_kwargs(self) -> Dict:
+        kwargs = {"max_new_tokens": self.max_new_tokens}
+        if self.greedy:
+            kwargs["do_sample"] = False
+        else:
+            kwargs.update(do_sample=True, temperature=0.7, top_p=0.9)
+        if self.deadline_s is not None:
+            kwargs["max_time"] = self.remaining()
+        return kwargs
+
+    def describe(self) -> str:
+        decode = "贪心解码(确定性模式)" if self.greedy else "temperature=0.7, top_p=0.9"
+        deadline = f", deadline={self.deadline_s * 1000:.0f}ms" if self.deadline_s is not None else ""
+        thinking = f", thinking_budget={self.thinking_budget}" if self.thinking_budget is not None else ""
+        return f"max_new_tokens={self.max_new_tokens}, {decode}{deadline}{thinking}"
+
+
+class _ProgressBar:
+    """包装 transformers 的进度条，每推进一步回调 (已完成数, 总数)，其余行为原样转发"""
+
+    def __init__(self, bar, total: Optional[int], callback):
+        self._bar = bar
+        self._total = total
+        self._callback = callback
+        self._done = 0
+
+    def __iter__(self):
+        for item in self._bar:
+            yield item
+            # 迭代器恢复时说明调用方已经处理完上一个分片
+            self._advance(1)
+
+    def update(self, n: int = 1):
+        result = self._bar.update(n)
+        self._advance(n)
+        return result
+
+    def _advance(self, n: int):
+        self._done += n
+        self._callback(self._done, self._total)
+
+    def __enter__(self):
+        self._bar.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._bar.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._bar, name)
+
+
 class DreamInterpreter:
-    def __init__(self, verbose: bool = True):
+    def __init__(self, verbose: bool = True, load: bool = True):
         self.verbose = verbose
         self.loading_steps = []
         self.inference_steps = []
         self.model = None
         self.tokenizer = None
         self.use_llm = False
+        self.quantization = None
+        self.compiled = False
+        self._eager_forward = None
+        self.warmup_stats = None
+        self.prefix_cache = None
+        self.speculative = None
+        self.draft_model_name = None
+        self.thinking = None
+        self._prompt_opens_thinking = None
+        self.stopping_stats = StoppingStats()
+        self.result_cache = ResultCache()
+        self.sessions = SessionStore()
+        self.integrity = None
+        # 规则引擎的符号词典在构造时编译，模型加载期间的兜底请求不承担编译开销
+        self.lexicon = load_lexicon(log=self._log_step)
+        # 加载状态: pending / loading / ready / failed；loaded 在加载结束 (无论成败) 后置位
+        self.load_state = "pending"
+        self.load_progress = 0.0
+        self.load_error = None
+        self.shards_loaded = 0
+        self.shards_total = None
+        self.loaded = threading.Event()
         
         os.environ.setdefault("HF_ENDPOINT", "https://hf-mirror.com")
         os.environ.setdefault("HF_HUB_BASE_URL", "https://hf-mirror.com")
@@ -19,18 +189,65 @@ class DreamInterpreter:
             if k in os.environ:
                 os.environ.pop(k)
 
-        # 检查本地模型路径
-        local_model_path = self._find_local_model()
-        if local_model_path:
-            self.model_name = local_model_path
-            self._log_step(f"🎯 使用本地模型: {local_model_path}")
-        else:
-            self.model_name = os.environ.get("MODEL_NAME", "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B")
+        # 离线优先解析模型路径：清单 -> 配置的搜索路径/HF缓存 (refs/main) -> (允许时) 远程模型ID
+        self.resolved_model = None
+        self._resolve_error = None
+        resolve_start = time.time()
+        try:
+            self.resolved_model = ModelResolver(log=self._log_step).resolve()
+            self.model_name = self.resolved_model.path
+        except FileNotFoundError as e:
+            self.model_name = os.environ.get("MODEL_NAME", DEFAULT_MODEL_ID)
+            self._resolve_error = e
+        resolve_ms = (time.time() - resolve_start) * 1000
+        if self.resolved_model is not None and self.resolved_model.local:
+            self._log_step(f"🎯 使用本地模型: {self.model_name} (来源: {self.resolved_model.source}, 解析耗时: {resolve_ms:.0f}ms)")
+        elif self.resolved_model is not None:
             self._log_step(f"🌐 使用远程模型: {self.model_name}")
-        
+        self._local_model_path = self.model_name if self.resolved_model is not None and self.resolved_model.local else None
+
+        if load:
+            self.load()
+
+    @property
+    def ready(self) -> bool:
+        """大模型已加载完成并可以接收请求"""
+        return self.loaded.is_set() and self.use_llm
+
+    def load_in_background(self) -> threading.Thread:
+        """在后台线程中加载模型，调用方可以立即开始服务 (加载完成前由规则引擎兜底)"""
+        thread = threading.Thread(target=self.load, name="model-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def loading_status(self) -> Dict:
+        return {
+            "state": self.load_state,
+            "progress": round(self.load_progress, 1),
+            "shards_loaded": self.shards_loaded,
+            "shards_total": self.shards_total,
+            "error": self.load_error,
+            "integrity": self.integrity.status if self.integrity is not None else None,
+        }
+
+    def load(self):
+        local_model_path = self._local_model_path
+        self.load_state = "loading"
         try:
+            if self._resolve_error is not None:
+                raise self._resolve_error
+            quant_mode = os.environ.get("CPU_QUANTIZATION", "").lower()
+            if quant_mode and quant_mode not in QUANT_MODES:
+                # 配置错误在加载分词器和权重之前就报出来
+                raise ValueError(f"不支持的 CPU_QUANTIZATION={quant_mode} (可选: {', '.join(QUANT_MODES)})")
             self._log_step(f"🚀 开始加载模型: {self.model_name}")
-            self._log_step(f"📡 使用镜像: {os.environ.get('HF_ENDPOINT')}")
+            hub_kwargs = {"local_files_only": local_model_path is not None}
+            if local_model_path is None:
+                self._log_step(f"📡 使用镜像: {os.environ.get('HF_ENDPOINT')}")
+                if self.resolved_model is not None and self.resolved_model.force_download:
+                    hub_kwargs["force_download"] = True
+            else:
+                self._start_integrity_check(local_model_path)
 
             self._log_step("📚 正在加载分词器...")
             start_time = time.time()
@@ -39,17 +256,25 @@ class DreamInterpreter:
             config = AutoConfig.from_pretrained(
                 self.model_name,
                 trust_remote_code=True,
-                local_files_only=local_model_path is not None
+                **hub_kwargs
             )
             self._log_step(f"🔍 模型类型: {config.model_type}")
             
+            # 直接复用已加载的配置，分词器不再重复读取 config.json
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.model_name,
+                config=config,
                 trust_remote_code=True,
-                local_files_only=local_model_path is not None
+                **hub_kwargs
             )
+            # 批量生成需要左填充；部分模型没有pad token，复用eos
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.thinking = ThinkingController(self.tokenizer)
             load_time = time.time() - start_time
             self._log_step(f"✅ 分词器加载完成 (耗时: {load_time:.2f}s)")
+            self.load_progress = 5.0
 
             if torch.cuda.is_available():
                 self._log_step(f"🎮 CUDA可用，GPU: {torch.cuda.get_device_name(0)}")
@@ -59,70 +284,288 @@ class DreamInterpreter:
             self._log_step("🧠 正在加载模型(这可能需要一些时间)...")
             start_time = time.time()
             load_kwargs = {
+                "config": config,
                 "trust_remote_code": True,
-                "local_files_only": local_model_path is not None,
+                **hub_kwargs,
             }
             if torch.cuda.is_available():
                 load_kwargs["torch_dtype"] = torch.float16
                 load_kwargs["device_map"] = "auto"
             else:
-                load_kwargs["torch_dtype"] = torch.float32
+                load_kwargs["torch_dtype"] = self._cpu_dtype()
 
             # 根据模型类型选择合适的加载方式
             if config.model_type == "qwen2":
                 from transformers import Qwen2ForCausalLM
-                self.model = Qwen2ForCausalLM.from_pretrained(
-                    self.model_name,
-                    **load_kwargs,
-                )
+                model_cls = Qwen2ForCausalLM
             else:
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    self.model_name,
-                    **load_kwargs,
-                )
+                model_cls = AutoModelForCausalLM
+
+            model = None
+            with self._track_shard_progress():
+                # CPU 量化模式：首次量化并保存产物，之后以内存映射方式直接加载
+                if quant_mode and not torch.cuda.is_available():
+                    self._log_step(f"🗜️ 使用CPU权重量化模式: {quant_mode}")
+                    self.quantization = quant_mode
+                    model = load_quantized_model(self.model_name, config, quant_mode, load_kwargs, log=self._log_step)
+                # 快速加载：并行预读全部分片，逐张量直接物化到目标精度 (仅本地 safetensors 快照)
+                elif os.environ.get("MODEL_LOADER", "default") == "fast" and local_model_path is not None:
+                    try:
+                        model = load_sharded_model(
+                            self.model_name, config, load_kwargs["torch_dtype"], model_cls,
+                            device="cuda:0" if torch.cuda.is_available() else "cpu",
+                            log=self._log_step, on_shard=self._on_shard_loaded,
+                        )
+                    except Exception as e:
+                        self._log_step(f"⚠️ 快速加载失败，改用 from_pretrained: {e}")
+                if model is None:
+                    model = model_cls.from_pretrained(
+                        self.model_name,
+                        **load_kwargs,
+                    )
             if not torch.cuda.is_available():
-                self.model = self.model.to("cpu")
+                model = model.to("cpu")
+            self.model = model
             load_time = time.time() - start_time
             self._log_step(f"✅ 模型加载完成 (耗时: {load_time:.2f}s)")
+            self.load_progress = 90.0
             self.use_llm = True
+            if local_model_path is None:
+                # 按模型 ID 加载时校验 transformers 实际使用的缓存快照，与后续的编译、预热并行
+                self._check_downloaded_snapshot()
         
             if hasattr(self.model, 'config'):
                 self._log_step(f"📊 模型参数: {getattr(self.model.config, 'n_parameters', '未知')}")
                 self._log_step(f"📝 词汇表大小: {getattr(self.model.config, 'vocab_size', '未知')}")
+
+            # 静态KV缓存 + 编译解码步，去掉逐token的Python和算子分发开销
+            if os.environ.get("COMPILE_DECODE", "0") == "1":
+                self._enable_compiled_decode()
+
+            # 小草稿模型提出候选token，主模型一次前向验证多个位置
+            # (编译解码步固定了输入形状，验证时的变长前向会反复重新编译，两者不同时启用)
+            if os.environ.get("DRAFT_MODEL_NAME"):
+                if self.compiled:
+                    self._log_step("⚠️ 已启用编译解码步，跳过投机解码")
+                else:
+                    self._load_draft_model(os.environ["DRAFT_MODEL_NAME"], load_kwargs)
+
+            # 预先计算聊天模板固定前缀的KV，之后每个请求只需预填充梦境部分
+            # (编译路径使用静态缓存，不能再传入动态的前缀KV)
+            if not self.compiled:
+                self._build_prefix_cache()
+
+            # 编译和首轮算子初始化放在启动阶段，第一个真实请求不再承担这部分开销；
+            # 预热失败 (多半是编译失败) 不影响模型就绪，关闭编译后继续
+            if os.environ.get("WARMUP_ON_START", "1") != "0":
+                try:
+                    self._warmup()
+                except Exception as e:
+                    self._log_step(f"⚠️ 预热失败: {e}")
+                    if self.compiled:
+                        self._disable_compiled_decode()
+                        self._build_prefix_cache()
+            self._enforce_integrity()
+            self.load_progress = 100.0
+            self.load_state = "ready"
         except Exception as e:
+            self.use_llm = False
+            self.load_error = str(e)
+            self.load_state = "failed"
             self._log_step(f"❌ 模型加载失败，将使用规则引擎: {e}")
+        finally:
+            self.loaded.set()
 
-    def _find_local_model(self) -> Optional[str]:
-        """查找本地DeepSeek模型路径"""
-        possible_paths = [
-            # Windows常见路径
-            os.path.expanduser("~\\.cache\\huggingface\\hub\\models--deepseek-ai--DeepSeek-R1-Distill-Qwen-7B\\snapshots"),
-            "D:\\models\\deepseek-ai\\DeepSeek-R1-Distill-Qwen-7B",
-            "E:\\models\\deepseek-ai\\DeepSeek-R1-Distill-Qwen-7B",
-            "./models/deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
-            "../models/deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
-        ]
-        
-        for base_path in possible_paths:
-            if os.path.exists(base_path):
-                if "snapshots" in base_path:
-                    # 如果是snapshots目录，查找最新版本
-                    try:
-                        subdirs = [d for d in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, d))]
-                        if subdirs:
-                            latest_snapshot = os.path.join(base_path, sorted(subdirs)[-1])
-                            config_path = os.path.join(latest_snapshot, "config.json")
-                            if os.path.exists(config_path):
-                                return latest_snapshot
-                    except Exception:
-                        pass
-                else:
-                    # 直接检查模型目录
-                    config_path = os.path.join(base_path, "config.json")
-                    if os.path.exists(config_path):
-                        return base_path
-        
-        return None
+    def _start_integrity_check(self, model_path: str):
+        """完整性校验与分词器、模型加载并行进行 (VERIFY_MODEL=off 时不校验)"""
+        check = IntegrityCheck(model_path, log=self._log_step)
+        if not check.enabled:
+            return
+        self.integrity = check
+        self._log_step(f"🔐 后台校验模型完整性 (策略: {check.policy}, 参考: {os.path.basename(check.reference_path)})")
+        check.start()
+
+    def _check_downloaded_snapshot(self):
+        if integrity_policy(self._log_step) == "off":
+            return
+        try:
+            from huggingface_hub import try_to_load_from_cache
+            config_path = try_to_load_from_cache(self.model_name, "config.json")
+        except Exception:
+            config_path = None
+        if isinstance(config_path, str):
+            self._start_integrity_check(os.path.dirname(config_path))
+        elif integrity_policy(self._log_step) != "warn":
+            raise RuntimeError("找不到实际加载的模型快照，无法校验完整性，拒绝就绪")
+        else:
+            self._log_step("⚠️ 找不到实际加载的模型快照，跳过完整性校验")
+
+    def _enforce_integrity(self):
+        """warn 策略不等待结果；refuse / quarantine 在标记就绪前等待校验结束，
+        不一致或无法完成校验时都拒绝就绪，只有确认不一致才隔离快照"""
+        check = self.integrity
+        if check is None or check.policy == "warn":
+            return
+        if not check.done:
+            self._log_step("⏳ 等待模型完整性校验结束...")
+            check.wait()
+        if check.passed:
+            if self.resolved_model is not None and self.resolved_model.force_download:
+                # 强制重新下载的快照已校验通过，下次启动可以直接使用
+                ModelResolver(log=self._log_step).release(check.model_path)
+            return
+        if not check.failed:
+            raise RuntimeError(f"模型完整性校验无法完成，拒绝就绪: {check.describe()}")
+        if check.policy == "quarantine":
+            ModelResolver(log=self._log_step).quarantine(check.model_path, f"完整性校验未通过: {check.describe()}")
+            check.quarantined = True
+        # 不可信的权重不再保留在内存中
+        self.model = None
+        self.prefix_cache = None
+        self.speculative = None
+        raise RuntimeError(f"模型完整性校验未通过，拒绝就绪: {check.describe()}")
+
+    @contextlib.contextmanager
+    def _track_shard_progress(self):
+        """临时接管 transformers 的加载进度条，按已加载的权重分片数把进度从 5% 推进到 90%
+
+        transformers 4.x 按分片迭代 ("Loading checkpoint shards")；较新版本在 core_model_loading
+        中按权重逐个迭代，同样能换算成百分比。
+        """
+        import importlib
+
+        patched = []
+        for module_name in ("transformers.utils.logging", "transformers.core_model_loading"):
+            try:
+                module = importlib.import_module(module_name)
+            except ImportError:
+                continue
+            original_tqdm = getattr(module, "tqdm", None)
+            if original_tqdm is None:
+                continue
+
+            def tracked_tqdm(*args, _original=original_tqdm, **kwargs):
+                bar = _original(*args, **kwargs)
+                total = kwargs.get("total")
+                if total is None and args and hasattr(args[0], "__len__"):
+                    total = len(args[0])
+                return _ProgressBar(bar, total, self._on_shard_loaded)
+
+            module.tqdm = tracked_tqdm
+            patched.append((module, original_tqdm))
+        try:
+            yield
+        finally:
+            for module, original_tqdm in patched:
+                module.tqdm = original_tqdm
+
+    def _on_shard_loaded(self, done: int, total: Optional[int]):
+        if not total:
+            return
+        previous = int(self.load_progress) // 10
+        self.shards_loaded = min(done, total)
+        self.shards_total = total
+        self.load_progress = 5.0 + 85.0 * self.shards_loaded / total
+        if int(self.load_progress) // 10 != previous:
+            self._log_step(f"📦 权重加载进度: {self.shards_loaded}/{total} ({self.load_progress:.0f}%)")
+
+    def _load_draft_model(self, draft_name: str, load_kwargs: Dict):
+        """加载草稿模型；分词器与主模型不一致时放弃投机解码"""
+        try:
+            start_time = time.time()
+            resolved = ModelResolver(model_id=draft_name, log=self._log_step).resolve()
+            local_only = resolved.local
+            draft_tokenizer = AutoTokenizer.from_pretrained(resolved.path, trust_remote_code=True, local_files_only=local_only)
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                self._log_step(f"⚠️ 草稿模型 {draft_name} 的分词器与主模型不一致，跳过投机解码")
+                return
+            draft_kwargs = {k: v for k, v in load_kwargs.items() if k != "config"}
+            draft_kwargs["local_files_only"] = local_only
+            draft = AutoModelForCausalLM.from_pretrained(resolved.path, **draft_kwargs)
+            draft.to(next(self.model.parameters()).device)
+            draft.eval()
+            self.speculative = SpeculativeDecoder(self.model, draft)
+            self.draft_model_name = resolved.path
+            self._log_step(
+                f"🎯 草稿模型加载完成: {resolved.path} (k={self.speculative.num_draft_tokens}, 耗时: {time.time() - start_time:.2f}s)"
+            )
+        except Exception as e:
+            self.speculative = None
+            self._log_step(f"⚠️ 草稿模型加载失败，不使用投机解码: {e}")
+
+    def _cpu_dtype(self) -> torch.dtype:
+        """CPU_DTYPE=auto(默认)/bf16/fp32；auto 只在有原生bf16指令的CPU上使用bf16"""
+        choice = os.environ.get("CPU_DTYPE", "auto").lower()
+        if choice == "bf16" or (choice == "auto" and cpu_supports_bf16()):
+            self._log_step("🧮 CPU计算精度: bfloat16")
+            return torch.bfloat16
+        self._log_step("🧮 CPU计算精度: float32")
+        return torch.float32
+
+    def _build_prefix_cache(self):
+        if os.environ.get("PREFIX_CACHE", "1") == "0":
+            return
+        try:
+            self.prefix_cache = PromptPrefixCache(self)
+            self.prefix_cache.refresh()
+        except Exception as e:
+            self.prefix_cache = None
+            self._log_step(f"⚠️ 提示前缀KV缓存构建失败，将完整预填充: {e}")
+
+    def _enable_compiled_decode(self):
+        """只编译单token解码步：预填充的长度随提示变化，放进编译图会按每个新长度重新编译，
+        很快超过 dynamo 的 cache_size_limit；解码步在静态KV缓存下形状固定 (只随批大小变化)"""
+        try:
+            self.model.generation_config.cache_implementation = "static"
+            eager_forward = self.model.forward
+            compiled_forward = torch.compile(eager_forward, dynamic=False)
+
+            def forward(*args, **kwargs):
+                input_ids = kwargs.get("input_ids", args[0] if args else None)
+                if input_ids is not None and input_ids.shape[1] == 1:
+                    return compiled_forward(*args, **kwargs)
+                return eager_forward(*args, **kwargs)
+
+            self._eager_forward = eager_forward
+            self.model.forward = forward
+            self.compiled = True
+            self._log_step("🛠️ 已启用静态KV缓存与编译解码步 (首次调用时编译)")
+        except Exception as e:
+            self._log_step(f"⚠️ 编译解码步失败，使用普通执行路径: {e}")
+
+    def _disable_compiled_decode(self):
+        self.model.forward = self._eager_forward
+        self.model.generation_config.cache_implementation = None
+        self.compiled = False
+        self._log_step("⚠️ 已关闭编译解码步，使用普通执行路径")
+
+    def _warmup(self):
+        """用合成梦境跑两轮生成：第一轮包含编译/初始化 (冷)，第二轮为稳定状态 (热)；
+        预热请求不计入提前结束统计和前缀缓存命中数"""
+        warmup_tokens = int(os.environ.get("WARMUP_TOKENS", "16"))
+        stats = {}
+        stopping_stats = self.stopping_stats
+        prefix_counts = (self.prefix_cache.hits, self.prefix_cache.misses) if self.prefix_cache is not None else None
+        self.stopping_stats = StoppingStats()
+        try:
+            for phase in ("cold", "warm"):
+                start_time = time.time()
+                result = self.interpret_detailed(
+                    "我梦见自己在一片安静的森林里散步",
+                    GenerationBudget(max_new_tokens=warmup_tokens, greedy=False),
+                )
+                elapsed = time.time() - start_time
+                stats[f"{phase}_seconds"] = round(elapsed, 3)
+                stats[f"{phase}_ms_per_token"] = round(elapsed * 1000 / max(1, result.get("generated_tokens", 0)), 1)
+        finally:
+            self.stopping_stats = stopping_stats
+            if prefix_counts is not None and self.prefix_cache is not None:
+                self.prefix_cache.hits, self.prefix_cache.misses = prefix_counts
+            self.inference_steps = []
+        self.warmup_stats = stats
+        self._log_step(
+            f"🔥 预热完成: 冷启动 {stats['cold_ms_per_token']} ms/token, 预热后 {stats['warm_ms_per_token']} ms/token"
+        )
 
     def _log_step(self, message: str):
         if self.verbose:
@@ -134,24 +577,96 @@ class DreamInterpreter:
             print(f"🤔 {message}")
         self.inference_steps.append(message)
     
-    def interpret(self, text: str) -> str:
+    def result_cache_key(self, text: str, budget: "GenerationBudget") -> str:
+        params = {"decode": "greedy", "max_new_tokens": budget.max_new_tokens}
+        if budget.thinking_budget is not None:
+            params["thinking_budget"] = budget.thinking_budget
+        if budget.stop_strings:
+            params["stop"] = budget.stop_strings
+        # 影响输出的加载与运行配置：换量化模式、精度、编译方式、提前结束条件或模型版本后不复用旧结果
+        params.update({
+            "quantization": self.quantization,
+            "dtype": str(getattr(self.model, "dtype", None)),
+            "compiled": self.compiled,
+            "stopping_criteria": configured_criteria(),
+            "revision": self._model_revision(),
+        })
+        return self.result_cache.make_key(text, self.model_name, params)
+
+    def _model_revision(self) -> Optional[str]:
+        """解析器给出的快照 commit；按模型 ID 加载时取 transformers 记录的 commit"""
+        commit = self.resolved_model.commit if self.resolved_model is not None else None
+        return commit or getattr(getattr(self.model, "config", None), "_commit_hash", None)
+
+    def stop_monitor(self, budget: "GenerationBudget") -> Optional[StopMonitor]:
+        """按 STOPPING_CRITERIA 为一条序列创建提前结束检测；设为空字符串时关闭"""
+        criteria = configured_criteria()
+        if not criteria:
+            return None
+        opens_thinking = self.prompt_opens_thinking if self.thinking is not None else False
+        return StopMonitor(self.tokenizer, criteria, budget.stop_strings, opens_thinking)
+
+    def _apply_stop(self, result: Dict, monitor: Optional[StopMonitor], budget: "GenerationBudget") -> Dict:
+        """提前结束时标注触发的条件，并把结果计入提前结束统计"""
+        fired = monitor.fired if monitor is not None and result["finish_reason"] == "stop" else None
+        if fired is not None:
+            result["stop_criterion"] = fired
+            result["truncated"] = False
+            result["interpretation"] = monitor.trim(result["interpretation"])
+        self.stopping_stats.record(fired, result.get("generated_tokens", 0), budget.max_new_tokens)
+        return result
+
+    @property
+    def prompt_opens_thinking(self) -> bool:
+        """聊天模板是否在生成提示末尾就打开了 <think> (与梦境内容无关，只计算一次)"""
+        if self._prompt_opens_thinking is None:
+            prompt_ids = self.tokenizer(self._build_prompt("梦")).input_ids
+            self._prompt_opens_thinking = self.thinking.opens_in_prompt(prompt_ids)
+        return self._prompt_opens_thinking
+
+    def shape_reasoning(self, result: Dict, budget: "GenerationBudget") -> Dict:
+        if self.thinking is None:
+            return result
+        return shape_result(result, budget.reasoning, self.prompt_opens_thinking)
+
+    def interpret(self, text: str, deterministic: Optional[bool] = None,
+                  budget: Optional["GenerationBudget"] = None) -> str:
+        if budget is None:
+            budget = GenerationBudget(greedy=deterministic)
+        return self.interpret_detailed(text, budget)["interpretation"]
+
+    def interpret_detailed(self, text: str, budget: Optional["GenerationBudget"] = None,
+                           return_scores: bool = False, session: Optional[Session] = None) -> Dict:
+        """按请求预算解析梦境，返回解析文本以及是否被截断、结束原因等信息；
+        传入 session 时作为该会话的下一轮，复用上一轮的 KV cache"""
         self.inference_steps = []  # 清空之前的推理步骤
+        budget = budget or GenerationBudget()
         
         self._log_inference(f"📝 收到梦境描述: {text[:50]}{'...' if len(text) > 50 else ''}")
         if not self.model or not self.tokenizer or not self.use_llm:
             self._log_inference("⚠️ 未加载大模型，使用规则引擎进行解析")
-            return self._fallback_interpret(text)
+            return self.fallback_result(text)
         
-        messages = [
-            {"role": "user", "content": f"请帮我详细解析这个梦境，并给出心理学建议：\n{text}"}
-        ]
+        max_new_tokens = budget.max_new_tokens
+        cache_key = None
+        # 会话的回答依赖之前的对话，不使用按梦境文本索引的结果缓存
+        if budget.greedy and not return_scores and session is None:
+            cache_key = self.result_cache_key(text, budget)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                self._log_inference("💾 命中解析结果缓存")
+                return self.shape_reasoning(
+                    {"interpretation": cached, "truncated": False, "finish_reason": "cached"}, budget
+                )
         
         self._log_inference("🔧 正在构建输入模板...")
-        text_input = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-        )
+        messages = None
+        if session is not None:
+            messages = self.session_messages(session, text)
+            text_input = self._render_messages(messages)
+            self._log_inference(f"💬 会话 {session.session_id[:8]} 第 {session.turns + 1} 轮")
+        else:
+            text_input = self._build_prompt(text)
         self._log_inference(f"📄 输入模板长度: {len(text_input)} 字符")
         
         # 分词
@@ -166,67 +681,267 @@ class DreamInterpreter:
         input_length = model_inputs.input_ids.shape[1]
         self._log_inference(f"📊 输入token数量: {input_length}")
         
+        generate_kwargs = {}
+        prefix = None
+        if session is not None:
+            prefix, prefix_length = self.sessions.reusable(session, model_inputs.input_ids[0].tolist())
+            if prefix is not None:
+                generate_kwargs["past_key_values"] = from_legacy(prefix)
+                self._log_inference(f"💬 复用会话KV缓存: {prefix_length} tokens, 仅需预填充 {input_length - prefix_length} tokens")
+        # 会话的第一轮 (或 KV 已被淘汰) 与普通请求一样从提示前缀KV缓存开始
+        if prefix is None and self.prefix_cache is not None:
+            prefix, prefix_length = self.prefix_cache.lookup(model_inputs.input_ids[0].tolist())
+            if prefix is not None:
+                # 每次从缓存张量构造新的Cache对象，生成过程不会改动共享的前缀KV
+                generate_kwargs["past_key_values"] = from_legacy(prefix)
+                self._log_inference(f"🧩 复用提示前缀KV缓存: {prefix_length} tokens, 仅需预填充 {input_length - prefix_length} tokens")
+        
         # 设置生成参数
-        max_new_tokens = int(os.environ.get("MAX_NEW_TOKENS", "256"))
-        self._log_inference(f"⚙️ 生成参数设置: max_new_tokens={max_new_tokens}, temperature=0.7, top_p=0.9")
+        generate_kwargs.update(budget.generate_kwargs())
+        if return_scores:
+            # 逐步保存logits既占内存又耗时，只有调用方需要时才打开
+            generate_kwargs.update(output_scores=True, return_dict_in_generate=True)
+        # 会话需要取回生成结束时的 KV cache 留给下一轮；编译解码使用静态 cache，不保存
+        keep_session_cache = session is not None and not self.compiled
+        if keep_session_cache:
+            generate_kwargs["return_dict_in_generate"] = True
+        thinking_processor = None
+        if budget.thinking_budget is not None:
+            thinking_processor = self.thinking.processor(model_inputs.input_ids.tolist(), budget.thinking_budget)
+            generate_kwargs["logits_processor"] = LogitsProcessorList([thinking_processor])
+        monitor = self.stop_monitor(budget)
+        if monitor is not None:
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                EarlyStoppingCriteria([monitor], input_length, self.tokenizer.eos_token_id)
+            ])
+        self._log_inference(f"⚙️ 生成参数设置: {budget.describe()}")
         
         # 开始生成
         self._log_inference("🚀 开始生成回复...")
         start_time = time.time()
+        session_cache, sequence_ids = None, None
         
-        # 使用更详细的生成过程
-        generated_ids = self.model.generate(
-            input_ids=model_inputs.input_ids,
-            attention_mask=model_inputs.attention_mask,
-            max_new_tokens=max_new_tokens,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=self.tokenizer.eos_token_id,
-            # 添加回调函数来显示生成进度
-            output_scores=True,
-            return_dict_in_generate=True,
-        )
+        # 强制结束推理需要逐步修改 logits，投机解码的批量验证不支持，此时走普通 generate
+        if self.speculative is not None and not return_scores and thinking_processor is None:
+            generated, spec_stats = self.speculative.generate(
+                model_inputs.input_ids[0].tolist(),
+                max_new_tokens,
+                do_sample=not budget.greedy,
+                eos_token_id=self.tokenizer.eos_token_id,
+                deadline_at=budget.deadline_at,
+                target_cache=prefix,
+                stop_check=monitor.push if monitor is not None else None,
+            )
+            generated_ids = torch.tensor(generated, dtype=torch.long)
+            self._log_inference(
+                f"🎯 投机解码: 接受率 {spec_stats['acceptance_rate']:.1%} "
+                f"({spec_stats['accepted']}/{spec_stats['proposed']}), "
+                f"每次主模型前向产出 {spec_stats['tokens_per_round']} tokens, "
+                f"有效速度 {spec_stats['tokens_per_second']:.2f} tokens/秒"
+            )
+        else:
+            outputs = self.model.generate(
+                input_ids=model_inputs.input_ids,
+                attention_mask=model_inputs.attention_mask,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **generate_kwargs,
+            )
+            # 处理生成的ID
+            sequences = outputs.sequences if "return_dict_in_generate" in generate_kwargs else outputs
+            generated_ids = sequences[0, input_length:]
+            if keep_session_cache:
+                # cache 覆盖到倒数第二个 token，最后一个 token 下一轮和新消息一起预填充
+                session_cache = to_legacy(outputs.past_key_values)
+                sequence_ids = sequences[0].tolist()
         
         generation_time = time.time() - start_time
         
-        # 处理生成的ID
-        generated_ids_output = generated_ids.sequences
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids_output)
-        ]
-        
-        output_length = len(generated_ids[0])
-        self._log_inference(f"✅ 生成完成!")
+        if monitor is not None and monitor.fired is not None:
+            # 提前结束：触发之后的位置只是填充 (重复检测还会截掉多余的重复)
+            generated_ids = generated_ids[:monitor.keep_tokens]
+            finish_reason = "stop"
+            self._log_inference(f"🛑 提前结束 (条件: {monitor.fired})，节省 {max_new_tokens - len(generated_ids)} tokens 预算")
+        else:
+            finish_reason = self._finish_reason(generated_ids.tolist(), budget)
+        output_length = len(generated_ids)
+        self._log_inference(f"✅ 生成完成! (结束原因: {finish_reason})")
         self._log_inference(f"📏 输出token数量: {output_length}")
         self._log_inference(f"⏱️ 生成耗时: {generation_time:.2f}秒")
         self._log_inference(f"⚡ 生成速度: {output_length/generation_time:.2f} tokens/秒")
 
         # 解码
         self._log_inference("🔤 正在解码输出...")
-        response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        response = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
         self._log_inference(f"📤 最终回复长度: {len(response)} 字符")
         
-        return response
+        result = {
+            "interpretation": response,
+            "truncated": finish_reason != "eos",
+            "finish_reason": finish_reason,
+            "generated_tokens": output_length,
+        }
+        if thinking_processor is not None:
+            tracker = thinking_processor.trackers[0]
+            result.update(reasoning_tokens=tracker.reasoning_tokens, thinking_forced=tracker.forced)
+            if tracker.forced:
+                self._log_inference(f"🧠 推理达到预算 {budget.thinking_budget} tokens，已强制结束推理")
+        if return_scores:
+            # 每一步所选token在(处理后)分布下的对数概率
+            result["token_logprobs"] = [
+                float(torch.log_softmax(step_scores[0].float(), dim=-1)[token_id])
+                for step_scores, token_id in zip(outputs.scores, generated_ids.tolist())
+            ]
+        result = self._apply_stop(result, monitor, budget)
+        # 被截断的部分结果不进缓存，命中缓存时总是完整的解析
+        if cache_key is not None and result["finish_reason"] in CACHEABLE_FINISH_REASONS:
+            self.result_cache.put(cache_key, result["interpretation"])
+        if session is not None:
+            self.complete_turn(session, messages, result, sequence_ids, session_cache)
+        return self.shape_reasoning(result, budget)
+
+    def _finish_reason(self, token_ids: List[int], budget: "GenerationBudget") -> str:
+        if self.tokenizer.eos_token_id in token_ids:
+            return "eos"
+        if len(token_ids) >= budget.max_new_tokens:
+            return "length"
+        return "deadline"
+
+    def interpret_batch(self, texts: List[str], budget: Optional["GenerationBudget"] = None) -> List[str]:
+        return [item["interpretation"] for item in self.interpret_batch_detailed(texts, budget)]
+
+    def interpret_batch_detailed(self, texts: List[str], budget: Optional["GenerationBudget"] = None) -> List[Dict]:
+        """一次左填充的 generate 同时解析多条梦境，按输入顺序返回各自的结果"""
+        self.inference_steps = []
+        budget = budget or GenerationBudget()
+        
+        self._log_inference(f"📦 收到批量梦境: {len(texts)} 条")
+        if not self.model or not self.tokenizer or not self.use_llm:
+            self._log_inference("⚠️ 未加载大模型，使用规则引擎进行解析")
+            return [self.fallback_result(text) for text in texts]
+        if self.speculative is not None and len(texts) == 1:
+            # 投机解码只支持单条序列
+            return [self.interpret_detailed(texts[0], budget)]
+        
+        self._log_inference("🔧 正在构建输入模板...")
+        text_inputs = [self._build_prompt(text) for text in texts]
+        
+        # 左填充，保证每条序列的最后一个token都紧挨着生成位置
+        device = next(self.model.parameters()).device
+        model_inputs = self.tokenizer(
+            text_inputs,
+            return_tensors="pt",
+            padding=True,
+        ).to(device)
+        
+        input_length = model_inputs.input_ids.shape[1]
+        self._log_inference(f"📊 批大小: {len(texts)}, 填充后输入长度: {input_length}")
+        self._log_inference(f"⚙️ 生成参数设置: {budget.describe()}")
+        
+        generate_kwargs = budget.generate_kwargs()
+        thinking_processor = None
+        if budget.thinking_budget is not None:
+            thinking_processor = self.thinking.processor(model_inputs.input_ids.tolist(), budget.thinking_budget)
+            generate_kwargs["logits_processor"] = LogitsProcessorList([thinking_processor])
+        monitors = [self.stop_monitor(budget) for _ in texts]
+        if monitors[0] is not None:
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                EarlyStoppingCriteria(monitors, input_length, self.tokenizer.eos_token_id)
+            ])
+
+        self._log_inference("🚀 开始批量生成...")
+        start_time = time.time()
+        sequences = self.model.generate(
+            input_ids=model_inputs.input_ids,
+            attention_mask=model_inputs.attention_mask,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **generate_kwargs,
+        )
+        generation_time = time.time() - start_time
+        
+        # 左填充时所有序列的提示长度相同，切掉提示部分即为各自的输出
+        generated_ids = sequences[:, input_length:]
+        results = []
+        total_tokens = 0
+        for index, row in enumerate(generated_ids.tolist()):
+            monitor = monitors[index]
+            if monitor is not None and monitor.fired is not None:
+                finish_reason, length = "stop", monitor.keep_tokens
+            else:
+                finish_reason = self._finish_reason(row, budget)
+                # eos 之后都是填充，不计入输出长度
+                length = row.index(self.tokenizer.eos_token_id) + 1 if finish_reason == "eos" else len(row)
+            total_tokens += length
+            result = {
+                "interpretation": self.tokenizer.decode(row[:length], skip_special_tokens=True),
+                "truncated": finish_reason != "eos",
+                "finish_reason": finish_reason,
+                "generated_tokens": length,
+            }
+            if thinking_processor is not None:
+                tracker = thinking_processor.trackers[index]
+                result.update(reasoning_tokens=tracker.reasoning_tokens, thinking_forced=tracker.forced)
+            results.append(self.shape_reasoning(self._apply_stop(result, monitor, budget), budget))
+        self._log_inference("✅ 批量生成完成!")
+        self._log_inference(f"📏 输出token总数: {total_tokens}")
+        self._log_inference(f"⏱️ 生成耗时: {generation_time:.2f}秒")
+        self._log_inference(f"⚡ 聚合生成速度: {total_tokens/generation_time:.2f} tokens/秒")
+        return results
+
+    def _build_prompt(self, text: str) -> str:
+        return self._render_messages([self._first_message(text)])
+
+    @staticmethod
+    def _first_message(text: str) -> Dict[str, str]:
+        return {"role": "user", "content": f"请帮我详细解析这个梦境，并给出心理学建议：\n{text}"}
+
+    def session_messages(self, session: Session, text: str) -> List[Dict[str, str]]:
+        """本轮的完整对话：首轮与单次解析使用同样的提问模板，之后的追问直接作为用户消息"""
+        message = {"role": "user", "content": text} if session.messages else self._first_message(text)
+        return session.messages + [message]
+
+    def complete_turn(self, session: Session, messages: List[Dict[str, str]], result: Dict,
+                      token_ids: Optional[List[int]] = None, cache=None):
+        """把本轮回答写入会话；token_ids 为 cache 覆盖的 (或更长的) token 序列"""
+        result["session_id"] = session.session_id
+        opened = self.prompt_opens_thinking if self.thinking is not None else False
+        # 聊天模板不会把历史回答里的推理放回提示，会话里只保存答案部分
+        answer = split_reasoning(result["interpretation"], opened)[1] or result["interpretation"]
+        if answer:
+            if cache is not None:
+                # 提前结束截掉的 token 也不保留它们的 KV
+                length = min(len(token_ids), cache_length(cache))
+                token_ids, cache = token_ids[:length], crop(cache, length)
+            self.sessions.save(session, messages + [{"role": "assistant", "content": answer}], token_ids, cache)
+        result["session_turn"] = session.turns
+
+    def _render_messages(self, messages: List[Dict[str, str]]) -> str:
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+
+    def fallback_result(self, text: str) -> Dict:
+        """规则引擎的结果，带上来源和当前模型状态，调用方可以明确区分这不是大模型的解析"""
+        if self.load_state in ("pending", "loading"):
+            notice = f"大模型加载中 ({self.load_progress:.0f}%)，以下为规则引擎的简要解析"
+        else:
+            notice = "大模型不可用，以下为规则引擎的简要解析"
+        return {
+            "interpretation": self._fallback_interpret(text),
+            "truncated": False,
+            "finish_reason": "fallback",
+            "source": "rule_engine",
+            "notice": notice,
+        }
 
     def _fallback_interpret(self, text: str) -> str:
         self._log_inference("开始分析梦境关键词")
-        lower = text.lower()
-        analysis_parts = []
-        if "蛇" in text or "snake" in lower:
-            analysis_parts.append("梦到蛇往往和潜意识中的紧张、压力或者对未知的担忧有关。")
-        if "追" in text or "追赶" in text or "chase" in lower:
-            analysis_parts.append("被追赶通常代表你在现实中有想逃避的问题或压力。")
-        if "掉" in text or "坠落" in text or "fall" in lower:
-            analysis_parts.append("下坠感经常和不安全感、对未来的不确定有关。")
-        if "考试" in text or "test" in lower or "考试" in text:
-            analysis_parts.append("考试场景多和自我要求、焦虑以及对评价的担心相关。")
-        if not analysis_parts:
-            analysis_parts.append("这个梦境反映出你最近情绪上存在一定的紧张和不安。")
+        matches = self.lexicon.match(text)
+        if matches:
+            self._log_inference(f"匹配到梦境符号: {', '.join(m['term'] for m in matches)}")
         self._log_inference("综合情节和情绪进行整体判断")
-        interpretation = "梦境解析：\n" + "\n".join(f"- {p}" for p in analysis_parts)
-        suggestion = "\n\n心理建议：\n- 建议你留意最近让你感到紧张或被追赶的事情。\n- 可以通过记录情绪、和信任的人沟通来释放压力。\n- 保持规律作息和适度放松，有助于减轻这类梦境带来的影响。"
-        return interpretation + suggestion
+        return self.lexicon.render(matches)
 
     def print_inference_summary(self):
         print("\n" + "="*60)
@@ -239,7 +954,27 @@ class DreamInterpreter:
     def get_model_info(self) -> Dict:
         return {
             "model_name": self.model_name,
+            "resolved_model": self.resolved_model.to_dict() if self.resolved_model is not None else None,
             "device": str(next(self.model.parameters()).device) if self.model is not None else "cpu",
+            "quantization": self.quantization,
+            "dtype": str(next(self.model.parameters()).dtype) if self.model is not None else None,
+            "compiled_decode": self.compiled,
+            "warmup": self.warmup_stats,
+            "speculative": {
+                "draft_model": self.draft_model_name,
+                "num_draft_tokens": self.speculative.num_draft_tokens,
+            } if self.speculative is not None else None,
+            "prefix_cache": {
+                "tokens": len(self.prefix_cache.prefix_ids),
+                "hits": self.prefix_cache.hits,
+                "misses": self.prefix_cache.misses,
+            } if self.prefix_cache is not None else None,
+            "result_cache": self.result_cache.stats(),
+            "sessions": self.sessions.stats(),
+            "integrity": self.integrity.to_dict() if self.integrity is not None else None,
+            "lexicon": self.lexicon.stats(),
+            "early_stopping": self.stopping_stats.snapshot(),
+            "loading": self.loading_status(),
             "loading_steps": self.loading_steps,
             "total_loading_steps": len(self.loading_steps)
         }
@@ -269,7 +1004,7 @@ if __name__ == "__main__":
                 break
             elif dream.lower() == 'info':
                 info = interpreter.get_model_info()
-                print(f"\n📊 模型信息:")
+                print("\n📊 模型信息:")
                 print(f"   模型名称: {info['model_name']}")
                 print(f"   运行设备: {info['device']}")
                 print(f"   加载步骤: {info['total_loading_steps']} 步")
@@ -278,7 +1013,7 @@ if __name__ == "__main__":
                 interpreter.print_inference_summary()
                 continue
             
-            print(f"\n🔮 正在解析您的梦境...")
+            print("\n🔮 正在解析您的梦境...")
             print("-" * 40)
             
             try:
@@ -0,0 +1,171 @@
+"""
+多轮会话缓存
+
+/interpret 返回 session_id，之后带着 session_id 的请求作为同一个梦境的追问，
+在已有对话后追加用户消息。每个会话保存上一轮结束时的 token 序列和对应的 KV cache (legacy 格式)，
+下一轮的提示与其最长公共前缀部分直接复用，只需预填充新增的 token。
+
+KV cache 的总字节数受 SESSION_CACHE_MB 限制，超出时按最近最少使用 (LRU) 的顺序丢弃 KV，
+但保留对话消息：被淘汰的会话下一轮会透明地重新完整预填充。
+会话本身在 SESSION_TTL 秒无访问后过期，或超过 SESSION_MAX 个时淘汰最旧的 (正在进行中的会话不会被过期或淘汰)。
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import kv_cache
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages: List[Dict[str, str]] = []
+        # cache 覆盖 token_ids 的全部位置
+        self.token_ids: List[int] = []
+        self.cache = None
+        self.nbytes = 0
+        self.turns = 0
+        self.busy = False
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+
+def _cache_bytes(cache) -> int:
+    if not cache:
+        return 0
+    return sum(t.numel() * t.element_size() for layer in cache for t in layer)
+
+
+class SessionStore:
+    def __init__(self, max_bytes: Optional[int] = None, max_sessions: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None):
+        self.max_bytes = max_bytes or int(float(os.environ.get("SESSION_CACHE_MB", "512")) * 1024 * 1024)
+        self.max_sessions = max_sessions or int(os.environ.get("SESSION_MAX", "1000"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.environ.get("SESSION_TTL", "3600"))
+        self.counters = {"created": 0, "expired": 0, "kv_evictions": 0, "kv_reused_tokens": 0, "kv_recomputed_turns": 0}
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, busy: bool = False) -> Session:
+        session = Session(uuid.uuid4().hex)
+        # 在锁内标记进行中，并发创建的其他会话不会把它当作空闲会话淘汰
+        session.busy = busy
+        with self._lock:
+            self._expire()
+            self._sessions[session.session_id] = session
+            self.counters["created"] += 1
+            excess = len(self._sessions) - self.max_sessions
+            for other in list(self._sessions.values()):
+                if excess <= 0:
+                    break
+                # 进行中的会话 (包括刚创建、即将开始第一轮的) 不淘汰，全部进行中时暂时超出上限
+                if other is session or other.busy:
+                    continue
+                self._drop(other)
+                excess -= 1
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def acquire(self, session_id: Optional[str] = None) -> Session:
+        """取得会话 (没有 session_id 时新建) 并标记为进行中；同一会话同时只能进行一轮"""
+        if not session_id:
+            return self.create(busy=True)
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        with self._lock:
+            if session.busy:
+                raise RuntimeError("Session is busy with another turn")
+            session.busy = True
+        return session
+
+    def release(self, session: Optional[Session]):
+        if session is not None:
+            session.busy = False
+
+    def reusable(self, session: Session, prompt_ids: List[int]):
+        """返回 (可复用的 cache, 复用长度)：与上一轮 token 序列的最长公共前缀，至少留一个 token 给预填充"""
+        with self._lock:
+            cache, token_ids = session.cache, session.token_ids
+        if cache is None:
+            if session.turns:
+                self.counters["kv_recomputed_turns"] += 1
+            return None, 0
+        limit = min(len(token_ids), kv_cache.cache_length(cache), len(prompt_ids) - 1)
+        n = 0
+        while n < limit and token_ids[n] == prompt_ids[n]:
+            n += 1
+        if n == 0:
+            return None, 0
+        self.counters["kv_reused_tokens"] += n
+        return kv_cache.crop(cache, n), n
+
+    def save(self, session: Session, messages: List[Dict[str, str]], token_ids: Optional[List[int]] = None, cache=None):
+        """一轮结束：更新对话消息，并保存 (或清除) 这一轮的 KV cache"""
+        nbytes = _cache_bytes(cache) if cache is not None else 0
+        with self._lock:
+            session.messages = messages
+            session.turns += 1
+            session.last_used = time.time()
+            # 只有仍在会话表里的会话计入 KV 总量；已被移出的会话不再保存 KV
+            tracked = self._sessions.get(session.session_id) is session
+            if tracked:
+                self._bytes -= session.nbytes
+            if cache is None or nbytes > self.max_bytes or not tracked:
+                session.token_ids, session.cache, session.nbytes = [], None, 0
+            else:
+                session.token_ids, session.cache, session.nbytes = list(token_ids), cache, nbytes
+                self._bytes += nbytes
+            if tracked:
+                self._sessions.move_to_end(session.session_id)
+            self._evict_kv(keep=session)
+
+    def _drop(self, session: Session):
+        """从会话表中移除，连同它的 KV 一起从总量中扣除"""
+        del self._sessions[session.session_id]
+        self._bytes -= session.nbytes
+        session.token_ids, session.cache, session.nbytes = [], None, 0
+
+    def _evict_kv(self, keep: Session):
+        for other in list(self._sessions.values()):
+            if self._bytes <= self.max_bytes:
+                return
+            if other is keep or other.cache is None:
+                continue
+            self._bytes -= other.nbytes
+            other.token_ids, other.cache, other.nbytes = [], None, 0
+            self.counters["kv_evictions"] += 1
+
+    def _expire(self):
+        now = time.time()
+        for session in list(self._sessions.values()):
+            if now - session.last_used <= self.ttl_seconds:
+                # OrderedDict 按最近使用排序，后面的都更新
+                break
+            if session.busy:
+                continue
+            self._drop(session)
+            self.counters["expired"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(
+                sessions=len(self._sessions),
+                sessions_with_kv=sum(1 for s in self._sessions.values() if s.cache is not None),
+                kv_mb=round(self._bytes / 1024 / 1024, 1),
+                max_kv_mb=round(self.max_bytes / 1024 / 1024, 1),
+            )
+            return stats
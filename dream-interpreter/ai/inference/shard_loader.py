@@ -0,0 +1,109 @@
+"""
+分片 safetensors 快速加载 (MODEL_LOADER=fast)
+
+from_pretrained 逐个读取分片，并且可能先按检查点精度创建张量再转换，短时间内同一个权重存在两份。
+这里的做法：
+1. 启动时对所有分片并行预读 (Linux 上用 posix_fadvise(WILLNEED) 交给内核异步读入页缓存，
+   其他平台用线程顺序读一遍)，磁盘在后续物化张量时不再是瓶颈；
+2. 模型骨架只在 meta 设备上创建，不分配任何权重内存；
+3. 逐个分片内存映射 (safe_open)，每个张量直接转换成目标精度放到目标设备，替换骨架中的参数，
+   峰值内存约为最终模型大小加上一个张量。
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import torch
+
+_READ_CHUNK = 16 * 1024 * 1024
+
+
+def shard_files(model_dir: str) -> List[str]:
+    """按 model.safetensors.index.json 列出全部分片；未分片的模型返回单个文件"""
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(model_dir, name) for name in sorted(set(weight_map.values()))]
+    single = os.path.join(model_dir, "model.safetensors")
+    return [single] if os.path.exists(single) else []
+
+
+def _prefetch(path: str) -> float:
+    """把文件读进页缓存，返回耗时 (秒)"""
+    start_time = time.time()
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            buffer = bytearray(_READ_CHUNK)
+            while f.readinto(buffer):
+                pass
+    return time.time() - start_time
+
+
+def load_sharded_model(model_dir: str, config, dtype: torch.dtype, model_cls, device: str = "cpu",
+                       log: Callable[[str], None] = print,
+                       on_shard: Optional[Callable[[int, int], None]] = None) -> torch.nn.Module:
+    from accelerate import init_empty_weights
+    from accelerate.utils import set_module_tensor_to_device
+    from safetensors import safe_open
+
+    shards = shard_files(model_dir)
+    if not shards:
+        raise FileNotFoundError(f"{model_dir} 中没有 safetensors 权重")
+
+    total_bytes = sum(os.path.getsize(p) for p in shards)
+    workers = int(os.environ.get("PREFETCH_WORKERS", str(min(8, len(shards)))))
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+    prefetches = [executor.submit(_prefetch, path) for path in shards]
+    log(f"📥 并行预读 {len(shards)} 个分片 ({total_bytes / 1024 ** 3:.2f} GB, {workers} 个线程)")
+
+    # 参数只在 meta 设备上搭骨架，buffer (如旋转位置编码) 正常创建
+    start_time = time.time()
+    with init_empty_weights(include_buffers=False):
+        model = model_cls.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+    log(f"🦴 模型骨架创建完成 (耗时: {time.time() - start_time:.2f}s)")
+
+    expected = {name for name, _ in model.named_parameters()}
+    loaded = set()
+    try:
+        for index, (path, prefetch) in enumerate(zip(shards, prefetches), 1):
+            wait_start = time.time()
+            prefetch_seconds = prefetch.result()
+            waited = time.time() - wait_start
+            start_time = time.time()
+            with safe_open(path, framework="pt", device="cpu") as f:
+                for name in f.keys():
+                    if name not in expected:
+                        continue
+                    # 检查点精度 -> 目标精度只在单个张量上转换，不会同时存在整模型的两份拷贝
+                    set_module_tensor_to_device(model, name, device, value=f.get_tensor(name), dtype=dtype)
+                    loaded.add(name)
+            size_gb = os.path.getsize(path) / 1024 ** 3
+            elapsed = time.time() - start_time
+            log(f"📦 分片 {index}/{len(shards)} {os.path.basename(path)}: {size_gb:.2f} GB, "
+                f"物化 {elapsed:.2f}s ({size_gb / max(elapsed, 1e-6):.2f} GB/s), "
+                f"预读 {prefetch_seconds:.2f}s, 等待预读 {waited:.2f}s")
+            if on_shard is not None:
+                on_shard(index, len(shards))
+    finally:
+        executor.shutdown(wait=False)
+
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError(f"检查点缺少 {len(missing)} 个参数，例如: {missing[:3]}")
+    if device != "cpu":
+        # 非持久化 buffer 仍在 CPU 上
+        model.to(device)
+
+    try:
+        from transformers import GenerationConfig
+        model.generation_config = GenerationConfig.from_pretrained(model_dir, local_files_only=True)
+    except (OSError, ValueError):
+        pass
+    model.eval()
+    return model
@@ -0,0 +1,146 @@
+"""
+投机解码 (speculative decoding)
+
+CPU 上解码 7B 模型受内存带宽限制：每生成一个 token 都要把全部权重读一遍。
+这里用一个共享分词器的小草稿模型 (如 Qwen2.5-0.5B) 先连续提出 k 个 token，
+再让主模型一次前向同时验证这 k 个位置：
+- 贪心解码：草稿 token 与主模型 argmax 一致则接受，第一个不一致的位置改用主模型的 token；
+- 采样解码：按 min(1, p/q) 接受，被拒绝时从 max(0, p - q) 归一化后的分布重新采样，
+  输出分布与只用主模型采样完全相同。
+全部接受时额外得到主模型在第 k+1 个位置上的 token，一次主模型前向最多产出 k+1 个 token。
+只支持单条序列 (batch=1)，KV cache 使用 kv_cache 中的 legacy 格式，拒绝后直接裁剪。
+"""
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from kv_cache import cache_length, crop, from_legacy, to_legacy
+
+
+class SpeculativeDecoder:
+    def __init__(self, target, draft, num_draft_tokens: Optional[int] = None):
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = num_draft_tokens or int(os.environ.get("SPECULATIVE_K", "4"))
+        # 同一分词器的模型词表嵌入可能按不同倍数填充，只比较共同的部分
+        self.vocab_size = min(target.config.vocab_size, draft.config.vocab_size)
+
+    def _forward(self, model, tokens: List[int], cache):
+        device = next(model.parameters()).device
+        outputs = model(
+            input_ids=torch.tensor([tokens], dtype=torch.long, device=device),
+            past_key_values=from_legacy(cache),
+            use_cache=True,
+        )
+        return outputs.logits[0, :, :self.vocab_size].float(), to_legacy(outputs.past_key_values)
+
+    @staticmethod
+    def _probs(logits: torch.Tensor, temperature: float, top_p: float) -> torch.Tensor:
+        """温度 + top-p 处理后的分布；草稿和主模型使用同样的处理，拒绝采样仍然无偏"""
+        probs = torch.softmax(logits / temperature, dim=-1)
+        sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+        outside = torch.cumsum(sorted_probs, dim=-1) - sorted_probs > top_p
+        sorted_probs = sorted_probs.masked_fill(outside, 0.0)
+        probs = torch.zeros_like(probs).scatter(-1, sorted_idx, sorted_probs)
+        return probs / probs.sum()
+
+    @torch.inference_mode()
+    def generate(self, prompt_ids: List[int], max_new_tokens: int, do_sample: bool = False,
+                 temperature: float = 0.7, top_p: float = 0.9, eos_token_id: Optional[int] = None,
+                 deadline_at: Optional[float] = None, target_cache=None,
+                 stop_check: Optional[Callable[[List[int]], bool]] = None) -> Tuple[List[int], Dict]:
+        """返回 (生成的 token, 统计信息)；target_cache 可以传入主模型已计算好的提示前缀 KV，
+        stop_check 每轮验证后以目前生成的全部 token 调用一次，返回 True 时提前结束"""
+        start_time = time.time()
+        tokens = list(prompt_ids)
+        prompt_length = len(tokens)
+
+        # 两个模型的 cache 都只覆盖到倒数第二个 token，最后一个 token 留到下一轮一起喂入
+        if cache_length(target_cache) < len(tokens) - 1:
+            _, target_cache = self._forward(self.target, tokens[cache_length(target_cache):-1], target_cache)
+        draft_cache = None
+        if len(tokens) > 1:
+            _, draft_cache = self._forward(self.draft, tokens[:-1], None)
+
+        stats = {"rounds": 0, "proposed": 0, "accepted": 0}
+        finish_reason = "length"
+        while len(tokens) - prompt_length < max_new_tokens:
+            if deadline_at is not None and time.time() >= deadline_at:
+                finish_reason = "deadline"
+                break
+            k = min(self.num_draft_tokens, max_new_tokens - (len(tokens) - prompt_length) - 1)
+
+            # 1. 草稿模型自回归提出 k 个 token
+            draft_tokens, draft_probs = [], []
+            feed = tokens[cache_length(draft_cache):]
+            for _ in range(k):
+                logits, draft_cache = self._forward(self.draft, feed, draft_cache)
+                if do_sample:
+                    q = self._probs(logits[-1], temperature, top_p)
+                    token = int(torch.multinomial(q, 1))
+                    draft_probs.append(q)
+                else:
+                    token = int(torch.argmax(logits[-1]))
+                draft_tokens.append(token)
+                feed = [token]
+
+            # 2. 主模型一次前向验证：logits[i] 是接在前 i 个草稿 token 之后的分布
+            base_length = len(tokens)
+            logits, target_cache = self._forward(
+                self.target, tokens[cache_length(target_cache):] + draft_tokens, target_cache
+            )
+            accepted, next_token = 0, None
+            for i, token in enumerate(draft_tokens):
+                if do_sample:
+                    p = self._probs(logits[i], temperature, top_p)
+                    q = draft_probs[i]
+                    if torch.rand(()) < torch.clamp(p[token] / q[token], max=1.0):
+                        accepted += 1
+                        continue
+                    residual = torch.clamp(p - q, min=0.0)
+                    residual = residual if residual.sum() > 0 else p
+                    next_token = int(torch.multinomial(residual / residual.sum(), 1))
+                else:
+                    best = int(torch.argmax(logits[i]))
+                    if best == token:
+                        accepted += 1
+                        continue
+                    next_token = best
+                break
+            if next_token is None:
+                # 全部接受：主模型在最后一个位置上的预测作为额外的 token
+                if do_sample:
+                    next_token = int(torch.multinomial(self._probs(logits[k], temperature, top_p), 1))
+                else:
+                    next_token = int(torch.argmax(logits[k]))
+
+            stats["rounds"] += 1
+            stats["proposed"] += k
+            stats["accepted"] += accepted
+            # 3. 丢弃被拒绝位置的 KV；新 token 还没有喂给任何一个模型
+            target_cache = crop(target_cache, base_length + accepted)
+            if draft_cache is not None:
+                draft_cache = crop(draft_cache, min(cache_length(draft_cache), base_length + accepted))
+            tokens.extend(draft_tokens[:accepted] + [next_token])
+
+            if eos_token_id is not None and eos_token_id in tokens[base_length:]:
+                del tokens[tokens.index(eos_token_id, base_length) + 1:]
+                finish_reason = "eos"
+                break
+            if stop_check is not None and stop_check(tokens[prompt_length:]):
+                finish_reason = "stop"
+                break
+
+        generated = tokens[prompt_length:prompt_length + max_new_tokens]
+        elapsed = time.time() - start_time
+        stats.update(
+            generated=len(generated),
+            seconds=round(elapsed, 3),
+            finish_reason=finish_reason,
+            acceptance_rate=round(stats["accepted"] / stats["proposed"], 4) if stats["proposed"] else 0.0,
+            tokens_per_round=round(len(generated) / stats["rounds"], 2) if stats["rounds"] else 0.0,
+            tokens_per_second=round(len(generated) / elapsed, 2) if elapsed > 0 else 0.0,
+        )
+        return generated, stats
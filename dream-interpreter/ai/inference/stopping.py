@@ -0,0 +1,161 @@
+"""
+提前结束生成的判定条件
+
+采样解码偶尔会在一个短语上打转直到 max_new_tokens 用完，或者在完整的"解析 + 建议"之后继续输出。
+这里提供可组合的结束条件 (STOPPING_CRITERIA 环境变量选择，逗号分隔)：
+- repetition: 输出末尾出现同一段 token 连续重复，截掉重复部分后结束；
+- stop_strings: 出现配置的停止字符串 (STOP_STRINGS，用 || 分隔，或请求中的 stop 字段)，截掉停止字符串；
+- structure: 答案 (推理段之后) 已包含"解析"和以"建议："标题行开头的建议部分，且建议列表之后出现空行。
+每条请求记录触发的条件，节省的 token 数 (剩余预算) 累计到 StoppingStats。
+"""
+import math
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+import torch
+from transformers import StoppingCriteria
+
+from thinking import split_reasoning
+
+DEFAULT_CRITERIA = "repetition,stop_strings,structure"
+
+_LIST_ITEM = re.compile(r"^\s*(?:[-*•·]|\d+[.、)）]|[（(]?[一二三四五六七八九十]+[、.)）])")
+# 建议部分的标题行："建议："、"心理建议："、"## 建议:"、"**生活建议**：" 等，正文里顺带提到的"建议"不算
+_SUGGESTION_HEADING = re.compile(r"^[ \t#>*]*[\u4e00-\u9fff]{0,4}建议[ \t*]*[：:]", re.MULTILINE)
+
+
+def configured_criteria() -> List[str]:
+    return [c.strip() for c in os.environ.get("STOPPING_CRITERIA", DEFAULT_CRITERIA).split(",") if c.strip()]
+
+
+def configured_stop_strings() -> List[str]:
+    return [s for s in os.environ.get("STOP_STRINGS", "").split("||") if s]
+
+
+class StopMonitor:
+    """单条序列的提前结束检测；push 传入目前为止生成的全部 token，触发时返回 True"""
+
+    def __init__(self, tokenizer, criteria: List[str], stop_strings: List[str], opens_thinking: bool = False):
+        self.tokenizer = tokenizer
+        self.criteria = criteria
+        self.stop_strings = stop_strings
+        self.opens_thinking = opens_thinking
+        self.max_period = int(os.environ.get("REPETITION_MAX_PERIOD", "48"))
+        self.min_repeats = int(os.environ.get("REPETITION_MIN_REPEATS", "3"))
+        self.min_span = int(os.environ.get("REPETITION_MIN_SPAN", "24"))
+        self.min_suggestions = int(os.environ.get("STRUCTURE_MIN_SUGGESTIONS", "2"))
+        # 解码停止字符串时回看的 token 数：最长停止字符串的字符数足够覆盖
+        self._tail_tokens = max([len(s) for s in stop_strings] + [1]) + 4
+        self.fired: Optional[str] = None
+        # 触发后保留的 token 数 (重复检测会截掉多余的重复)
+        self.keep_tokens: Optional[int] = None
+        # 结构检测按行增量解码：_text 是前 _decoded 个 token 的文本 (总是在换行处截止)
+        self._text = ""
+        self._decoded = 0
+
+    def push(self, token_ids: List[int]) -> bool:
+        if self.fired is not None:
+            return True
+        for name in self.criteria:
+            check = getattr(self, f"_check_{name}", None)
+            if check is not None and check(token_ids):
+                self.fired = name
+                if self.keep_tokens is None:
+                    self.keep_tokens = len(token_ids)
+                return True
+        return False
+
+    def _check_repetition(self, token_ids: List[int]) -> bool:
+        for period in range(1, min(self.max_period, len(token_ids) // self.min_repeats) + 1):
+            repeats = max(self.min_repeats, math.ceil(self.min_span / period))
+            span = period * repeats
+            if span > len(token_ids):
+                continue
+            block = token_ids[-period:]
+            if token_ids[-span:] == block * repeats:
+                # 保留一次完整的重复单元
+                self.keep_tokens = len(token_ids) - period * (repeats - 1)
+                return True
+        return False
+
+    def _check_stop_strings(self, token_ids: List[int]) -> bool:
+        if not self.stop_strings:
+            return False
+        tail = self.tokenizer.decode(token_ids[-self._tail_tokens:], skip_special_tokens=True)
+        return any(s in tail for s in self.stop_strings)
+
+    def _check_structure(self, token_ids: List[int]) -> bool:
+        # 只在刚输出换行时检查，避免每一步都解码全文
+        if "\n" not in self.tokenizer.decode(token_ids[-1:], skip_special_tokens=True):
+            return False
+        if len(token_ids) < self._decoded:
+            self._text, self._decoded = "", 0
+        # 只解码上次换行之后的新行，片段都在换行处切分，不会截断多字节字符
+        self._text += self.tokenizer.decode(token_ids[self._decoded:], skip_special_tokens=True)
+        self._decoded = len(token_ids)
+        # 建议列表之后出现空行才算结束 (split_reasoning 会去掉答案末尾的空白，在原文上判断)
+        if not self._text.endswith("\n\n"):
+            return False
+        return structure_complete(split_reasoning(self._text, self.opens_thinking)[1], self.min_suggestions)
+
+    def trim(self, text: str) -> str:
+        """停止字符串不出现在返回的文本中"""
+        if self.fired == "stop_strings":
+            positions = [text.find(s) for s in self.stop_strings if s in text]
+            if positions:
+                return text[:min(positions)].rstrip()
+        return text
+
+
+def structure_complete(answer: str, min_suggestions: int = 2) -> bool:
+    """答案已有解析部分和建议部分 (以建议标题行开头)，建议至少 min_suggestions 条 (建议列表之后的空行由调用方判断)"""
+    analysis = answer.find("解析")
+    if analysis < 0:
+        return False
+    headings = [m.start() for m in _SUGGESTION_HEADING.finditer(answer, analysis)]
+    if not headings:
+        return False
+    section = answer[headings[-1]:]
+    items = [line for line in section.splitlines()[1:] if _LIST_ITEM.match(line)]
+    return len(items) >= min_suggestions
+
+
+class EarlyStoppingCriteria(StoppingCriteria):
+    """供 model.generate 使用，按行返回是否结束 (transformers>=4.39 支持逐行结束)"""
+
+    def __init__(self, monitors: List[StopMonitor], prompt_length: int, eos_token_id: Optional[int]):
+        self.monitors = monitors
+        self.prompt_length = prompt_length
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        generated = input_ids[:, self.prompt_length:].tolist()
+        # 已经输出 eos 的行后面只剩填充，不再检测，以免把填充当成重复
+        done = [
+            self.eos_token_id in row or monitor.push(row)
+            for monitor, row in zip(self.monitors, generated)
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class StoppingStats:
+    """按条件统计提前结束次数和节省的 token 数 (相对于请求剩余的 max_new_tokens 预算)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.tokens_saved = 0
+        self.requests = 0
+
+    def record(self, criterion: Optional[str], generated_tokens: int, max_new_tokens: int):
+        with self._lock:
+            self.requests += 1
+            if criterion is not None:
+                self.counts[criterion] = self.counts.get(criterion, 0) + 1
+                self.tokens_saved += max(0, max_new_tokens - generated_tokens)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"requests": self.requests, "early_stops": dict(self.counts), "tokens_saved": self.tokens_saved}
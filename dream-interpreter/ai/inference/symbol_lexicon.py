@@ -0,0 +1,208 @@
+"""
+规则引擎的梦境符号词典
+
+词典是一个 JSON 文件 (DREAM_LEXICON_PATH，默认同目录下的 dream_symbols.json)，每个符号带若干中英文同义词、
+权重和解析模板，模板中的 {term} 替换为梦境里实际出现的词：
+    {"symbols": [{"id": "snake", "terms": ["蛇", "snake"], "weight": 0.9, "interpretation": "梦到{term}..."}],
+     "default": "没有匹配到符号时的解析", "suggestions": ["心理建议", ...]}
+
+加载时把所有同义词编译成一个 Aho–Corasick 自动机，匹配时对梦境文本只扫描一遍，
+耗时只与文本长度 (和命中数) 有关，与词典大小无关。英文词在编译时同时加入大写转移，
+匹配时不需要复制一份小写文本，并且要求词边界 ("test" 不匹配 "latest")。
+重叠的命中保留更长的词 ("掉牙" 不再算作 "掉")，最后按符号权重排序取前 LEXICON_TOP_K 个。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dream_symbols.json")
+DEFAULT_INTERPRETATION = "这个梦境反映出你最近情绪上存在一定的紧张和不安。"
+DEFAULT_SUGGESTIONS = [
+    "建议你留意最近让你感到紧张或被追赶的事情。",
+    "可以通过记录情绪、和信任的人沟通来释放压力。",
+    "保持规律作息和适度放松，有助于减轻这类梦境带来的影响。",
+]
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+class AhoCorasick:
+    """多模式匹配自动机；模式按小写编译，ASCII 字母同时接受大写"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, object]]):
+        # 每个状态: 转移表、失败指针、以该状态结尾的 (模式长度, 是否要求词边界, 附带数据)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, bool, object]]] = [[]]
+        for pattern, payload in patterns:
+            self._add(pattern.lower(), payload)
+        self._link()
+
+    def _add(self, pattern: str, payload):
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        word = _is_word_char(pattern[0]) or _is_word_char(pattern[-1])
+        self.output[state].append((len(pattern), word, payload))
+
+    def _link(self):
+        """按广度优先计算失败指针，并把失败状态的输出并入当前状态，匹配时不必再沿失败链收集"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.output[self.fail[nxt]]:
+                    self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+        # 失败指针算完之后再补大写转移，两种大小写的失败链完全一致
+        for table in self.goto:
+            for ch, nxt in list(table.items()):
+                upper = ch.upper()
+                if upper != ch and len(upper) == 1:
+                    table.setdefault(upper, nxt)
+
+    @property
+    def states(self) -> int:
+        return len(self.goto)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, object]]:
+        """返回所有命中的 (起始位置, 结束位置, 附带数据)"""
+        goto, fail, output = self.goto, self.fail, self.output
+        matches = []
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not output[state]:
+                continue
+            end = index + 1
+            for length, word, payload in output[state]:
+                start = end - length
+                if word and ((start > 0 and _is_word_char(text[start - 1])) or (end < len(text) and _is_word_char(text[end]))):
+                    continue
+                matches.append((start, end, payload))
+        return matches
+
+
+class Symbol:
+    def __init__(self, symbol_id: str, terms: List[str], interpretation: str, weight: float = 1.0,
+                 category: Optional[str] = None):
+        self.symbol_id = symbol_id
+        self.terms = terms
+        self.interpretation = interpretation
+        self.weight = weight
+        self.category = category
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Symbol":
+        terms = [t for t in data.get("terms", []) if isinstance(t, str) and t.strip()]
+        if not terms or not data.get("interpretation"):
+            raise ValueError(f"symbol {data.get('id')!r} needs terms and an interpretation")
+        return cls(
+            symbol_id=str(data.get("id") or terms[0]),
+            terms=[t.strip() for t in terms],
+            interpretation=data["interpretation"],
+            weight=float(data.get("weight", 1.0)),
+            category=data.get("category"),
+        )
+
+
+class SymbolLexicon:
+    def __init__(self, symbols: List[Symbol], default: str = DEFAULT_INTERPRETATION,
+                 suggestions: Optional[List[str]] = None, top_k: Optional[int] = None, source: Optional[str] = None):
+        start_time = time.time()
+        self.symbols = symbols
+        self.default = default
+        self.suggestions = suggestions if suggestions is not None else list(DEFAULT_SUGGESTIONS)
+        self.top_k = top_k or int(os.environ.get("LEXICON_TOP_K", "5"))
+        self.source = source
+        self.automaton = AhoCorasick((term, symbol) for symbol in symbols for term in symbol.terms)
+        self.build_ms = (time.time() - start_time) * 1000
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "SymbolLexicon":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            [Symbol.from_dict(entry) for entry in data.get("symbols", [])],
+            default=data.get("default") or DEFAULT_INTERPRETATION,
+            suggestions=data.get("suggestions"),
+            source=path,
+            **kwargs,
+        )
+
+    def match(self, text: str) -> List[Dict]:
+        """命中的符号按权重 (相同时按首次出现的位置) 排序，同一符号只出现一次"""
+        spans = sorted(self.automaton.find_all(text), key=lambda m: (m[0], m[0] - m[1]))
+        found: Dict[str, Dict] = {}
+        covered_end = 0
+        for start, end, symbol in spans:
+            # 被更长的命中完全覆盖的短词不算 (按起点排序、同起点长的在前)
+            if end <= covered_end:
+                continue
+            covered_end = end
+            hit = found.get(symbol.symbol_id)
+            if hit is None:
+                hit = found[symbol.symbol_id] = {"symbol": symbol, "term": text[start:end], "position": start, "count": 0, "end": 0}
+            # 同一符号的词互相重叠 ("掉牙齿" 中的 "掉牙" 与 "牙齿") 只算一次
+            if start >= hit["end"]:
+                hit["count"] += 1
+            hit["end"] = end
+        ranked = sorted(found.values(), key=lambda h: (-h["symbol"].weight, h["position"]))
+        return ranked[:self.top_k]
+
+    def render(self, matches: List[Dict]) -> str:
+        parts = [m["symbol"].interpretation.replace("{term}", m["term"]) for m in matches] or [self.default]
+        interpretation = "梦境解析：\n" + "\n".join(f"- {p}" for p in parts)
+        if not self.suggestions:
+            return interpretation
+        return interpretation + "\n\n心理建议：\n" + "\n".join(f"- {s}" for s in self.suggestions)
+
+    def stats(self) -> Dict:
+        return {
+            "source": self.source,
+            "symbols": len(self.symbols),
+            "terms": sum(len(s.terms) for s in self.symbols),
+            "states": self.automaton.states,
+            "build_ms": round(self.build_ms, 1),
+        }
+
+
+_lexicons: Dict[str, SymbolLexicon] = {}
+_lexicons_lock = threading.Lock()
+
+
+def load_lexicon(path: Optional[str] = None, log: Callable[[str], None] = print) -> SymbolLexicon:
+    """按路径缓存编译好的词典 (多个解释器实例共用)；词典缺失或损坏时退回空词典，规则引擎仍可给出通用解析"""
+    path = path or os.environ.get("DREAM_LEXICON_PATH", DEFAULT_LEXICON_PATH)
+    with _lexicons_lock:
+        lexicon = _lexicons.get(path)
+        if lexicon is None:
+            try:
+                lexicon = SymbolLexicon.from_file(path)
+                stats = lexicon.stats()
+                log(f"📖 梦境符号词典: {stats['symbols']} 个符号, {stats['terms']} 个词 (编译耗时: {stats['build_ms']:.0f}ms)")
+            except (OSError, ValueError) as e:
+                log(f"⚠️ 梦境符号词典加载失败，规则引擎只给出通用解析: {e}")
+                lexicon = SymbolLexicon([], source=path)
+            _lexicons[path] = lexicon
+        return lexicon
@@ -6,15 +6,15 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from service import DreamInterpreter
+from service import DreamInterpreter, GenerationBudget
 
 def test_direct_service():
     """直接测试服务类 - 使用较小的max_new_tokens"""
     print("🧪 快速测试DreamInterpreter服务...")
     
     try:
-        # 设置较小的max_new_tokens来加快生成速度
-        os.environ["MAX_NEW_TOKENS"] = "50"  # 从256减少到50
+        # 用单次请求的预算限制max_new_tokens来加快生成速度，不再修改环境变量
+        budget = GenerationBudget(max_new_tokens=50)  # 从256减少到50
         print("⚙️ 设置max_new_tokens=50来加快生成速度")
         
         # 创建解释器实例
@@ -25,7 +25,7 @@ def test_direct_service():
         test_text = "蛇"
         print(f"\n🧠 测试梦境解析: {test_text}")
         
-        result = interpreter.interpret(test_text)
+        result = interpreter.interpret(test_text, budget=budget)
         print(f"\n解析结果: {result}")
         
         # 打印推理过程
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+连续批处理引擎测试 - 使用随机初始化的小型 Qwen2 模型和逐字符的测试分词器，CPU 上几秒内即可跑完
+
+1. reasoning=separate 的流式输出：推理事件之后继续推送答案 token，最后以 done 结束；
+2. 客户端断开 (关闭流式生成器) 后，引擎在下一个解码步让这一行退出，不再解码到 max_new_tokens；
+3. 不同长度的请求错开时间进入批次、有的提前退出 (length / eos)，每条的贪心输出都与模型单独 generate 一致。
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 随机模型经常原地重复，关闭提前结束检测；结果缓存只放内存
+os.environ["STOPPING_CRITERIA"] = ""
+os.environ["RESULT_CACHE_PATH"] = ""
+
+from types import SimpleNamespace
+
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from engine import ContinuousBatchingEngine
+from service import DreamInterpreter, GenerationBudget
+from thinking import THINK_END, THINK_START, ThinkingController
+
+VOCAB_SIZE = 256
+
+
+class CharTokenizer:
+    """测试用分词器：<think> / </think> 各占一个 token，其余字符按码位映射到词表，解码成可见的汉字"""
+
+    special = {THINK_START: 1, THINK_END: 2}
+
+    def __init__(self, eos_token_id: int = 0, opens_thinking: bool = False):
+        self.eos_token_id = eos_token_id
+        self.opens_thinking = opens_thinking
+        self.names = {token_id: tag for tag, token_id in self.special.items()}
+
+    def encode(self, text: str, add_special_tokens: bool = False):
+        ids, i = [], 0
+        while i < len(text):
+            tag = next((tag for tag in self.special if text.startswith(tag, i)), None)
+            if tag is not None:
+                ids.append(self.special[tag])
+                i += len(tag)
+            else:
+                ids.append(3 + ord(text[i]) % (VOCAB_SIZE - 3))
+                i += 1
+        return ids
+
+    def __call__(self, text: str, **kwargs):
+        return SimpleNamespace(input_ids=self.encode(text))
+
+    def decode(self, ids, skip_special_tokens: bool = True) -> str:
+        return "".join(
+            "" if t == self.eos_token_id else self.names.get(t) or chr(0x4E00 + t) for t in ids
+        )
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        text = "".join(f"<{m['role']}>{m['content']}" for m in messages) + "<assistant>"
+        return text + (THINK_START if self.opens_thinking else "")
+
+
+def tiny_qwen2(seed: int = 0) -> Qwen2ForCausalLM:
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=512,
+        # 默认初始化下注意力接近均匀，放大权重让位置或填充处理上的错误改变贪心输出
+        initializer_range=0.2,
+    )
+    return Qwen2ForCausalLM(config).eval()
+
+
+def make_interpreter(tokenizer: CharTokenizer, thinking: bool = False) -> DreamInterpreter:
+    interpreter = DreamInterpreter(verbose=False, load=False)
+    interpreter.model = tiny_qwen2()
+    interpreter.tokenizer = tokenizer
+    interpreter.use_llm = True
+    interpreter.thinking = ThinkingController(tokenizer) if thinking else None
+    return interpreter
+
+
+def test_stream_separate_reasoning():
+    # 提示以 <think> 结尾，推理预算 4 个 token 后强制输出 </think>；eos 不在词表里，一定以 length 结束
+    interpreter = make_interpreter(CharTokenizer(eos_token_id=VOCAB_SIZE, opens_thinking=True), thinking=True)
+    engine = ContinuousBatchingEngine(interpreter, max_slots=2)
+    budget = GenerationBudget(max_new_tokens=16, greedy=True, thinking_budget=4, reasoning="separate")
+
+    events = list(engine.stream("梦见自己在飞", budget))
+    kinds = [kind for kind, _ in events]
+    assert kinds[-1] == "done", kinds
+    assert "reasoning" in kinds and "token" in kinds, kinds
+    assert kinds.index("token") > max(i for i, kind in enumerate(kinds) if kind == "reasoning"), kinds
+    assert events[-1][1]["finish_reason"] == "length", events[-1]
+
+    # 流式推送的内容与非流式、按 separate 整理后的结果一致；以 length 结束的结果是截断的，不进缓存
+    result = engine.interpret_detailed("梦见自己在飞", budget)
+    assert result["finish_reason"] == "length" and result["truncated"], result
+    assert "".join(p for k, p in events if k == "token") == result["interpretation"], (events, result)
+    assert "".join(p for k, p in events if k == "reasoning").strip() == result["reasoning"], (events, result)
+    print(f"✅ separate 流式输出: {kinds.count('reasoning')} 个推理事件, {kinds.count('token')} 个答案事件, 以 done 结束")
+
+
+def test_stream_cancelled_on_close():
+    interpreter = make_interpreter(CharTokenizer(eos_token_id=VOCAB_SIZE))
+    engine = ContinuousBatchingEngine(interpreter, max_slots=2)
+    budget = GenerationBudget(max_new_tokens=400, greedy=True)
+
+    events = engine.stream("梦见一条很长的走廊", budget)
+    kind, _ = next(events)
+    assert kind == "token", kind
+    events.close()
+
+    deadline = time.time() + 30
+    while engine.stats["completed"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert engine.stats["cancelled"] == 1, engine.stats
+    assert engine.stats["generated_tokens"] < 400, engine.stats
+    assert not engine._active, "取消的请求仍占着槽位"
+    print(f"✅ 关闭流后请求被取消: 只解码了 {engine.stats['generated_tokens']} / 400 tokens")
+
+
+def reference_greedy(model, prompt_ids, max_new_tokens: int, eos_token_id: int):
+    output = model.generate(
+        torch.tensor([prompt_ids]), attention_mask=torch.ones((1, len(prompt_ids)), dtype=torch.long),
+        max_new_tokens=max_new_tokens, do_sample=False, eos_token_id=eos_token_id, pad_token_id=eos_token_id,
+    )[0, len(prompt_ids):].tolist()
+    # generate 在 eos 之后用 pad 补齐 (这里 pad 与 eos 相同)，引擎生成到 eos 为止
+    return output[:output.index(eos_token_id) + 1] if eos_token_id in output else output
+
+
+def wait_for_tokens(request, count: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while len(request.generated) < count and not request.future.done() and time.time() < deadline:
+        time.sleep(0.001)
+
+
+def test_staggered_greedy_matches_generate():
+    tokenizer = CharTokenizer()
+    interpreter = make_interpreter(tokenizer)
+    model = interpreter.model
+    dreams = [
+        ("梦见海", 24),
+        ("梦见自己在一座没有出口的高楼里不停地往上爬", 40),
+        ("梦见牙齿掉了", 6),
+        ("梦见和很久没联系的老同学一起考试，却怎么也找不到考场", 32),
+        ("飞", 16),
+    ]
+    prompts = [tokenizer(interpreter._build_prompt(text)).input_ids for text, _ in dreams]
+
+    # 以第二条梦境贪心输出的第 5 个 token 作为 eos，让它在批次中途因 eos 退出
+    probe = reference_greedy(model, prompts[1], 40, eos_token_id=VOCAB_SIZE)
+    tokenizer.eos_token_id = probe[4]
+    expected = [reference_greedy(model, ids, n, tokenizer.eos_token_id) for ids, (_, n) in zip(prompts, dreams)]
+
+    engine = ContinuousBatchingEngine(interpreter, max_slots=3)
+    requests = []
+    for i, (text, max_new_tokens) in enumerate(dreams):
+        requests.append(engine.submit(text, GenerationBudget(max_new_tokens=max_new_tokens, greedy=True)))
+        if i in (0, 2):
+            # 前一条已经解码了几步再提交，新序列与已有序列左填充合并
+            wait_for_tokens(requests[-1], 3)
+    for request in requests:
+        request.future.result(timeout=60)
+
+    for (text, _), request, want in zip(dreams, requests, expected):
+        assert request.generated == want, f"{text}: {request.generated} != {want}"
+    reasons = [request.finish_reason for request in requests]
+    assert "eos" in reasons and "length" in reasons, reasons
+    assert engine.stats["completed"] == len(dreams) and not engine._active, engine.stats
+    print(f"✅ 错开进入的 {len(dreams)} 条请求贪心输出与 generate 一致 (结束原因: {reasons}, 解码步数: {engine.stats['decode_steps']})")
+
+
+if __name__ == "__main__":
+    print("🧪 测试连续批处理引擎...")
+    test_stream_separate_reasoning()
+    test_stream_cancelled_on_close()
+    test_staggered_greedy_matches_generate()
+    print("🎉 全部通过")
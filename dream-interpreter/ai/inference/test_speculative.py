@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+投机解码测试 - 使用两个随机初始化的小型 Qwen2 模型，CPU 上几秒内即可跑完
+
+1. 贪心解码时，投机解码的输出必须与主模型单独 generate 的输出逐 token 一致；
+2. 草稿模型与主模型相同时，接受率应为 100%；
+3. 采样解码能正常结束，并报告接受率和有效速度。
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from speculative import SpeculativeDecoder
+
+VOCAB_SIZE = 256
+
+
+def tiny_qwen2(seed: int, layers: int, hidden: int) -> Qwen2ForCausalLM:
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=hidden,
+        intermediate_size=hidden * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=512,
+    )
+    return Qwen2ForCausalLM(config).eval()
+
+
+def test_greedy_matches_target():
+    target = tiny_qwen2(0, layers=4, hidden=128)
+    draft = tiny_qwen2(1, layers=1, hidden=64)
+    prompt = list(range(10, 30))
+
+    expected = target.generate(
+        torch.tensor([prompt]), max_new_tokens=40, do_sample=False, pad_token_id=0,
+    )[0, len(prompt):].tolist()
+    for k in (1, 3, 5):
+        generated, stats = SpeculativeDecoder(target, draft, num_draft_tokens=k).generate(prompt, 40)
+        assert generated == expected, f"k={k} 的输出与主模型不一致"
+        print(f"✅ 贪心一致 k={k}: 接受率 {stats['acceptance_rate']:.1%}, 每轮 {stats['tokens_per_round']} tokens")
+
+
+def test_same_model_accepts_everything():
+    target = tiny_qwen2(0, layers=2, hidden=64)
+    generated, stats = SpeculativeDecoder(target, target, num_draft_tokens=4).generate(list(range(5, 15)), 30)
+    assert len(generated) == 30
+    assert stats["acceptance_rate"] == 1.0, stats
+    print(f"✅ 相同模型接受率 100%, 主模型前向 {stats['rounds']} 次生成 {stats['generated']} tokens")
+
+
+def test_sampling_and_eos():
+    target = tiny_qwen2(0, layers=2, hidden=64)
+    draft = tiny_qwen2(1, layers=1, hidden=64)
+    torch.manual_seed(42)
+    generated, stats = SpeculativeDecoder(target, draft, num_draft_tokens=4).generate(
+        list(range(5, 15)), 50, do_sample=True, temperature=0.7, top_p=0.9,
+    )
+    assert 0 < len(generated) <= 50
+    print(f"✅ 采样解码: {stats}")
+
+    # 把贪心解码的第 3 个 token 当作 eos，生成应在它之后立即结束
+    greedy, _ = SpeculativeDecoder(target, draft).generate(list(range(5, 15)), 50)
+    eos = greedy[2]
+    generated, stats = SpeculativeDecoder(target, draft).generate(list(range(5, 15)), 50, eos_token_id=eos)
+    assert generated[-1] == eos and stats["finish_reason"] == "eos", (generated, stats)
+    print("✅ 遇到 eos 后停止")
+
+
+if __name__ == "__main__":
+    print("🧪 测试投机解码...")
+    test_greedy_matches_target()
+    test_same_model_accepts_everything()
+    test_sampling_and_eos()
+    print("🎉 全部通过")
@@ -0,0 +1,122 @@
+"""
+DeepSeek-R1 推理过程 (<think>...</think>) 的预算控制
+
+R1 蒸馏模型在给出解析之前会先输出一段推理，经常在 max_new_tokens 用完时还没开始写答案。
+这里在解码时统计推理部分已经用掉的 token 数，超过预算后强制输出 </think>，让模型立即转入答案；
+返回结果时可以保留推理 (keep)、去掉推理 (strip) 或把推理单独放在 reasoning 字段 (separate)。
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+REASONING_MODES = ("keep", "strip", "separate")
+
+
+def _ends_with(tokens: Sequence[int], suffix: Sequence[int]) -> bool:
+    return len(suffix) > 0 and len(tokens) >= len(suffix) and list(tokens[-len(suffix):]) == list(suffix)
+
+
+class ThinkingTracker:
+    """跟踪单条序列是否处于推理段、已用多少推理 token，以及下一步是否必须强制输出结束标签"""
+
+    def __init__(self, start_ids: List[int], end_ids: List[int], budget: Optional[int], in_thinking: bool = False):
+        self.start_ids = start_ids
+        self.end_ids = end_ids
+        self.budget = budget
+        self.in_thinking = in_thinking
+        self.closed = False
+        self.reasoning_tokens = 0
+        self.forced = False
+        self._recent: List[int] = []
+
+    def push(self, token_id: int) -> bool:
+        """记录一个生成的 token，返回它是否属于推理部分 (包括开始/结束标签)"""
+        self._recent = (self._recent + [token_id])[-max(len(self.start_ids), len(self.end_ids)):]
+        if self.in_thinking:
+            if _ends_with(self._recent, self.end_ids):
+                self.in_thinking = False
+                self.closed = True
+            else:
+                self.reasoning_tokens += 1
+            return True
+        if not self.closed and _ends_with(self._recent, self.start_ids):
+            self.in_thinking = True
+            return True
+        return False
+
+    def forced_token(self) -> Optional[int]:
+        if not self.in_thinking or self.budget is None or self.reasoning_tokens < self.budget:
+            return None
+        self.forced = True
+        # 结束标签可能由多个 token 组成，已经输出了前 j 个就接着输出第 j+1 个
+        for j in range(len(self.end_ids) - 1, 0, -1):
+            if _ends_with(self._recent, self.end_ids[:j]):
+                return self.end_ids[j]
+        return self.end_ids[0]
+
+
+class ThinkingBudgetProcessor(LogitsProcessor):
+    """供 model.generate 使用：推理超出预算的行只保留结束标签的 logit"""
+
+    def __init__(self, trackers: List[ThinkingTracker], prompt_length: int):
+        self.trackers = trackers
+        self._seen = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for column in range(self._seen, input_ids.shape[1]):
+            for row, tracker in enumerate(self.trackers):
+                tracker.push(int(input_ids[row, column]))
+        self._seen = input_ids.shape[1]
+        for row, tracker in enumerate(self.trackers):
+            token_id = tracker.forced_token()
+            if token_id is not None:
+                scores[row, :] = -float("inf")
+                scores[row, token_id] = 0.0
+        return scores
+
+
+class ThinkingController:
+    def __init__(self, tokenizer):
+        self.start_ids = tokenizer.encode(THINK_START, add_special_tokens=False)
+        self.end_ids = tokenizer.encode(THINK_END, add_special_tokens=False)
+
+    def opens_in_prompt(self, prompt_ids: Sequence[int]) -> bool:
+        """新版 R1 聊天模板在生成提示末尾直接加上 <think>，生成从推理段内部开始"""
+        tail = list(prompt_ids[-32:])
+        for end in range(len(tail), 0, -1):
+            if _ends_with(tail[:end], self.end_ids):
+                return False
+            if _ends_with(tail[:end], self.start_ids):
+                return True
+        return False
+
+    def tracker(self, prompt_ids: Sequence[int], budget: Optional[int]) -> ThinkingTracker:
+        return ThinkingTracker(self.start_ids, self.end_ids, budget, self.opens_in_prompt(prompt_ids))
+
+    def processor(self, batch_prompt_ids: List[List[int]], budget: Optional[int]) -> ThinkingBudgetProcessor:
+        trackers = [self.tracker(ids, budget) for ids in batch_prompt_ids]
+        return ThinkingBudgetProcessor(trackers, len(batch_prompt_ids[0]))
+
+
+def split_reasoning(text: str, opened: bool = False) -> Tuple[str, str]:
+    """返回 (推理, 答案)；没有闭合的推理段说明答案还没开始"""
+    if THINK_END in text:
+        reasoning, answer = text.split(THINK_END, 1)
+        return reasoning.replace(THINK_START, "").strip(), answer.strip()
+    if opened or THINK_START in text:
+        return text.replace(THINK_START, "").strip(), ""
+    return "", text.strip()
+
+
+def shape_result(result: Dict, mode: str, opened: bool = False) -> Dict:
+    """按 reasoning 选项整理返回给调用方的结果，原始文本 (含推理) 仍然是写入缓存的内容"""
+    if mode == "keep" or result.get("finish_reason") == "fallback":
+        return result
+    reasoning, answer = split_reasoning(result["interpretation"], opened)
+    result["interpretation"] = answer
+    if mode == "separate":
+        result["reasoning"] = reasoning
+    return result
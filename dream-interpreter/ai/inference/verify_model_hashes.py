@@ -1,26 +1,104 @@
 #!/usr/bin/env python3
 """
 模型文件哈希校验工具
+
+- 以大块 (HASH_CHUNK_MB，默认 8MB) 读入复用的缓冲区计算哈希，hashlib 计算大块数据时释放 GIL，
+  多个文件在线程池中并发计算；
+- 已计算过的文件记录在旁路缓存 (HASH_CACHE_PATH) 中，以 (路径, 大小, mtime, inode) 为键，
+  文件未变化时直接使用缓存的哈希；--full 忽略缓存完整重新计算。
+- 默认使用快速模式：HF 缓存中的 LFS 文件是指向 blobs/<sha256> 的符号链接，直接比对 blob 名，
+  不读取内容；--deep 读取全部内容校验，--sample-files N 随机抽查 N 个 blob 的内容。
+- --manifest 生成块级 Merkle 清单 (默认 64MB 一块，同时保留整个文件的 sha256)；以清单作为参考并使用 --deep
+  (或 --sample-chunks N) 时各块并行校验，损坏的位置报告到字节范围。
 """
 import os
+import sys
 import hashlib
 import json
-from pathlib import Path
-from typing import Dict, List, Optional
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+HASH_CHUNK_SIZE = int(float(os.environ.get("HASH_CHUNK_MB", "8")) * 1024 * 1024)
+DEFAULT_CACHE_PATH = os.environ.get(
+    "HASH_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "dream-interpreter", "model_hash_cache.json")
+)
 
-def calculate_file_hash(file_path: str, algorithm: str = "sha256") -> str:
+def calculate_file_hash(file_path: str, algorithm: str = "sha256", chunk_size: int = HASH_CHUNK_SIZE) -> str:
     """计算文件的哈希值"""
     hash_obj = hashlib.new(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
     
     try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_obj.update(chunk)
+        with open(file_path, "rb", buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                hash_obj.update(view[:n])
         return hash_obj.hexdigest()
     except Exception as e:
         print(f"计算哈希失败 {file_path}: {e}")
         return ""
 
+class HashCache:
+    """旁路哈希缓存：文件的大小、修改时间或 inode 任一变化都视为需要重新计算"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def _signature(file_path: str) -> Tuple[int, int, int]:
+        st = os.stat(file_path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, file_path: str, algorithm: str) -> Optional[str]:
+        entry = self.entries.get(os.path.abspath(file_path))
+        if entry is None or entry.get("algorithm") != algorithm:
+            return None
+        if tuple(entry["signature"]) != self._signature(file_path):
+            return None
+        return entry["hash"]
+
+    def put(self, file_path: str, algorithm: str, file_hash: str, signature: Optional[Tuple[int, int, int]] = None):
+        """signature 应在开始计算前取得，计算期间文件被改动时下次会重新计算"""
+        with self._lock:
+            self.entries[os.path.abspath(file_path)] = {
+                "signature": list(signature or self._signature(file_path)),
+                "algorithm": algorithm,
+                "hash": file_hash,
+            }
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+def _hash_one(file_path: str, algorithm: str, cache: Optional[HashCache]) -> Dict:
+    """计算 (或从缓存取得) 单个文件的哈希，返回哈希、大小、耗时和是否命中缓存"""
+    signature = HashCache._signature(file_path)
+    cached = cache.get(file_path, algorithm) if cache is not None else None
+    if cached is not None:
+        return {"hash": cached, "size": signature[0], "seconds": 0.0, "cached": True}
+    start_time = time.time()
+    file_hash = calculate_file_hash(file_path, algorithm)
+    elapsed = time.time() - start_time
+    return {"hash": file_hash, "size": signature[0], "seconds": elapsed, "cached": False, "signature": signature}
+
+def _mb_per_s(size: int, seconds: float) -> float:
+    return round(size / 1024 / 1024 / seconds, 1) if seconds > 0 else 0.0
+
 def find_model_files(model_path: str) -> List[str]:
     """查找模型相关文件"""
     model_files = []
@@ -43,47 +121,79 @@ def find_model_files(model_path: str) -> List[str]:
     
     return model_files
 
-def verify_model_hashes(model_path: str, reference_hashes: Optional[Dict[str, str]] = None) -> Dict:
-    """验证模型文件的哈希值"""
-    print(f"🔍 正在扫描模型目录: {model_path}")
-    
-    model_files = find_model_files(model_path)
-    
-    if not model_files:
-        print("❌ 未找到模型文件")
-        return {"status": "error", "message": "未找到模型文件"}
-    
-    print(f"📁 找到 {len(model_files)} 个模型相关文件")
-    
-    results = {
-        "model_path": model_path,
-        "total_files": len(model_files),
-        "hashes": {},
-        "missing_files": [],
-        "mismatched_files": [],
-        "verified_files": []
-    }
-    
-    # 计算所有文件的哈希值
-    for file_path in model_files:
-        file_name = os.path.basename(file_path)
-        print(f"🔄 正在计算 {file_name} 的哈希值...")
-        
-        file_hash = calculate_file_hash(file_path)
-        if file_hash:
-            results["hashes"][file_name] = file_hash
-            
-            # 如果有参考哈希值，进行比对
-            if reference_hashes and file_name in reference_hashes:
-                if file_hash == reference_hashes[file_name]:
-                    results["verified_files"].append(file_name)
-                    print(f"✅ {file_name}: 哈希值匹配")
-                else:
-                    results["mismatched_files"].append(file_name)
-                    print(f"❌ {file_name}: 哈希值不匹配")
-            else:
-                print(f"ℹ️  {file_name}: {file_hash[:16]}...")
-    
+def blob_digest(file_path: str) -> Optional[str]:
+    """Hugging Face 缓存中 LFS 文件是指向 blobs/<sha256> 的符号链接，文件名本身就是内容的 sha256；
+    非 LFS 的小文件 (blob 名为 git 的 sha1) 和普通目录中的文件返回 None"""
+    if not os.path.islink(file_path):
+        return None
+    target = os.path.realpath(file_path)
+    name = os.path.basename(target)
+    if os.path.basename(os.path.dirname(target)) != "blobs" or len(name) != 64:
+        return None
+    try:
+        int(name, 16)
+    except ValueError:
+        return None
+    return name
+
+def _hash_files(file_paths: List[str], algorithm: str, workers: Optional[int], cache: HashCache,
+                full: bool) -> Dict[str, Dict]:
+    """在线程池中并发计算一组文件的哈希 (大文件先开始，缩短总耗时)，返回 {路径: 信息}"""
+    workers = workers or int(os.environ.get("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    file_paths = sorted(file_paths, key=os.path.getsize, reverse=True)
+    infos = {}
+    if not file_paths:
+        return infos
+    print(f"🔄 正在计算 {len(file_paths)} 个文件的哈希值 (线程数: {workers}{', 完整重算' if full else ''})...")
+    start_time = time.time()
+    bytes_hashed = 0
+    cached_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_hash_one, file_path, algorithm, None if full else cache): file_path
+            for file_path in file_paths
+        }
+        for future in as_completed(futures):
+            file_path = futures[future]
+            file_name = os.path.basename(file_path)
+            try:
+                info = future.result()
+            except OSError as e:
+                print(f"❌ {file_name}: 读取失败 {e}")
+                continue
+            infos[file_path] = info
+            if info["cached"]:
+                cached_count += 1
+                print(f"💾 {file_name}: 文件未变化，使用缓存的哈希值")
+            elif info["hash"]:
+                bytes_hashed += info["size"]
+                print(f"📏 {file_name}: {info['size'] / 1024 / 1024:.1f}MB, {info['seconds']:.2f}秒, "
+                      f"{_mb_per_s(info['size'], info['seconds'])} MB/s")
+                cache.put(file_path, algorithm, info["hash"], info["signature"])
+    elapsed = time.time() - start_time
+    print(f"⚡ 共计算 {bytes_hashed / 1024 / 1024:.1f}MB, 耗时 {elapsed:.2f}秒, "
+          f"总吞吐 {_mb_per_s(bytes_hashed, elapsed)} MB/s (缓存命中 {cached_count} 个文件)")
+    try:
+        cache.save()
+    except OSError as e:
+        print(f"⚠️ 保存哈希缓存失败: {e}")
+    return infos
+
+def _compare(results: Dict, file_name: str, file_hash: str, reference_hashes: Optional[Dict[str, str]],
+             how: str = ""):
+    results["hashes"][file_name] = file_hash
+    # 如果有参考哈希值，进行比对
+    if reference_hashes and file_name in reference_hashes:
+        if file_hash == reference_hashes[file_name]:
+            results["verified_files"].append(file_name)
+            print(f"✅ {file_name}: 哈希值匹配{how}")
+        else:
+            results["mismatched_files"].append(file_name)
+            print(f"❌ {file_name}: 哈希值不匹配{how}")
+    else:
+        print(f"ℹ️  {file_name}: {file_hash[:16]}...")
+
+def _summarize(results: Dict, model_files: List[str], reference_hashes: Optional[Dict[str, str]]) -> Dict:
     # 检查缺失的文件
     if reference_hashes:
         for ref_file in reference_hashes.keys():
@@ -102,9 +212,258 @@ def verify_model_hashes(model_path: str, reference_hashes: Optional[Dict[str, st
     else:
         results["status"] = "calculated"
         print(f"\n✅ 已完成 {len(results['hashes'])} 个文件的哈希值计算")
-    
     return results
 
+def _scan(model_path: str) -> Tuple[List[str], Optional[Dict]]:
+    print(f"🔍 正在扫描模型目录: {model_path}")
+    model_files = find_model_files(model_path)
+    if not model_files:
+        print("❌ 未找到模型文件")
+        return model_files, {"status": "error", "message": "未找到模型文件"}
+    print(f"📁 找到 {len(model_files)} 个模型相关文件")
+    return model_files, None
+
+def _new_results(model_path: str, model_files: List[str], mode: str) -> Dict:
+    return {
+        "model_path": model_path,
+        "mode": mode,
+        "total_files": len(model_files),
+        "hashes": {},
+        "missing_files": [],
+        "mismatched_files": [],
+        "verified_files": [],
+        "cached_files": [],
+    }
+
+def verify_model_hashes(model_path: str, reference_hashes: Optional[Dict[str, str]] = None,
+                        workers: Optional[int] = None, full: bool = False,
+                        cache_path: Optional[str] = None, algorithm: str = "sha256") -> Dict:
+    """读取文件内容验证模型文件的哈希值；full=True 时忽略缓存重新计算全部文件"""
+    model_files, error = _scan(model_path)
+    if error is not None:
+        return error
+    results = _new_results(model_path, model_files, "deep")
+    start_time = time.time()
+    
+    # 计算所有文件的哈希值
+    infos = _hash_files(model_files, algorithm, workers, HashCache(cache_path or DEFAULT_CACHE_PATH), full)
+    for file_path, info in infos.items():
+        file_name = os.path.basename(file_path)
+        if info["cached"]:
+            results["cached_files"].append(file_name)
+        if info["hash"]:
+            _compare(results, file_name, info["hash"], reference_hashes)
+    elapsed = time.time() - start_time
+    bytes_hashed = sum(info["size"] for info in infos.values() if not info["cached"])
+    results.update(bytes_hashed=bytes_hashed, seconds=round(elapsed, 2), mb_per_s=_mb_per_s(bytes_hashed, elapsed))
+    return _summarize(results, model_files, reference_hashes)
+
+def verify_model_fast(model_path: str, reference_hashes: Optional[Dict[str, str]] = None,
+                      sample_files: int = 0, workers: Optional[int] = None,
+                      cache_path: Optional[str] = None) -> Dict:
+    """快速校验：HF 缓存中 LFS 文件的 blob 名就是 sha256，直接与参考值比对而不读取内容；
+    其余文件 (配置、分词器等小文件，或非 HF 缓存目录中的文件) 仍计算哈希，未变化时走哈希缓存。
+    sample_files > 0 时随机抽取这么多个 LFS 文件完整读取，确认 blob 内容与文件名一致 (发现磁盘上的损坏)。"""
+    model_files, error = _scan(model_path)
+    if error is not None:
+        return error
+    results = _new_results(model_path, model_files, "fast")
+    results["blob_files"] = []
+    start_time = time.time()
+
+    to_hash = []
+    blob_files = {}
+    for file_path in model_files:
+        digest = blob_digest(file_path)
+        if digest is None:
+            to_hash.append(file_path)
+            continue
+        file_name = os.path.basename(file_path)
+        blob_files[file_path] = digest
+        results["blob_files"].append(file_name)
+        _compare(results, file_name, digest, reference_hashes, " (blob 名)")
+
+    sampled = random.sample(sorted(blob_files), min(sample_files, len(blob_files))) if sample_files else []
+    # 抽查的 blob 完整读取且不使用缓存，其余文件照常使用哈希缓存
+    cache = HashCache(cache_path or DEFAULT_CACHE_PATH)
+    infos = _hash_files(to_hash, "sha256", workers, cache, full=False)
+    infos.update(_hash_files(sampled, "sha256", workers, cache, full=True))
+    results["sampled_files"] = []
+    for file_path, info in infos.items():
+        file_name = os.path.basename(file_path)
+        if info["cached"]:
+            results["cached_files"].append(file_name)
+        if not info["hash"]:
+            continue
+        if file_path in blob_files:
+            results["sampled_files"].append(file_name)
+            if info["hash"] != blob_files[file_path]:
+                # blob 内容已损坏：文件名对得上参考值也不能算通过
+                results["mismatched_files"].append(file_name)
+                if file_name in results["verified_files"]:
+                    results["verified_files"].remove(file_name)
+                print(f"❌ {file_name}: blob 内容与文件名不一致，文件已损坏")
+            else:
+                print(f"✅ {file_name}: 抽查 blob 内容一致")
+        else:
+            _compare(results, file_name, info["hash"], reference_hashes)
+    results["seconds"] = round(time.time() - start_time, 3)
+    print(f"⏱️ 快速校验耗时: {results['seconds'] * 1000:.0f}ms (blob 名比对 {len(blob_files)} 个, 读取内容 {len(infos)} 个)")
+    return _summarize(results, model_files, reference_hashes)
+
+DEFAULT_MERKLE_CHUNK_SIZE = 64 * 1024 * 1024
+
+def _merkle_root(leaves: List[str]) -> str:
+    """两两拼接后再做 sha256，奇数个时最后一个直接进入上一层；只有一个叶子时根就是该叶子"""
+    level = [bytes.fromhex(leaf) for leaf in leaves]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        paired = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+def _chunk_ranges(size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    return [(offset, min(offset + chunk_size, size)) for offset in range(0, size, chunk_size)] or [(0, 0)]
+
+def _hash_file_chunks(file_path: str, chunk_size: int) -> Dict:
+    """一次顺序读取同时得到整个文件的 sha256 和每个块的 sha256"""
+    file_hash = hashlib.sha256()
+    leaves = []
+    buffer = bytearray(min(HASH_CHUNK_SIZE, chunk_size))
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        for start, end in _chunk_ranges(os.path.getsize(file_path), chunk_size):
+            chunk_hash = hashlib.sha256()
+            remaining = end - start
+            while remaining > 0:
+                n = f.readinto(view[:min(len(buffer), remaining)])
+                if not n:
+                    break
+                file_hash.update(view[:n])
+                chunk_hash.update(view[:n])
+                remaining -= n
+            leaves.append(chunk_hash.hexdigest())
+    return {
+        "size": os.path.getsize(file_path),
+        "sha256": file_hash.hexdigest(),
+        "root": _merkle_root(leaves),
+        "chunks": leaves,
+    }
+
+def build_merkle_manifest(model_path: str, chunk_size: int = DEFAULT_MERKLE_CHUNK_SIZE,
+                          workers: Optional[int] = None) -> Dict:
+    """生成块级 Merkle 清单；每个文件同时保留整个文件的 sha256，兼容原来的扁平参考格式"""
+    model_files, error = _scan(model_path)
+    if error is not None:
+        return error
+    workers = workers or int(os.environ.get("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    print(f"🌳 正在生成 Merkle 清单 (块大小 {chunk_size // 1024 // 1024}MB, 线程数 {workers})...")
+    start_time = time.time()
+    files = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_hash_file_chunks, f, chunk_size): f for f in model_files}
+        for future in as_completed(futures):
+            file_name = os.path.basename(futures[future])
+            files[file_name] = future.result()
+            print(f"🌿 {file_name}: {len(files[file_name]['chunks'])} 块, root {files[file_name]['root'][:16]}...")
+    elapsed = time.time() - start_time
+    total = sum(entry["size"] for entry in files.values())
+    print(f"⚡ 共 {total / 1024 / 1024:.1f}MB, 耗时 {elapsed:.2f}秒, {_mb_per_s(total, elapsed)} MB/s")
+    return {"format": "merkle-v1", "algorithm": "sha256", "chunk_size": chunk_size, "files": dict(sorted(files.items()))}
+
+def load_reference(path: str) -> Tuple[Dict[str, str], Optional[Dict]]:
+    """读取参考文件，返回 (扁平的 {文件名: sha256}, Merkle 清单或 None)；两种格式都接受"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and data.get("format") == "merkle-v1":
+        return {name: entry["sha256"] for name, entry in data["files"].items()}, data
+    return data, None
+
+def _hash_range(file_path: str, start: int, end: int) -> str:
+    chunk_hash = hashlib.sha256()
+    buffer = bytearray(min(HASH_CHUNK_SIZE, max(end - start, 1)))
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            n = f.readinto(view[:min(len(buffer), remaining)])
+            if not n:
+                break
+            chunk_hash.update(view[:n])
+            remaining -= n
+    return chunk_hash.hexdigest()
+
+def verify_merkle(model_path: str, manifest: Dict, workers: Optional[int] = None,
+                  sample_chunks: int = 0) -> Dict:
+    """按块并行校验；损坏的位置精确到块的字节范围 [start, end)，同步工具可以只重新获取这些块。
+    sample_chunks > 0 时每个文件只随机抽查这么多块。
+    hashes 中记录由实际读到的块哈希算出的 Merkle 根 (只有全部块都读过的文件才有)，不是清单里的期望值"""
+    model_files, error = _scan(model_path)
+    if error is not None:
+        return error
+    chunk_size = manifest["chunk_size"]
+    results = _new_results(model_path, model_files, "merkle")
+    results["corrupted_ranges"] = {}
+    paths = {os.path.basename(f): f for f in model_files}
+    workers = workers or int(os.environ.get("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    start_time = time.time()
+
+    jobs = []
+    for file_name, entry in manifest["files"].items():
+        file_path = paths.get(file_name)
+        if file_path is None:
+            continue
+        if _merkle_root(entry["chunks"]) != entry["root"]:
+            print(f"⚠️  {file_name}: 清单中的块哈希与 Merkle 根不一致，清单本身可能已损坏")
+        size = os.path.getsize(file_path)
+        if size != entry["size"]:
+            # 文件长度不对 (例如复制中断)：从较短长度所在的块开始到较长的末尾都需要重新获取
+            first = min(size, entry["size"]) // chunk_size * chunk_size
+            results["corrupted_ranges"].setdefault(file_name, []).append([first, entry["size"]])
+            print(f"❌ {file_name}: 大小 {size} 与清单中的 {entry['size']} 不一致")
+        ranges = list(enumerate(_chunk_ranges(entry["size"], chunk_size)))
+        if sample_chunks:
+            ranges = random.sample(ranges, min(sample_chunks, len(ranges)))
+        for index, (start, end) in ranges:
+            if end <= size:
+                jobs.append((file_name, file_path, index, start, end))
+
+    print(f"🔄 正在并行校验 {len(jobs)} 个块 (块大小 {chunk_size // 1024 // 1024}MB, 线程数 {workers})...")
+    bytes_hashed = 0
+    computed: Dict[str, Dict[int, str]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_hash_range, path, start, end): (name, index, start, end)
+                   for name, path, index, start, end in jobs}
+        for future in as_completed(futures):
+            file_name, index, start, end = futures[future]
+            bytes_hashed += end - start
+            chunk_hash = computed.setdefault(file_name, {})[index] = future.result()
+            if chunk_hash != manifest["files"][file_name]["chunks"][index]:
+                results["corrupted_ranges"].setdefault(file_name, []).append([start, end])
+
+    for file_name in manifest["files"]:
+        if file_name not in paths:
+            continue
+        chunks = computed.get(file_name, {})
+        if len(chunks) == len(manifest["files"][file_name]["chunks"]):
+            results["hashes"][file_name] = _merkle_root([chunks[i] for i in range(len(chunks))])
+        ranges = sorted(results["corrupted_ranges"].get(file_name, []))
+        if ranges:
+            results["corrupted_ranges"][file_name] = ranges
+            results["mismatched_files"].append(file_name)
+            print(f"❌ {file_name}: 损坏的字节范围 {', '.join(f'[{a}, {b})' for a, b in ranges)}")
+        else:
+            results["verified_files"].append(file_name)
+            print(f"✅ {file_name}: 所有{'抽查的' if sample_chunks else ''}块哈希匹配")
+    elapsed = time.time() - start_time
+    results.update(bytes_hashed=bytes_hashed, seconds=round(elapsed, 2), mb_per_s=_mb_per_s(bytes_hashed, elapsed))
+    print(f"⚡ 共校验 {bytes_hashed / 1024 / 1024:.1f}MB, 耗时 {elapsed:.2f}秒, {results['mb_per_s']} MB/s")
+    return _summarize(results, model_files, {name: entry["sha256"] for name, entry in manifest["files"].items()})
+
 def save_hashes_to_file(hashes: Dict[str, str], output_file: str):
     """保存哈希值到文件"""
     try:
@@ -193,21 +552,44 @@ if __name__ == "__main__":
     parser.add_argument("--path", type=str, help="模型目录路径")
     parser.add_argument("--reference", type=str, help="参考哈希值JSON文件")
     parser.add_argument("--output", type=str, help="输出哈希值到文件")
+    parser.add_argument("--workers", type=int, help="并发计算的线程数 (默认: HASH_WORKERS 或 min(4, CPU数))")
+    parser.add_argument("--cache", type=str, help=f"哈希缓存文件 (默认: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--full", action="store_true", help="忽略缓存，完整重新计算所有文件 (隐含 --deep)")
+    parser.add_argument("--deep", action="store_true", help="读取全部文件内容校验，不使用 blob 名快速比对")
+    parser.add_argument("--sample-files", type=int, default=0, help="快速模式下随机完整抽查的 blob 文件数")
+    parser.add_argument("--manifest", type=str, help="生成块级 Merkle 清单 (含整文件哈希) 并写入该文件")
+    parser.add_argument("--chunk-mb", type=int, default=DEFAULT_MERKLE_CHUNK_SIZE // 1024 // 1024,
+                        help="Merkle 清单的块大小 (MB，默认 64)")
+    parser.add_argument("--sample-chunks", type=int, default=0,
+                        help="参考文件为 Merkle 清单且使用 --deep 时，每个文件只随机抽查这么多块")
     
     args = parser.parse_args()
     
     if args.path:
         # 使用指定的路径
-        reference_hashes = None
+        reference_hashes, manifest = None, None
         if args.reference:
             try:
-                with open(args.reference, 'r') as f:
-                    reference_hashes = json.load(f)
+                # 参考文件可以是扁平的 {文件名: sha256}，也可以是 Merkle 清单
+                reference_hashes, manifest = load_reference(args.reference)
             except Exception as e:
                 print(f"❌ 读取参考哈希文件失败: {e}")
                 sys.exit(1)
         
-        results = verify_model_hashes(args.path, reference_hashes)
+        if args.manifest:
+            merkle = build_merkle_manifest(args.path, args.chunk_mb * 1024 * 1024, workers=args.workers)
+            if merkle.get("status") == "error":
+                sys.exit(1)
+            save_hashes_to_file(merkle, args.manifest)
+            sys.exit(0)
+        if manifest is not None and (args.deep or args.sample_chunks):
+            results = verify_merkle(args.path, manifest, workers=args.workers, sample_chunks=args.sample_chunks)
+        elif args.deep or args.full:
+            results = verify_model_hashes(args.path, reference_hashes, workers=args.workers, full=args.full,
+                                          cache_path=args.cache)
+        else:
+            results = verify_model_fast(args.path, reference_hashes, sample_files=args.sample_files,
+                                        workers=args.workers, cache_path=args.cache)
         
         if args.output:
             save_hashes_to_file(results["hashes"], args.output)
@@ -4,12 +4,49 @@ const axios = require('axios');
 
 const AI_SERVICE_URL = process.env.AI_SERVICE_URL || 'http://localhost:5000';
 
+const JOB_POLL_WAIT_S = Number(process.env.AI_JOB_POLL_WAIT_S || 25);
+const JOB_TIMEOUT_MS = Number(process.env.AI_JOB_TIMEOUT_MS || 15 * 60 * 1000);
+// Generations at least this long (or explicitly offline ones) go through the job queue
+const JOB_MIN_NEW_TOKENS = Number(process.env.AI_JOB_MIN_NEW_TOKENS || 1024);
+
+const usesJob = (options) =>
+    Boolean(options.offline) || (Number(options.maxNewTokens) || 0) >= JOB_MIN_NEW_TOKENS;
+
+// Submit the dream as an async job and long-poll until it finishes, so long generations
+// are not cut off by HTTP timeouts between the backend and the AI service
+const runInterpretJob = async (params) => {
+    const { data: job } = await axios.post(`${AI_SERVICE_URL}/jobs`, params);
+    const deadline = Date.now() + JOB_TIMEOUT_MS;
+    while (Date.now() < deadline) {
+        const { data } = await axios.get(`${AI_SERVICE_URL}/jobs/${job.job_id}`, {
+            params: { wait: JOB_POLL_WAIT_S },
+            timeout: (JOB_POLL_WAIT_S + 10) * 1000,
+        });
+        if (data.status === 'done') {
+            return data.result.interpretation;
+        }
+        if (data.status === 'failed') {
+            throw new Error(`AI job ${job.job_id} failed: ${data.error}`);
+        }
+    }
+    throw new Error(`AI job ${job.job_id} did not finish within ${JOB_TIMEOUT_MS} ms`);
+};
+
 // Function to call the Python AI Service
-const interpretDream = async (text) => {
+const interpretDream = async (text, options = {}) => {
+    const params = { text };
+    if (options.maxNewTokens) {
+        params.max_new_tokens = Number(options.maxNewTokens);
+    }
     try {
-        // Attempt to call the AI service
+        if (usesJob(options)) {
+            console.log(`Calling AI service at ${AI_SERVICE_URL}/jobs`);
+            return await runInterpretJob(params);
+        }
+        // Interactive requests stay on /interpret so they pass admission control
+        // and share the batching engine with other requests
         console.log(`Calling AI service at ${AI_SERVICE_URL}/interpret`);
-        const response = await axios.post(`${AI_SERVICE_URL}/interpret`, { text });
+        const response = await axios.post(`${AI_SERVICE_URL}/interpret`, params);
         return response.data.interpretation;
     } catch (error) {
         console.error('AI Service Error:', error.message);
@@ -24,16 +61,34 @@ const interpretDream = async (text) => {
 
 router.post('/interpret', async (req, res) => {
   try {
-    const { dreamText } = req.body;
+    const { dreamText, maxNewTokens, offline } = req.body;
     if (!dreamText) {
         return res.status(400).json({ error: 'dreamText is required' });
     }
     
-    const interpretation = await interpretDream(dreamText);
+    const interpretation = await interpretDream(dreamText, { maxNewTokens, offline });
     res.json({ success: true, interpretation });
   } catch (error) {
     res.status(500).json({ error: error.message });
   }
 });
 
+router.post('/interpret/batch', async (req, res) => {
+  try {
+    const { dreams } = req.body;
+    if (!Array.isArray(dreams) || dreams.length === 0) {
+        return res.status(400).json({ error: 'dreams must be a non-empty array' });
+    }
+
+    // One request for the whole batch so the AI service can generate the dreams together
+    const response = await axios.post(`${AI_SERVICE_URL}/interpret/batch`, {
+        items: dreams.map((dream) => (typeof dream === 'string' ? { text: dream } : dream)),
+    });
+    res.json({ success: true, ...response.data });
+  } catch (error) {
+    const status = error.response ? error.response.status : 502;
+    res.status(status).json({ error: error.response ? error.response.data.error : error.message });
+  }
+});
+
 module.exports = router;